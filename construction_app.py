@@ -1,19 +1,38 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
+import numpy as np
 import time
 import os
 import logging
 import json
+import re
 import base64
+import hashlib
+import heapq
+import random
+import shutil
+import string
+import tempfile
+import threading
+import tracemalloc
+import uuid
+import zlib
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from pathlib import Path
 from io import BytesIO
+from urllib.parse import quote
 
 # INTENTO DE IMPORTAR LIBRERÍAS DE GOOGLE CLOUD
 try:
     from google.cloud import firestore
     from google.cloud import storage
     from google.oauth2 import service_account
+    import requests
     import json
     GCP_LIB_AVAILABLE = True
 except ImportError:
@@ -34,6 +53,12 @@ except ImportError:
     PIL_AVAILABLE = False
     st.warning("⚠️ PIL no disponible. Las imágenes no se comprimirán. Instala con: pip install Pillow")
 
+from image_service import (
+    DEFAULT_PHOTO_FORMAT, PHOTO_FORMATS, PHOTO_VARIANTS, PHOTO_VARIANT_QUALITY,
+    compress_image_with_stats, extract_photo_metadata, make_photo_variants, process_photo, to_rgb, transcode_image,
+)
+from plan_metadata import PYPDF_AVAILABLE, extract_plan_metadata, summarize_plan_metadata
+
 # --- CONFIGURACIÓN DE LOGGING ---
 logging.basicConfig(
     level=logging.INFO,
@@ -1041,17 +1066,167 @@ MAX_FILE_SIZE_MB = 50
 MAX_IMAGE_SIZE_MB = 10
 ALLOWED_FILE_TYPES = ['.pdf', '.dwg', '.dwgx', '.dxf']
 ALLOWED_IMAGE_TYPES = ['.jpg', '.jpeg', '.png', '.webp']
+FILE_EXTENSION_KINDS = {
+    '.pdf': 'pdf', '.dwg': 'dwg', '.dwgx': 'dwg', '.dxf': 'dxf',
+    '.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.webp': 'webp',
+}
+FILE_SNIFF_BYTES = 1024
+IMAGE_CONTENT_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp'}
 UPLOAD_DIR = Path("uploads")
 PHOTOS_DIR = Path("uploads/photos")
 DOCS_DIR = Path("uploads/docs")
+BLOBS_DIR = Path("uploads/blobs")
 DATA_DIR = Path("data")
 DB_FILE = DATA_DIR / "database.json"
+OUTBOX_DIR = DATA_DIR / "outbox"
+BLOB_INDEX_FILE = DATA_DIR / "blob_index.json"
+PHOTO_INDEX_FILE = DATA_DIR / "photo_index.jsonl"
+BLOB_CACHE_DIR = DATA_DIR / "cache" / "blobs"
+BLOB_CACHE_MAX_MB = 512
+BLOB_CACHE_GENERATION_TTL_SECONDS = 300  # Cada cuánto se revalida la generación de un objeto mutable de GCS
+# Streamlit sirve static/ junto al script (server.enableStaticServing) bajo app/static/
+STATIC_FILES_DIR = Path(__file__).parent / "static" / "files"
+STATIC_FILES_URL = "app/static/files"
+FILE_LINK_TTL_MINUTES = 15
+FILE_LINK_PRUNE_SECONDS = 60  # Cada cuánto el hilo de limpieza borra los enlaces locales vencidos
+DOC_VERSIONS_FILE = DATA_DIR / "document_versions.json"
+DOC_REVISIONS_DIR = DATA_DIR / "cache" / "revisions"  # Revisiones antiguas reconstruidas a pedido
+DELTA_DOCUMENT_TYPES = ['.pdf', '.dwg', '.dwgx', '.dxf']
+CDC_MIN_CHUNK = 4 * 1024
+CDC_AVG_BITS = 14  # Corte esperado cada 2^14 bytes (~16 KB) sobre el mínimo
+CDC_MAX_CHUNK = 64 * 1024
+CDC_BLOCK_SIZE = 4 * 1024 * 1024  # El hash se calcula por bloques para acotar la memoria temporal
+PLAN_METADATA_FILE = DATA_DIR / "plan_metadata.json"
+PLAN_METADATA_WORKERS = 2
+PLAN_METADATA_FAILURE_LOG = 10
+KPI_AGGREGATES_VERSION = 1  # Subirla si cambia la forma de los acumulados: se reconstruyen al leerlos
+# Acumulados de inspecciones y documentos: en modo local esos registros viven en la sesión, y sus conteos también
+RECORD_KPI_KEYS = ("inspections", "inspections_approved", "docs", "docs_pending")
+IMPROVEMENT_PENDING_STATES = ("Pendiente", "En Evaluación")
+# Reglas de alerta como datos: cada regla ("rule") lista sus niveles del más grave al menos grave y
+# se dispara el primero cuyas condiciones (métrica, operador, umbral) se cumplen todas.
+# Las métricas son las de compute_kpis más schedule_gap (presupuesto ejecutado % - avance físico %).
+ALERT_RULES_VERSION = 2  # Subirla al cambiar ALERT_RULES: se re-evalúan todos los proyectos
+ALERT_RULES = [
+    {"rule": "cronograma", "severity": "critical", "title": "CRÍTICO",
+     "when": [("schedule_gap", ">", 15), ("physical_progress", ">", 0)],
+     "message": "El avance físico está significativamente por debajo del avance financiero. Revisa el cronograma y prioriza actividades críticas."},
+    {"rule": "cronograma", "severity": "warning", "title": "ATENCIÓN",
+     "when": [("schedule_gap", ">", 7)],
+     "message": "El avance físico está algo rezagado respecto al presupuesto ejecutado."},
+    {"rule": "presupuesto", "severity": "critical", "title": "CRÍTICO",
+     "when": [("budget_percent", ">=", 95)],
+     "message": "El proyecto ha ejecutado ≥95% del presupuesto. Revisa sobrecostos y posibles ajustes."},
+    {"rule": "presupuesto", "severity": "warning", "title": "IMPORTANTE",
+     "when": [("budget_percent", ">=", 85)],
+     "message": "El proyecto ha ejecutado más del 85% del presupuesto."},
+    {"rule": "calidad", "severity": "critical", "title": "CRÍTICO",
+     "when": [("total_inspections", ">", 0), ("qa_approval_rate", "<", 75)],
+     "message": "Solo el {qa_approval_rate:.1f}% de las inspecciones fueron aprobadas. Revisa las no conformidades más frecuentes."},
+    {"rule": "calidad", "severity": "warning", "title": "ATENCIÓN",
+     "when": [("total_inspections", ">", 0), ("qa_approval_rate", "<", 90)],
+     "message": "Tasa de aprobación de inspecciones {qa_approval_rate:.1f}%. Revisa observaciones frecuentes."},
+    {"rule": "calidad", "severity": "success", "title": "CALIDAD",
+     "when": [("total_inspections", ">", 0)],
+     "message": "{qa_approval_rate:.1f}% de inspecciones aprobadas."},
+    {"rule": "documentos", "severity": "warning", "title": "DOCUMENTOS",
+     "when": [("pending_docs", ">", 0)],
+     "message": "Hay {pending_docs:.0f} documentos pendientes de aprobación."},
+    {"rule": "mejoras", "severity": "warning", "title": "MEJORAS",
+     "when": [("pending_improvements", ">", 0)],
+     "message": "{pending_improvements:.0f} mejoras o incidencias requieren revisión."},
+    {"rule": "mejoras", "severity": "success", "title": "MEJORAS",
+     "when": [("total_improvements", ">", 0)],
+     "message": "Todas las mejoras registradas han sido atendidas."},
+    {"rule": "asistencia", "severity": "critical", "title": "ASISTENCIA",
+     "when": [("total_personnel", ">", 0), ("attendance_percent", "<", 75)],
+     "message": "Asistencia estimada baja ({attendance_percent:.1f}%). Puede afectar productividad."},
+    {"rule": "asistencia", "severity": "warning", "title": "ASISTENCIA",
+     "when": [("total_personnel", ">", 0), ("attendance_percent", "<", 90)],
+     "message": "Asistencia estimada {attendance_percent:.1f}%. Monitorea ausencias y rotación."},
+    {"rule": "asistencia", "severity": "success", "title": "ASISTENCIA",
+     "when": [("total_personnel", ">", 0)],
+     "message": "Buena asistencia estimada ({attendance_percent:.1f}%)."},
+    {"rule": "sin_actividades", "severity": "info", "title": "INFO",
+     "when": [("total_activities", "==", 0)],
+     "message": "Aún no hay actividades registradas. Usa la sección 'Gestión de Información'."},
+    {"rule": "sin_personal", "severity": "info", "title": "INFO",
+     "when": [("total_personnel", "==", 0)],
+     "message": "No hay personal registrado para el proyecto actual."},
+    {"rule": "sin_documentos", "severity": "info", "title": "INFO",
+     "when": [("total_docs", "==", 0)],
+     "message": "No hay planos/documentos registrados aún."},
+]
+ALERT_SEVERITY_ICONS = {"critical": "🔴", "warning": "🟡", "success": "🟢", "info": "🔵"}
+ALERT_PERSISTED_SEVERITIES = ("critical", "warning")  # Solo estas quedan en la colección de alertas
+ALERT_COOLDOWN_HOURS = 24  # Una misma regla y nivel no se vuelve a registrar antes de este plazo
+FRAME_CACHE_MAX_ENTRIES = 64
+FRAME_CACHE_MAX_MB = 64
+# Tipos por colección para los DataFrames en caché
+FRAME_SCHEMAS = {
+    "activities": {"numeric": ["avance", "peso", "presupuesto", "costo_real"], "datetime": ["created_at"]},
+    "personnel": {"datetime": ["created_at"]},
+    "improvements": {"datetime": ["created_at", "updated_at"]},
+    "milestones": {"datetime": ["created_at"]},
+    "risks": {"numeric": ["score"], "datetime": ["created_at"]},
+    "alerts": {"datetime": ["created_at", "resolved_at"]},
+    "inspections": {"datetime": ["Timestamp"]},
+    "docs": {"integer": ["Revisión", "Tamaño_Bytes"], "datetime": ["Timestamp"]},
+}
+OUTBOX_POLL_SECONDS = 5
+OUTBOX_BASE_BACKOFF_SECONDS = 5
+OUTBOX_MAX_BACKOFF_SECONDS = 600
+UPLOAD_WORKERS = 3
+UPLOAD_QUEUE_SIZE = 12
+UPLOAD_POLL_SECONDS = 2
+UPLOAD_JOB_RETENTION_MINUTES = 60
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB por bloque en disco
+GCS_CHUNK_SIZE = 8 * 1024 * 1024  # Debe ser múltiplo de 256 KiB (protocolo resumable de GCS)
+GCS_CHUNK_RETRIES = 3
+PHOTO_OUTPUT_FORMAT = DEFAULT_PHOTO_FORMAT  # "webp" o "jpeg"; los clientes sin WebP reciben JPEG
+GALLERY_PAGE_SIZE = 9
+GALLERY_THUMB_WIDTH = 160  # Ancho de columna de la galería en móvil (px CSS)
+# Intervalos de actualización automática de los paneles en vivo del dashboard (0 = desactivada)
+DASHBOARD_REFRESH_OPTIONS = {0: "Desactivada", 30: "Cada 30 s", 60: "Cada minuto", 300: "Cada 5 minutos"}
+DASHBOARD_REFRESH_DEFAULT_SECONDS = 60
+S_CURVE_CACHE_ENTRIES = 64  # Curvas S memorizadas (proyecto, revisión de actividades, día, frecuencia)
+EVM_VERSION = 2  # Subirla si cambia el cálculo de valor ganado: los índices guardados se recalculan al leerlos
+EVM_HISTORY_MAX_POINTS = 730  # Puntos diarios de la serie de valor ganado por proyecto (~2 años)
+EVM_FIELDS = ("bac", "pv", "ev", "ac", "cv", "sv", "cpi", "spi", "eac", "etc", "vac")
+SCHEDULE_CACHE_MAX_PROJECTS = 32  # Redes de ruta crítica en memoria (una por proyecto, LRU)
+# Simulación Monte Carlo de plazo y costo
+MONTE_CARLO_ITERATIONS = 20000
+MONTE_CARLO_CELL_BUDGET = 4_000_000  # Actividades x iteraciones por bloque (acota la memoria de la simulación)
+MONTE_CARLO_CACHE_ENTRIES = 32
+MONTE_CARLO_RETRY_SECONDS = 300  # Una simulación que falló no se reintenta para la misma clave antes de este plazo
+MONTE_CARLO_DURATION_FACTORS = (0.9, 1.0, 1.4)  # Triangular (optimista, más probable, pesimista) sobre el trabajo pendiente
+MONTE_CARLO_COST_FACTORS = (0.95, 1.0, 1.2)  # Ídem sobre el presupuesto por ejecutar (BAC - EV)
+MONTE_CARLO_PERCENTILES = (10, 50, 80, 90)
+RISK_PROBABILITIES = {"Baja": 0.1, "Media": 0.3, "Alta": 0.6}
+# Impacto por nivel cuando el riesgo no trae valores propios: días de atraso y fracción del presupuesto
+RISK_IMPACT_DAYS = {"Bajo": 2, "Medio": 7, "Alto": 20, "Crítico": 45}
+RISK_IMPACT_COST_SHARE = {"Bajo": 0.005, "Medio": 0.02, "Alto": 0.05, "Crítico": 0.1}
+# Orden de la vista de portafolio: etiqueta -> (columna, ascendente)
+PORTFOLIO_SORTS = {
+    "Desfase financiero vs físico": ("schedule_gap", False),
+    "Avance físico": ("physical_progress", False),
+    "Avance financiero": ("budget_percent", False),
+    "Calidad (menor primero)": ("qa_approval_rate", True),
+    "Documentos pendientes": ("pending_docs", False),
+    "Riesgos altos": ("high_risks", False),
+    "Nombre": ("name", True),
+}
+IMAGE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+IMAGE_QUEUE_SIZE = 32
+DISPLAY_PIXEL_RATIO = 2  # Pantallas móviles de alta densidad: 300px de columna ≈ 600px reales
 
 # Crear directorios si no existen
 UPLOAD_DIR.mkdir(exist_ok=True)
 PHOTOS_DIR.mkdir(exist_ok=True)
 DOCS_DIR.mkdir(exist_ok=True)
+BLOBS_DIR.mkdir(exist_ok=True)
 DATA_DIR.mkdir(exist_ok=True)
+OUTBOX_DIR.mkdir(exist_ok=True)
 
 # --- UTILIDADES ---
 
@@ -1075,53 +1250,45 @@ def validate_file(file, max_size_mb: int, allowed_types: list) -> tuple[bool, st
     """Valida un archivo subido"""
     if file is None:
         return False, "No se proporcionó ningún archivo"
-    
+    return validate_ingested(ingest_upload(file), max_size_mb, allowed_types)
+
+def validate_ingested(ingested: dict, max_size_mb: int, allowed_types: list) -> tuple[bool, str]:
+    """Valida tamaño, extensión y tipo real (magic bytes) de un archivo ya inspeccionado"""
     # Validar tamaño
-    file_size_mb = len(file.getvalue()) / (1024 * 1024)
+    file_size_mb = ingested["size"] / (1024 * 1024)
     if file_size_mb > max_size_mb:
         return False, f"El archivo excede el tamaño máximo de {max_size_mb}MB"
     
     # Validar tipo
-    file_ext = Path(file.name).suffix.lower()
+    file_ext = ingested["ext"]
     if file_ext not in allowed_types:
         return False, f"Tipo de archivo no permitido. Permitidos: {', '.join(allowed_types)}"
     
+    # Validar contenido: la extensión debe coincidir con la firma del archivo
+    if ingested["kind"] != FILE_EXTENSION_KINDS.get(file_ext):
+        return False, f"El contenido del archivo no corresponde a un {file_ext}"
+    
     return True, "OK"
 
-def compress_image(image_bytes: bytes, max_size_kb: int = 500) -> bytes:
-    """Comprime una imagen manteniendo calidad razonable"""
+@st.cache_data(max_entries=16, show_spinner=False)
+def make_display_preview(image_bytes: bytes, display_width: int) -> bytes:
+    """Versión reducida de una foto recién capturada, solo para la vista previa"""
     if not PIL_AVAILABLE:
         return image_bytes
-    
     try:
         img = Image.open(BytesIO(image_bytes))
-        
-        # Convertir a RGB si es necesario
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = background
-        
-        # Calcular calidad inicial
-        quality = 85
+        edge = display_width * DISPLAY_PIXEL_RATIO
+        if max(img.size) <= edge:
+            return image_bytes
+        if img.format == 'JPEG':
+            img.draft('RGB', (edge, edge))
+        img = to_rgb(img)
+        img.thumbnail((edge, edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
         output = BytesIO()
-        
-        # Comprimir hasta alcanzar el tamaño deseado
-        while quality > 20:
-            output.seek(0)
-            output.truncate(0)
-            img.save(output, format='JPEG', quality=quality, optimize=True)
-            size_kb = len(output.getvalue()) / 1024
-            
-            if size_kb <= max_size_kb:
-                break
-            quality -= 10
-        
+        img.save(output, format='JPEG', quality=PHOTO_VARIANT_QUALITY)
         return output.getvalue()
     except Exception as e:
-        logger.error(f"Error comprimiendo imagen: {e}")
+        logger.warning(f"Error generando vista previa: {e}")
         return image_bytes
 
 def check_session_timeout() -> bool:
@@ -1305,220 +1472,2837 @@ def get_default_project_data():
             }
         },
         "milestones": [],
-        "alerts": []
+        "alerts": [],
+        "kpi_aggregates": get_default_kpi_aggregates()
     }
 
-# --- GESTOR DE DATOS ---
+def get_default_kpi_aggregates():
+    """Acumulados de KPIs de un proyecto sin registros"""
+    return {
+        "version": KPI_AGGREGATES_VERSION,
+        "activities": 0, "avance_count": 0, "avance_sum": 0.0,
+        "personnel": 0, "personnel_active": 0,
+        "inspections": 0, "inspections_approved": 0,
+        "docs": 0, "docs_pending": 0,
+        "improvements": 0, "improvements_pending": 0,
+        "updated_at": None,
+    }
 
-class DataManager:
-    def __init__(self):
-        self.use_gcp = False
-        self.db = None
+def kpi_contribution(kind: str, record: dict) -> dict:
+    """Aporte de un registro a los acumulados de KPIs (se suma al crearlo y se resta al reemplazarlo)"""
+    if kind == "activity":
+        avance = record.get("avance")
+        has_avance = isinstance(avance, (int, float)) and not pd.isna(avance)
+        return {"activities": 1, "avance_count": int(has_avance), "avance_sum": float(avance) if has_avance else 0.0}
+    if kind == "personnel":
+        return {"personnel": 1, "personnel_active": int(record.get("estado", "Activo") == "Activo")}
+    if kind == "inspection":
+        return {"inspections": 1, "inspections_approved": int(record.get("Resultado") == "Aprobado")}
+    if kind == "document":
+        return {"docs": 1, "docs_pending": int(record.get("Estado") != "Aprobado")}
+    if kind == "improvement":
+        return {"improvements": 1, "improvements_pending": int(record.get("status") in IMPROVEMENT_PENDING_STATES)}
+    raise ValueError(f"Tipo de registro sin KPIs: {kind}")
+
+def compute_kpis(aggregates: dict, budget: dict) -> dict:
+    """KPIs del dashboard a partir de los acumulados (O(1), sin recorrer colecciones)"""
+    budget_total = budget.get("total", 0)
+    budget_executed = budget.get("executed", 0)
+    return {
+        "physical_progress": aggregates["avance_sum"] / aggregates["avance_count"] if aggregates["avance_count"] else 0.0,
+        "budget_total": budget_total,
+        "budget_executed": budget_executed,
+        "budget_percent": (budget_executed / budget_total * 100) if budget_total > 0 else 0.0,
+        "attendance_percent": aggregates["personnel_active"] / aggregates["personnel"] * 100 if aggregates["personnel"] else 0.0,
+        "qa_approval_rate": aggregates["inspections_approved"] / aggregates["inspections"] * 100 if aggregates["inspections"] else 0.0,
+        "total_activities": aggregates["activities"],
+        "total_personnel": aggregates["personnel"],
+        "total_inspections": aggregates["inspections"],
+        "total_docs": aggregates["docs"],
+        "pending_docs": aggregates["docs_pending"],
+        "total_improvements": aggregates["improvements"],
+        "pending_improvements": aggregates["improvements_pending"],
+    }
+
+def compute_portfolio_kpis(frame: pd.DataFrame) -> pd.DataFrame:
+    """Versión columnar de compute_kpis: frame tiene una fila por proyecto con sus acumulados y presupuesto"""
+    def ratio(numerator: str, denominator: str) -> np.ndarray:
+        num, den = frame[numerator].to_numpy(dtype=float), frame[denominator].to_numpy(dtype=float)
+        return np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+    
+    result = pd.DataFrame(index=frame.index)
+    result["physical_progress"] = ratio("avance_sum", "avance_count")
+    result["budget_percent"] = ratio("budget_executed", "budget_total") * 100
+    result["schedule_gap"] = result["budget_percent"] - result["physical_progress"]
+    result["qa_approval_rate"] = ratio("inspections_approved", "inspections") * 100
+    result["attendance_percent"] = ratio("personnel_active", "personnel") * 100
+    result["budget_total"] = frame["budget_total"]
+    result["budget_executed"] = frame["budget_executed"]
+    result["total_activities"] = frame["activities"]
+    result["total_inspections"] = frame["inspections"]
+    result["total_docs"] = frame["docs"]
+    result["pending_docs"] = frame["docs_pending"]
+    result["pending_improvements"] = frame["improvements_pending"]
+    return result
+
+def write_json_atomic(path: Path, data) -> None:
+    """Escribe un JSON de forma atómica (archivo temporal + reemplazo)"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+def write_bytes_atomic(path: Path, data: bytes) -> None:
+    """Escribe bytes de forma atómica (archivo temporal + reemplazo)"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+# --- MOTOR DE REGLAS DE ALERTA ---
+
+ALERT_OPERATORS = (">", ">=", "<", "<=", "==")
+
+def compile_alert_rules(rules: list) -> dict:
+    """Aplana las condiciones de las reglas en arreglos para evaluarlas todas de una vez con NumPy"""
+    metrics = sorted({metric for rule in rules for metric, _, _ in rule["when"]})
+    conditions = [(j, metrics.index(metric), ALERT_OPERATORS.index(op), float(threshold))
+                  for j, rule in enumerate(rules) for metric, op, threshold in rule["when"]]
+    rule_idx = np.array([c[0] for c in conditions], dtype=np.intp)
+    # Condición x regla: una regla se cumple si no falla ninguna de sus condiciones
+    incidence = np.zeros((len(conditions), len(rules)), dtype=np.int32)
+    incidence[np.arange(len(conditions)), rule_idx] = 1
+    # Métricas que usa cada regla (condiciones y texto): solo esas reglas se re-evalúan si cambian
+    family_metrics = {}
+    for rule in rules:
+        used = {metric for metric, _, _ in rule["when"]}
+        used |= {field for _, field, _, _ in string.Formatter().parse(rule["message"]) if field}
+        family_metrics.setdefault(rule["rule"], set()).update(used)
+    return {
+        "rules": rules,
+        "metrics": metrics,
+        "metric_idx": np.array([c[1] for c in conditions], dtype=np.intp),
+        "op_idx": np.array([c[2] for c in conditions], dtype=np.intp),
+        "thresholds": np.array([c[3] for c in conditions], dtype=float),
+        "incidence": incidence,
+        "families": np.array([rule["rule"] for rule in rules]),
+        "family_metrics": family_metrics,
+    }
+
+COMPILED_ALERT_RULES = compile_alert_rules(ALERT_RULES)
+
+def alert_metrics_frame(kpis_by_project: dict) -> pd.DataFrame:
+    """Métricas de las reglas por proyecto (índice = project_id) a partir de compute_kpis"""
+    frame = pd.DataFrame.from_dict(kpis_by_project, orient="index", dtype=float)
+    if not frame.empty:
+        frame["schedule_gap"] = frame["budget_percent"] - frame["physical_progress"]
+    return frame
+
+def evaluate_alert_rules(metrics: pd.DataFrame, families: set | None = None) -> pd.DataFrame:
+    """Evalúa las reglas sobre todos los proyectos a la vez (una fila de metrics por proyecto).
+
+    Retorna una fila por proyecto y regla disparada con su nivel más grave; families
+    limita la evaluación a esas reglas (re-evaluación incremental).
+    """
+    compiled = COMPILED_ALERT_RULES
+    columns = ["project_id", "rule", "severity", "title", "message"]
+    if metrics.empty:
+        return pd.DataFrame(columns=columns)
+    operands = metrics.reindex(columns=compiled["metrics"]).to_numpy(dtype=float)[:, compiled["metric_idx"]]
+    op, thresholds = compiled["op_idx"], compiled["thresholds"]
+    passed = np.select(
+        [op == 0, op == 1, op == 2, op == 3],
+        [operands > thresholds, operands >= thresholds, operands < thresholds, operands <= thresholds],
+        default=operands == thresholds,
+    )
+    fired = ((~passed).astype(np.int32) @ compiled["incidence"]) == 0
+    if families is not None:
+        fired &= np.isin(compiled["families"], list(families))
+    # nonzero recorre proyecto por proyecto y regla por regla: el primer nivel de cada regla es el más grave
+    project_pos, rule_pos = np.nonzero(fired)
+    hits = pd.DataFrame({"project_id": metrics.index[project_pos], "rule": compiled["families"][rule_pos], "rule_pos": rule_pos})
+    hits = hits.drop_duplicates(["project_id", "rule"])
+    values = metrics.to_dict("index")
+    rows = []
+    for project_id, rule_pos in zip(hits["project_id"].tolist(), hits["rule_pos"].tolist()):
+        rule = compiled["rules"][rule_pos]
+        rows.append((project_id, rule["rule"], rule["severity"], rule["title"], rule["message"].format(**values[project_id])))
+    return pd.DataFrame(rows, columns=columns)
+
+# --- SUBIDA POR BLOQUES (STREAMING) ---
+
+class BufferReader:
+    """Lector tipo archivo sobre un memoryview: read() retorna vistas, nunca copias"""
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer)
+        self.size = self._buffer.nbytes
+        self._pos = 0
+
+    def read(self, n: int = -1) -> memoryview:
+        end = self.size if n is None or n < 0 else min(self._pos + n, self.size)
+        chunk = self._buffer[self._pos:end]
+        self._pos = end
+        return chunk
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: self.size}[whence]
+        self._pos = max(0, min(base + offset, self.size))
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+def sniff_file_type(header: bytes) -> str | None:
+    """Identifica el tipo real de un archivo por sus magic bytes"""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if b"%PDF-" in header:
+        return "pdf"
+    if header[:4] == b"AC10":  # Versión DWG: AC1012 ... AC1032
+        return "dwg"
+    if header.startswith(b"AutoCAD Binary DXF"):
+        return "dxf"
+    text = header.lstrip()
+    if (text.startswith(b"0") and b"SECTION" in text) or text.startswith(b"999"):
+        return "dxf"
+    return None
+
+def ingest_upload(file) -> dict:
+    """Inspecciona un archivo subido sin copiar su contenido.
+
+    Retorna tamaño, extensión, tipo real y un memoryview del buffer que se
+    entrega tal cual al almacenamiento. Se usa getvalue() y no getbuffer():
+    un BytesIO sin modificar comparte sus bytes (copy-on-write) y getvalue()
+    los retorna sin copiar, mientras que getbuffer() fuerza una copia completa.
+    """
+    buffer = memoryview(file.getvalue())
+    return {
+        "name": file.name,
+        "ext": Path(file.name).suffix.lower(),
+        "size": buffer.nbytes,
+        "kind": sniff_file_type(buffer[:FILE_SNIFF_BYTES].tobytes()),
+        "content_type": getattr(file, "type", None),
+        "buffer": buffer,
+    }
+
+def get_stream_size(source) -> int:
+    """Tamaño de un archivo en memoria sin copiar su contenido"""
+    size = getattr(source, "size", None)
+    if size is not None:
+        return size
+    position = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return size
+
+def hash_stream(source) -> tuple[str, int]:
+    """SHA-256 y tamaño de source leyendo por bloques desde el inicio"""
+    hasher = hashlib.sha256()
+    size = 0
+    source.seek(0)
+    for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+        hasher.update(chunk)
+        size += len(chunk)
+    source.seek(0)
+    return hasher.hexdigest(), size
+
+def stream_to_local(source, dest_path: Path, progress_cb=None) -> dict:
+    """Copia source a disco por bloques, calculando tamaño y SHA-256 en una sola lectura.
+
+    Escribe primero a un .part; si existe uno de un intento previo, retoma desde
+    su tamaño (re-hasheando lo ya escrito desde disco) en vez de empezar de cero.
+    """
+    part_path = dest_path.with_name(dest_path.name + ".part")
+    hasher = hashlib.sha256()
+    size = 0
+    if part_path.exists():
+        with open(part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+                size += len(chunk)
+        logger.info(f"Retomando escritura de {dest_path.name} desde {size} bytes")
+    source.seek(size)
+    with open(part_path, 'ab') as out:
+        for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+            if progress_cb:
+                progress_cb(size)
+    os.replace(part_path, dest_path)
+    return {"size": size, "sha256": hasher.hexdigest()}
+
+def _gcs_session_offset(session_url: str, total_size: int) -> int | None:
+    """Consulta cuántos bytes persistió GCS en una sesión resumable (None = ya completa)"""
+    response = requests.put(
+        session_url,
+        headers={"Content-Range": f"bytes */{total_size}", "Content-Length": "0"},
+        timeout=30,
+    )
+    if response.status_code in (200, 201):
+        return None
+    if response.status_code == 308:
+        received = response.headers.get("Range")  # Formato "bytes=0-N"
+        return int(received.split("-")[1]) + 1 if received else 0
+    response.raise_for_status()
+    raise RuntimeError(f"Respuesta inesperada de GCS: {response.status_code}")
+
+def stream_to_gcs(bucket, blob_name: str, source, content_type: str | None, session_url: str | None = None,
+                  progress_cb=None, session_cb=None) -> dict:
+    """Sube source a GCS con una sesión resumable, bloque a bloque, calculando SHA-256 al vuelo.
+
+    Si un bloque falla se consulta el offset confirmado por GCS y se reintenta
+    desde ahí. session_cb recibe la URL de sesión para poder retomarla más tarde
+    (por ejemplo desde el outbox tras un reinicio).
+    """
+    total_size = get_stream_size(source)
+    if session_url is None:
+        session_url = bucket.blob(blob_name).create_resumable_upload_session(content_type=content_type, size=total_size)
+        if session_cb:
+            session_cb(session_url)
+    
+    hasher = hashlib.sha256()
+    hashed_upto = 0
+
+    def advance_hash(new_offset, chunk=b"", chunk_start=0):
+        # Usa el bloque en mano si cubre el tramo; si no, relee solo lo que falta
+        nonlocal hashed_upto
+        if new_offset <= hashed_upto:
+            return
+        if chunk_start == hashed_upto and new_offset <= chunk_start + len(chunk):
+            hasher.update(memoryview(chunk)[:new_offset - chunk_start])
+        else:
+            source.seek(hashed_upto)
+            remaining = new_offset - hashed_upto
+            while remaining > 0:
+                piece = source.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                hasher.update(piece)
+                remaining -= len(piece)
+        hashed_upto = new_offset
+
+    offset = _gcs_session_offset(session_url, total_size)
+    if offset is None:
+        advance_hash(total_size)
+        return {"size": total_size, "sha256": hasher.hexdigest(), "session_url": session_url}
+    advance_hash(offset)
+    
+    failures = 0
+    while True:
+        source.seek(offset)
+        chunk = source.read(GCS_CHUNK_SIZE)
+        end = offset + len(chunk) - 1
+        try:
+            response = requests.put(
+                session_url,
+                data=bytes(chunk),
+                headers={"Content-Range": f"bytes {offset}-{end}/{total_size}"},
+                timeout=120,
+            )
+            if response.status_code in (200, 201):
+                advance_hash(total_size, chunk, offset)
+                if progress_cb:
+                    progress_cb(total_size)
+                return {"size": total_size, "sha256": hasher.hexdigest(), "session_url": session_url}
+            if response.status_code != 308:
+                response.raise_for_status()
+            received = response.headers.get("Range")  # Formato "bytes=0-N"
+            new_offset = int(received.split("-")[1]) + 1 if received else 0
+            advance_hash(new_offset, chunk, offset)
+            offset = new_offset
+            failures = 0
+            if progress_cb:
+                progress_cb(offset)
+        except Exception as e:
+            failures += 1
+            if failures > GCS_CHUNK_RETRIES:
+                raise
+            logger.warning(f"Bloque de {blob_name} falló ({e}); reintento {failures}/{GCS_CHUNK_RETRIES}")
+            time.sleep(2 ** failures)
+            offset = _gcs_session_offset(session_url, total_size)
+            if offset is None:
+                advance_hash(total_size)
+                return {"size": total_size, "sha256": hasher.hexdigest(), "session_url": session_url}
+            advance_hash(offset)
+
+# --- CACHÉ LOCAL DE BLOBS DE GCS ---
+
+def split_gcs_uri(uri: str) -> tuple[str, str]:
+    """Separa gs://bucket/objeto en (bucket, objeto)"""
+    if not uri.startswith("gs://") or uri.count("/") < 3:
+        raise ValueError(f"URI de GCS inválida: {uri}")
+    bucket_name, name = uri[len("gs://"):].split("/", 1)
+    return bucket_name, name
+
+class BlobCache:
+    """Caché de lectura en disco local para objetos gs://, acotado por tamaño con desalojo LRU.
+
+    La clave es URI + generación del objeto: si se sobrescribe en GCS cambia la
+    generación y la copia anterior deja de usarse hasta ser desalojada. Los blobs
+    direccionados por contenido (blobs/...) son inmutables y no consultan la
+    generación. Varias lecturas simultáneas del mismo objeto comparten una descarga.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
         self.bucket = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # clave -> (ruta, bytes), de menos a más recientemente usado
+        self._size = 0
+        self._inflight = {}
+        self._generations = {}  # uri -> (generación, instante de la consulta)
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "errors": 0,
+                       "hit_bytes": 0, "fetched_bytes": 0}
+        self._load()
+
+    def attach(self, bucket) -> None:
+        """Cliente de GCS con el que se descargan los objetos (también sirve otros buckets del mismo proyecto)"""
+        self.bucket = bucket
+
+    def get_path(self, uri: str, generation: int | None = None) -> Path:
+        """Ruta local de un objeto gs://, descargándolo si no está en caché (lanza la excepción si la descarga falla)"""
+        bucket_name, name = split_gcs_uri(uri)
+        if generation is None and not name.startswith("blobs/"):
+            generation = self._generation(uri, bucket_name, name)
+        key = hashlib.sha256(f"{uri}#{generation or 'cas'}".encode()).hexdigest()
+        while True:
+            with self._lock:
+                cached = self._entries.get(key)
+                if cached and cached[0].exists():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["hit_bytes"] += cached[1]
+                    os.utime(cached[0])  # El mtime conserva el orden LRU entre reinicios
+                    return cached[0]
+                if cached:
+                    self._drop(key)
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    self._inflight[key] = threading.Event()
+                    self._stats["misses"] += 1
+                    break
+                self._stats["coalesced"] += 1
+            # Otro hilo ya está descargando este objeto: se espera y se reintenta
+            waiter.wait()
         
-        if GCP_LIB_AVAILABLE:
+        path = self.root / key[:2] / f"{key}{Path(name).suffix}"
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.part")
+            blob = self._bucket(bucket_name).blob(name, generation=generation)
+            blob.download_to_filename(str(tmp_path))
+            os.replace(tmp_path, path)
+            size = path.stat().st_size
+            with self._lock:
+                self._entries[key] = (path, size)
+                self._size += size
+                self._stats["fetched_bytes"] += size
+                self._evict()
+            return path
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+    def get_bytes(self, uri: str, generation: int | None = None) -> bytes:
+        return self.get_path(uri, generation).read_bytes()
+
+    def clear(self) -> int:
+        """Vacía la caché; retorna los bytes liberados"""
+        with self._lock:
+            freed = self._size
+            for key in list(self._entries):
+                self._drop(key)
+            self._generations.clear()
+        return freed
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), cached_bytes=self._size, max_bytes=self.max_bytes)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _bucket(self, bucket_name: str):
+        if self.bucket is None:
+            raise RuntimeError("Cloud Storage no disponible")
+        return self.bucket if self.bucket.name == bucket_name else self.bucket.client.bucket(bucket_name)
+
+    def _generation(self, uri: str, bucket_name: str, name: str) -> int:
+        # Una consulta de metadatos (sin contenido) cada BLOB_CACHE_GENERATION_TTL_SECONDS por objeto
+        with self._lock:
+            known = self._generations.get(uri)
+        if known and time.monotonic() - known[1] < BLOB_CACHE_GENERATION_TTL_SECONDS:
+            return known[0]
+        blob = self._bucket(bucket_name).get_blob(name)
+        if blob is None:
+            raise FileNotFoundError(uri)
+        with self._lock:
+            self._generations[uri] = (blob.generation, time.monotonic())
+        return blob.generation
+
+    def _evict(self) -> None:
+        # Se conserva siempre la entrada recién agregada, aunque por sí sola exceda el límite
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def _drop(self, key: str) -> None:
+        path, size = self._entries.pop(key)
+        self._size -= size
+        path.unlink(missing_ok=True)
+
+    def _load(self) -> None:
+        # Reconstruye el orden LRU desde el disco (mtime) y limpia descargas interrumpidas
+        files = []
+        for path in self.root.glob("*/*"):
+            if path.name.endswith(".part"):
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._entries[path.name[:64]] = (path, size)
+            self._size += size
+        self._evict()
+
+@st.cache_resource
+def get_blob_cache() -> BlobCache:
+    """Instancia única de la caché de blobs por proceso"""
+    return BlobCache(BLOB_CACHE_DIR, BLOB_CACHE_MAX_MB * 1024 * 1024)
+
+def resolve_stored_path(path: str | None) -> Path | None:
+    """Ruta local legible de un archivo guardado: el propio archivo o su copia en caché si está en GCS"""
+    if not path:
+        return None
+    if path.startswith("gs://"):
+        try:
+            return get_blob_cache().get_path(path)
+        except Exception as e:
+            logger.warning(f"Error descargando {path}: {e}")
+            return None
+    local = Path(path)
+    return local if local.exists() else None
+
+# --- DESCARGAS DIRECTAS (URL FIRMADAS Y ARCHIVOS ESTÁTICOS) ---
+
+class FileServer:
+    """Enlaces de descarga que no pasan por el websocket ni por la memoria de Streamlit.
+
+    Objetos en GCS: URL firmada v4 de corta duración (el navegador descarga
+    directo desde GCS). Archivos locales: enlace duro (o copia) en
+    static/files/<token>/, que Streamlit sirve como archivo estático con soporte de
+    Range, así que las descargas grandes se pueden reanudar. Los enlaces vencen a
+    los FILE_LINK_TTL_MINUTES; como Streamlit los sirve sin pasar por la app, un
+    hilo en segundo plano ejecuta prune() cada FILE_LINK_PRUNE_SECONDS para
+    borrar sus archivos.
+    """
+
+    def __init__(self, static_root: Path, url_prefix: str, ttl: timedelta):
+        self.static_root = static_root
+        self.static_root.mkdir(parents=True, exist_ok=True)
+        self.url_prefix = url_prefix
+        self.ttl = ttl
+        self.bucket = None
+        self._lock = threading.Lock()
+        self._links = {}  # (ruta, nombre) -> {"url", "expires_at"}
+        self._stop = threading.Event()
+        self.prune()
+        self._worker = threading.Thread(target=self._run, name="file-server-prune", daemon=True)
+        self._worker.start()
+
+    def attach(self, bucket) -> None:
+        self.bucket = bucket
+
+    def url_for(self, path: str, filename: str | None = None) -> str | None:
+        """URL de descarga directa de un archivo guardado (None si no se puede servir sin pasar por la app).
+
+        Un mismo archivo reutiliza su enlace mientras le quede al menos la mitad de vigencia.
+        """
+        filename = filename or path.rsplit("/", 1)[-1]
+        key = (path, filename)
+        now = datetime.now()
+        with self._lock:
+            link = self._links.get(key)
+            if link and link["expires_at"] - now > self.ttl / 2:
+                return link["url"]
+        try:
+            url = self._sign(path, filename) if path.startswith("gs://") else self._publish(Path(path), filename)
+        except Exception as e:
+            logger.warning(f"No se pudo generar enlace directo para {path}: {e}")
+            return None
+        if url is None:
+            return None
+        with self._lock:
+            self._links[key] = {"url": url, "expires_at": now + self.ttl}
+        return url
+
+    def prune(self) -> int:
+        """Elimina los archivos publicados cuyo enlace ya venció; retorna cuántos directorios se borraron"""
+        cutoff = time.time() - self.ttl.total_seconds()
+        removed = 0
+        for token_dir in self.static_root.iterdir():
             try:
-                if "gcp_service_account" in st.secrets:
-                    creds_dict = dict(st.secrets["gcp_service_account"])
-                    creds = service_account.Credentials.from_service_account_info(creds_dict)
-                    self.db = firestore.Client(credentials=creds)
-                    
-                    # Inicializar bucket si está configurado
-                    if "gcp_bucket_name" in st.secrets:
-                        self.bucket = storage.Client(credentials=creds).bucket(st.secrets["gcp_bucket_name"])
-                    
-                    self.use_gcp = True
-                    logger.info("Conexión a GCP establecida correctamente")
+                if token_dir.stat().st_mtime < cutoff:
+                    shutil.rmtree(token_dir, ignore_errors=True)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        now = datetime.now()
+        with self._lock:
+            for key in [k for k, link in self._links.items() if link["expires_at"] <= now]:
+                del self._links[key]
+        return removed
+
+    def _run(self) -> None:
+        while not self._stop.wait(FILE_LINK_PRUNE_SECONDS):
+            try:
+                removed = self.prune()
+                if removed:
+                    logger.info(f"Enlaces de descarga: {removed} vencidos eliminados")
             except Exception as e:
-                logger.error(f"Error conectando a GCP: {e}")
-                self.use_gcp = False
-        
-        # Estado Local
-        if not self.use_gcp:
-            if 'local_docs' not in st.session_state:
-                st.session_state.local_docs = [
-                    {"Archivo": "Plano_Estructural.pdf", "Versión": "v4.2", "Fecha": "28 Nov", "Estado": "Aprobado"},
-                    {"Archivo": "Detalles_Sanitarios.dwg", "Versión": "v2.1", "Fecha": "27 Nov", "Estado": "Revisión"}
-                ]
-            if 'local_inspections' not in st.session_state:
-                st.session_state.local_inspections = [
-                    {"Fecha": "Hoy 10:30", "Actividad": "Recepción Enfierradura", "Auditor": "María Torres", "Resultado": "Aprobado"}
-                ]
+                logger.error(f"Error limpiando enlaces de descarga: {e}")
 
-    def save_inspection(self, data, photo=None):
-        """Guarda una inspección con foto opcional"""
+    def _sign(self, uri: str, filename: str) -> str | None:
+        if self.bucket is None:
+            return None
+        bucket_name, name = split_gcs_uri(uri)
+        bucket = self.bucket if self.bucket.name == bucket_name else self.bucket.client.bucket(bucket_name)
+        # La firma es local (clave de la cuenta de servicio): no hay llamada de red
+        return bucket.blob(name).generate_signed_url(
+            version="v4", expiration=self.ttl, method="GET",
+            response_disposition=f'attachment; filename="{filename}"',
+        )
+
+    def _publish(self, source: Path, filename: str) -> str | None:
+        if not st.get_option("server.enableStaticServing") or not source.exists():
+            return None
+        token = uuid.uuid4().hex
+        target = self.static_root / token / Path(filename).name
+        target.parent.mkdir()
         try:
-            # Procesar y guardar foto si existe
-            photo_path = None
-            if photo:
-                try:
-                    # Comprimir imagen
-                    photo_bytes = photo.getvalue()
-                    compressed_photo = compress_image(photo_bytes)
-                    
-                    # Generar nombre único
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    photo_filename = f"inspection_{timestamp}.jpg"
-                    
-                    if self.use_gcp and self.bucket:
-                        # Subir a Cloud Storage
-                        blob = self.bucket.blob(f"inspections/{photo_filename}")
-                        blob.upload_from_string(compressed_photo, content_type='image/jpeg')
-                        photo_path = f"gs://{self.bucket.name}/inspections/{photo_filename}"
-                        logger.info(f"Foto subida a GCS: {photo_path}")
-                    else:
-                        # Guardar localmente
-                        photo_path = PHOTOS_DIR / photo_filename
-                        photo_path.write_bytes(compressed_photo)
-                        photo_path = str(photo_path)
-                        logger.info(f"Foto guardada localmente: {photo_path}")
-                    
-                    data["Tiene_Foto"] = "Sí"
-                    data["Foto_Path"] = photo_path
-                except Exception as e:
-                    logger.error(f"Error guardando foto: {e}")
-                    data["Tiene_Foto"] = "Error"
-                    st.warning("La inspección se guardó pero hubo un error con la foto")
-            else:
-                data["Tiene_Foto"] = "No"
-            
-            # Agregar timestamp consistente
-            data["Timestamp"] = datetime.now().isoformat()
-            data["Fecha"] = format_date(datetime.now())
+            os.link(source, target)  # Sin copiar bytes cuando comparten sistema de archivos
+        except OSError:
+            shutil.copyfile(source, target)
+        return f"{self.url_prefix}/{token}/{quote(target.name)}"
 
-            if self.use_gcp:
+@st.cache_resource
+def get_file_server() -> FileServer:
+    """Instancia única del servidor de descargas por proceso"""
+    return FileServer(STATIC_FILES_DIR, STATIC_FILES_URL, timedelta(minutes=FILE_LINK_TTL_MINUTES))
+
+# --- ALMACÉN DE BLOBS DIRECCIONADO POR CONTENIDO ---
+
+class BlobStore:
+    """Almacén de archivos direccionado por contenido (SHA-256), común a los backends local y GCS.
+
+    Cada contenido se guarda una sola vez bajo su hash (blobs/ab/<sha256><ext>) y un
+    índice en disco lleva la cuenta de referencias: subir un duplicado solo cuesta
+    calcular el hash. Los blobs sin referencias se eliminan con collect_garbage().
+    """
+
+    def __init__(self, local_root: Path, index_path: Path):
+        self.local_root = local_root
+        self.local_root.mkdir(parents=True, exist_ok=True)
+        self.index_path = index_path
+        self.bucket = None
+        self.outbox = None
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._index = self._load_index()
+
+    def attach(self, bucket, outbox) -> None:
+        """Usa GCS como backend para los blobs nuevos (el outbox recibe las subidas fallidas)"""
+        self.bucket = bucket
+        self.outbox = outbox
+
+    def blob_name(self, sha256: str, ext: str) -> str:
+        return f"blobs/{sha256[:2]}/{sha256}{ext}"
+
+    def local_path(self, sha256: str, ext: str) -> Path:
+        return self.local_root / sha256[:2] / f"{sha256}{ext}"
+
+    def has_variants(self, sha256: str, ext: str) -> bool:
+        with self._lock:
+            entry = self._index.get(sha256)
+            return bool(entry) and all(f"{v}{ext}" in entry.get("variants", {}) for v in PHOTO_VARIANTS)
+
+    def put_variants(self, sha256: str, variants: dict, ext: str) -> None:
+        """Guarda los derivados de una foto junto al original (blobs/ab/<sha>.<variante><ext>)"""
+        with self._lock:
+            entry = self._index.get(sha256)
+        if entry is None or not variants:
+            return
+        content_type = IMAGE_CONTENT_TYPES.get(ext, 'application/octet-stream')
+        stored = {}
+        for variant, data in variants.items():
+            key = f"{variant}{ext}"
+            if entry["backend"] == "gcs":
+                blob_name = f"blobs/{sha256[:2]}/{sha256}.{key}"
                 try:
-                    self.db.collection("inspections").add(data)
-                    st.toast("Guardado en Nube", icon="☁️")
-                    logger.info("Inspección guardada en Firestore")
+                    self.bucket.blob(blob_name).upload_from_string(data, content_type=content_type)
                 except Exception as e:
-                    logger.error(f"Error guardando en Firestore: {e}")
-                    st.error("Error al guardar en la nube. Guardando localmente...")
-                    st.session_state.local_inspections.insert(0, data)
-                    st.toast("Guardado Localmente (fallback)", icon="💾")
+                    logger.error(f"Error subiendo derivado {blob_name}: {e}")
+                    self.outbox.enqueue_blob(blob_name, BytesIO(data), content_type)
             else:
-                st.session_state.local_inspections.insert(0, data)
-                st.toast("Guardado Localmente", icon="💾")
-                logger.info("Inspección guardada localmente")
-            
-            # Registrar en bitácora
-            self.add_audit_entry(
-                action="save_inspection",
-                entity_type="inspection",
-                entity_id=data.get("Actividad"),
-                details={"resultado": data.get("Resultado"), "tipo": data.get("Tipo")}
-            )
-        except Exception as e:
-            logger.error(f"Error en save_inspection: {e}")
-            st.error(f"Error al guardar la inspección: {str(e)}")
+                path = self.local_root / sha256[:2] / f"{sha256}.{key}"
+                path.parent.mkdir(exist_ok=True)
+                write_bytes_atomic(path, data)
+            stored[key] = len(data)
+        with self._lock:
+            if sha256 in self._index:
+                self._index[sha256].setdefault("variants", {}).update(stored)
+                self._save_index()
 
-    def get_inspections(self):
-        """Obtiene todas las inspecciones"""
+    def variant_path(self, path: str, display_width: int, accepted_formats: list) -> str:
+        """Ruta del derivado más pequeño que cubre display_width en un formato que el cliente acepta.
+
+        Si el cliente no decodifica el formato guardado (p. ej. WebP), se genera una
+        sola vez un derivado de respaldo en el primer formato aceptado.
+        """
+        sha256 = Path(path).name[:64]
+        with self._lock:
+            entry = self._index.get(sha256)
+        if entry is None:
+            return path
+        needed = display_width * DISPLAY_PIXEL_RATIO
+        tiers = sorted((edge, name) for name, edge in PHOTO_VARIANTS.items() if edge >= needed)
+        tier = tiers[0][1] if tiers else "full"
+        accepted_exts = [PHOTO_FORMATS[fmt]["ext"] for fmt in accepted_formats]
+        variants = entry.get("variants", {})
+        
+        if tier == "full" and (entry["ext"] in accepted_exts or entry["ext"] not in IMAGE_CONTENT_TYPES):
+            return path
+        for ext in accepted_exts:
+            if f"{tier}{ext}" in variants:
+                return self._stored_uri(sha256, entry, f"{sha256}.{tier}{ext}")
+        
+        # Respaldo: transcodificar desde el original (o el derivado del mismo tamaño) al formato aceptado
+        source_name = f"{sha256}{entry['ext']}" if tier == "full" else next(
+            (f"{sha256}.{key}" for key in variants if key.startswith(f"{tier}.")), None
+        )
+        if source_name is None:
+            return path
         try:
-            if self.use_gcp:
-                docs = self.db.collection("inspections").order_by("Timestamp", direction=firestore.Query.DESCENDING).limit(100).stream()
-                return [doc.to_dict() for doc in docs]
-            return st.session_state.local_inspections
+            fallback = get_image_service().submit(transcode_image, self._read(sha256, entry, source_name), accepted_formats[0]).result()
+            self.put_variants(sha256, {tier: fallback}, accepted_exts[0])
+            return self._stored_uri(sha256, entry, f"{sha256}.{tier}{accepted_exts[0]}")
         except Exception as e:
-            logger.error(f"Error obteniendo inspecciones: {e}")
-            st.error("Error al cargar inspecciones")
-            return st.session_state.local_inspections if 'local_inspections' in st.session_state else []
+            logger.warning(f"No se pudo generar derivado de respaldo para {sha256[:12]}: {e}")
+            return path
 
-    def upload_file(self, uploaded_file, metadata):
-        """Sube un archivo con validación"""
+    def put(self, source, ext: str, content_type: str | None = None, progress_cb=None, sha256: str | None = None) -> dict:
+        """Guarda source si su contenido aún no existe y suma una referencia.
+
+        sha256 evita recalcular el hash si quien llama ya lo tiene. Retorna sha256,
+        size, path, deduplicated y pending (subida a GCS encolada en el outbox).
+        """
+        if sha256 is None:
+            sha256, size = hash_stream(source)
+        else:
+            size = get_stream_size(source)
+        while True:
+            with self._lock:
+                entry = self._index.get(sha256)
+                waiter = self._inflight.get(sha256)
+                if entry and waiter is None and not self._is_missing(sha256, entry):
+                    entry["refs"] += 1
+                    entry["last_ref_at"] = datetime.now().isoformat()
+                    self._save_index()
+                    logger.info(f"Blob {sha256[:12]} deduplicado ({entry['refs']} referencias)")
+                    if progress_cb:
+                        progress_cb(size)
+                    return self._result(sha256, entry, deduplicated=True, pending=False)
+                if waiter is None:
+                    self._inflight[sha256] = threading.Event()
+                    new_entry = {
+                        "ext": entry["ext"] if entry else ext.lower(),
+                        "size": size,
+                        "content_type": content_type,
+                        "backend": "gcs" if self.bucket is not None else "local",
+                        "refs": entry["refs"] if entry else 0,
+                        "created_at": datetime.now().isoformat(),
+                    }
+                    break
+            # Otro hilo está escribiendo el mismo contenido: se espera y se reintenta
+            waiter.wait()
+        
         try:
-            # Validar archivo
-            is_valid, message = validate_file(uploaded_file, MAX_FILE_SIZE_MB, ALLOWED_FILE_TYPES)
-            if not is_valid:
-                st.error(message)
-                return False
-            
-            # Generar nombre único
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_ext = Path(uploaded_file.name).suffix
-            safe_filename = f"{timestamp}_{Path(uploaded_file.name).stem}{file_ext}"
-            
-            # Guardar archivo
-            file_path = None
-            if self.use_gcp and self.bucket:
-                try:
-                    blob = self.bucket.blob(f"docs/{safe_filename}")
-                    blob.upload_from_string(uploaded_file.getvalue(), content_type=uploaded_file.type)
-                    file_path = f"gs://{self.bucket.name}/docs/{safe_filename}"
-                    logger.info(f"Archivo subido a GCS: {file_path}")
-                except Exception as e:
-                    logger.error(f"Error subiendo a GCS: {e}")
-                    st.warning("Error subiendo a la nube. Guardando localmente...")
-                    file_path = DOCS_DIR / safe_filename
-                    file_path.write_bytes(uploaded_file.getvalue())
-                    file_path = str(file_path)
-            else:
-                file_path = DOCS_DIR / safe_filename
-                file_path.write_bytes(uploaded_file.getvalue())
-                file_path = str(file_path)
-                logger.info(f"Archivo guardado localmente: {file_path}")
-            
-            # Registrar en base de datos
-            new_doc = {
-                "Archivo": uploaded_file.name,
-                "Versión": metadata.get("version", "v1.0"),
-                "Fecha": datetime.now().strftime("%d/%m/%Y"),
-                "Estado": "Pendiente",
-                "File_Path": file_path,
-                "Timestamp": datetime.now().isoformat()
-            }
-            
-            if self.use_gcp:
+            pending = self._write(sha256, new_entry, source, progress_cb)
+            with self._lock:
+                new_entry["refs"] += 1
+                new_entry["last_ref_at"] = datetime.now().isoformat()
+                self._index[sha256] = new_entry
+                self._save_index()
+        finally:
+            with self._lock:
+                self._inflight.pop(sha256).set()
+        return self._result(sha256, new_entry, deduplicated=False, pending=pending)
+
+    def release(self, sha256: str) -> None:
+        """Resta una referencia; el blob se elimina en el próximo collect_garbage()"""
+        with self._lock:
+            entry = self._index.get(sha256)
+            if entry:
+                entry["refs"] = max(0, entry["refs"] - 1)
+                self._save_index()
+
+    def collect_garbage(self) -> dict:
+        """Elimina blobs sin referencias y archivos huérfanos del directorio local.
+
+        Los candidatos quedan marcados como en escritura (un put() del mismo contenido
+        espera) y se borran fuera del lock, porque en GCS cada borrado es una llamada de
+        red. Los huérfanos solo se barren si el índice cargó sin errores: con un índice
+        vacío por corrupción todos los archivos parecerían huérfanos.
+        """
+        with self._lock:
+            candidates = [(sha, dict(e)) for sha, e in self._index.items() if e["refs"] <= 0 and sha not in self._inflight]
+            for sha256, _ in candidates:
+                self._inflight[sha256] = threading.Event()
+        
+        deleted = []
+        try:
+            for sha256, entry in candidates:
                 try:
-                    self.db.collection("documents").add(new_doc)
+                    for name in self._stored_names(sha256, entry):
+                        if entry["backend"] == "gcs":
+                            if self.bucket is None:
+                                raise RuntimeError("Cloud Storage no disponible")
+                            blob = self.bucket.blob(f"blobs/{sha256[:2]}/{name}")
+                            if blob.exists():
+                                blob.delete()
+                        else:
+                            (self.local_root / sha256[:2] / name).unlink(missing_ok=True)
+                    deleted.append((sha256, entry))
                 except Exception as e:
-                    logger.error(f"Error guardando documento en Firestore: {e}")
-                    if 'local_docs' not in st.session_state:
-                        st.session_state.local_docs = []
-                    st.session_state.local_docs.insert(0, new_doc)
-            else:
-                if 'local_docs' not in st.session_state:
-                    st.session_state.local_docs = []
-                st.session_state.local_docs.insert(0, new_doc)
-            
-            st.toast("Archivo registrado", icon="📂")
-            # Registrar en bitácora
-            self.add_audit_entry(
-                action="upload_file",
-                entity_type="document",
-                entity_id=new_doc.get("Archivo"),
-                details={"version": new_doc.get("Versión"), "estado": new_doc.get("Estado")}
-            )
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error en upload_file: {e}")
-            st.error(f"Error al subir archivo: {str(e)}")
-            return False
+                    logger.warning(f"No se pudo eliminar el blob {sha256[:12]}: {e}")
+        finally:
+            with self._lock:
+                removed = 0
+                freed = 0
+                for sha256, entry in deleted:
+                    self._index.pop(sha256, None)
+                    removed += 1
+                    freed += entry["size"] + sum(entry.get("variants", {}).values())
+                for sha256, _ in candidates:
+                    self._inflight.pop(sha256).set()
+                
+                if self._index_clean:
+                    known = {
+                        self.local_root / sha[:2] / name
+                        for sha, e in self._index.items() if e["backend"] == "local"
+                        for name in self._stored_names(sha, e)
+                    }
+                    for path in self.local_root.glob("*/*"):
+                        if path in known or path.name[:64] in self._inflight:
+                            continue
+                        freed += path.stat().st_size
+                        path.unlink(missing_ok=True)
+                        removed += 1
+                else:
+                    logger.warning("GC de blobs: el índice no cargó correctamente, no se eliminan archivos huérfanos")
+                self._save_index()
+        logger.info(f"GC de blobs: {removed} eliminados, {freed} bytes liberados")
+        return {"removed": removed, "freed_bytes": freed}
 
-    def get_docs(self):
-        """Obtiene todos los documentos"""
-        try:
-            if self.use_gcp:
-                docs = self.db.collection("documents").order_by("Timestamp", direction=firestore.Query.DESCENDING).limit(100).stream()
-                return [doc.to_dict() for doc in docs]
-            return st.session_state.local_docs
-        except Exception as e:
-            logger.error(f"Error obteniendo documentos: {e}")
-            return st.session_state.local_docs if 'local_docs' in st.session_state else []
-    
-    # --- MÉTODOS PARA GESTIÓN DE PROYECTOS Y DATOS ---
-    
-    def get_db(self):
-        """Obtiene la base de datos completa"""
-        if self.use_gcp:
-            # En GCP se obtendría de Firestore
-            return get_default_db()
-        if 'json_db' not in st.session_state:
-            st.session_state.json_db = load_json_db()
-        return st.session_state.json_db
-    
-    def save_db(self, db_data):
+    def stats(self) -> dict:
+        """Resumen del almacén: blobs únicos, referencias y bytes ahorrados por deduplicación"""
+        with self._lock:
+            entries = list(self._index.values())
+        stored = sum(e["size"] for e in entries)
+        logical = sum(e["size"] * e["refs"] for e in entries)
+        return {
+            "blobs": len(entries),
+            "refs": sum(e["refs"] for e in entries),
+            "unreferenced": sum(1 for e in entries if e["refs"] <= 0),
+            "stored_bytes": stored,
+            "saved_bytes": max(0, logical - stored),
+        }
+
+    def _write(self, sha256: str, entry: dict, source, progress_cb) -> bool:
+        if entry["backend"] == "gcs":
+            blob_name = self.blob_name(sha256, entry["ext"])
+            session = {}
+            try:
+                if self.bucket.blob(blob_name).exists():
+                    return False  # Otra instancia ya subió este contenido
+                stream_to_gcs(
+                    self.bucket, blob_name, source, entry["content_type"],
+                    progress_cb=progress_cb,
+                    session_cb=lambda url: session.update(url=url),
+                )
+                logger.info(f"Blob subido a GCS: {blob_name}")
+                return False
+            except Exception as e:
+                logger.error(f"Error subiendo blob a GCS: {e}")
+                # El outbox retoma la misma sesión resumable: no se re-suben los bytes ya confirmados
+                self.outbox.enqueue_blob(blob_name, source, entry["content_type"], session_url=session.get("url"))
+                return True
+        
+        path = self.local_path(sha256, entry["ext"])
+        path.parent.mkdir(exist_ok=True)
+        stream_to_local(source, path, progress_cb=progress_cb)
+        logger.info(f"Blob guardado localmente: {path}")
+        return False
+
+    def _stored_names(self, sha256: str, entry: dict) -> list:
+        return [f"{sha256}{entry['ext']}"] + [f"{sha256}.{key}" for key in entry.get("variants", {})]
+
+    def _stored_uri(self, sha256: str, entry: dict, name: str) -> str:
+        if entry["backend"] == "gcs":
+            return f"gs://{self.bucket.name}/blobs/{sha256[:2]}/{name}"
+        return str(self.local_root / sha256[:2] / name)
+
+    def _read(self, sha256: str, entry: dict, name: str) -> bytes:
+        if entry["backend"] == "gcs":
+            return get_blob_cache().get_bytes(self._stored_uri(sha256, entry, name))
+        return (self.local_root / sha256[:2] / name).read_bytes()
+
+    def _is_missing(self, sha256: str, entry: dict) -> bool:
+        # Solo se verifica en disco local; en GCS sería una llamada de red bajo el lock
+        return entry["backend"] == "local" and not self.local_path(sha256, entry["ext"]).exists()
+
+    def _result(self, sha256: str, entry: dict, deduplicated: bool, pending: bool) -> dict:
+        if entry["backend"] == "gcs":
+            path = f"gs://{self.bucket.name}/{self.blob_name(sha256, entry['ext'])}"
+        else:
+            path = str(self.local_path(sha256, entry["ext"]))
+        return {"sha256": sha256, "size": entry["size"], "path": path, "deduplicated": deduplicated, "pending": pending}
+
+    def _load_index(self) -> dict:
+        """Carga el índice; _index_clean indica si refleja lo que hay en disco (habilita barrer huérfanos)"""
+        self._index_clean = False
+        if self.index_path.exists():
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                self._index_clean = True
+                return index
+            except Exception as e:
+                logger.error(f"Error cargando índice de blobs: {e}")
+            return {}
+        # Sin índice solo es seguro barrer si tampoco hay blobs guardados
+        self._index_clean = not any(self.local_root.glob("*/*"))
+        return {}
+
+    def _save_index(self) -> None:
+        write_json_atomic(self.index_path, self._index)
+
+@st.cache_resource
+def get_blob_store() -> BlobStore:
+    """Instancia única del almacén de blobs por proceso"""
+    return BlobStore(BLOBS_DIR, BLOB_INDEX_FILE)
+
+def image_extension(image_bytes: bytes) -> str:
+    """Extensión según el tipo real (magic bytes) de una imagen"""
+    kind = sniff_file_type(bytes(image_bytes[:FILE_SNIFF_BYTES]))
+    return {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}.get(kind, ".bin")
+
+def store_photo_variants(blob_result: dict, image_bytes: bytes) -> None:
+    """Genera (en el pool de imágenes) y guarda los derivados small/medium de una foto, una sola vez por contenido"""
+    blobs = get_blob_store()
+    ext = PHOTO_FORMATS[PHOTO_OUTPUT_FORMAT]["ext"]
+    if not blobs.has_variants(blob_result["sha256"], ext):
+        variants = get_image_service().submit(make_photo_variants, image_bytes, PHOTO_OUTPUT_FORMAT).result()
+        blobs.put_variants(blob_result["sha256"], variants, ext)
+
+def store_processed_photo(processed: dict, original: bytes | None = None) -> dict:
+    """Guarda una foto ya procesada por el pool (versión de entrega + derivados) y, si se entrega, el original para archivo"""
+    blobs = get_blob_store()
+    fmt = processed["format"]
+    ext = PHOTO_FORMATS[fmt]["ext"] if fmt else image_extension(processed["data"])
+    result = blobs.put(
+        BufferReader(processed["data"]), ext, IMAGE_CONTENT_TYPES.get(ext), sha256=processed["sha256"]
+    )
+    if fmt and not blobs.has_variants(result["sha256"], ext):
+        blobs.put_variants(result["sha256"], processed["variants"], ext)
+    if original is not None:
+        original_ext = image_extension(original)
+        archive = blobs.put(BufferReader(original), original_ext, IMAGE_CONTENT_TYPES.get(original_ext))
+        result["archive_path"] = archive["path"]
+    return result
+
+def client_accepts_webp() -> bool:
+    """Negocia el formato con el navegador: header Accept y, si no lo declara, su User-Agent"""
+    try:
+        headers = st.context.headers
+    except Exception:
+        return True
+    if "image/webp" in headers.get("Accept", ""):
+        return True
+    user_agent = headers.get("User-Agent", "")
+    if "MSIE" in user_agent or "Trident/" in user_agent:
+        return False
+    safari = re.search(r"Version/(\d+)[.\d]* (Mobile/\S+ )?Safari", user_agent)
+    if safari and "Chrome" not in user_agent and int(safari.group(1)) < 14:
+        return False
+    return True
+
+def get_photo_variant(path: str, display_width: int) -> str:
+    """Ruta del derivado adecuado para mostrar una foto guardada a display_width píxeles en este navegador"""
+    if not path or path.startswith("http"):
+        return path
+    accepted = ["webp", "jpeg"] if client_accepts_webp() else ["jpeg"]
+    return get_blob_store().variant_path(path, display_width, accepted)
+
+# --- ÍNDICE DE METADATOS DE FOTOS ---
+
+PHOTO_INDEX_COLUMNS = [
+    "photo_id", "sha256", "path", "archive_path", "captured_at", "captured_source", "ingested_at",
+    "lat", "lon", "camera", "width", "height", "size_bytes",
+    "entity_type", "entity_id", "label", "location", "project_id",
+]
+
+class PhotoIndex:
+    """Índice compacto de metadatos de fotos (JSON Lines en disco) para filtrar y ordenar sin abrir imágenes.
+
+    Una fila por foto y entidad vinculada (inspección, incidente, documento escaneado)
+    con fecha de captura, GPS, cámara, dimensiones, hash y rutas. Las filas nuevas se
+    agregan al final del archivo (una escritura por lote, no se reescribe el índice);
+    las consultas se resuelven sobre un DataFrame en memoria que se reconstruye solo
+    tras una escritura.
+    """
+
+    def __init__(self, index_path: Path):
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._rows = self._load()
+        self._frame = None
+
+    def make_row(self, metadata: dict, blob_result: dict, entity_type: str, entity_id: str, label: str | None = None,
+                 location: str | None = None, project_id: str | None = None, ingested_at: str | None = None) -> dict:
+        """Fila del índice para una foto ya almacenada y la entidad a la que pertenece (sin registrarla)"""
+        ingested_at = ingested_at or datetime.now().isoformat()
+        return {
+            "photo_id": uuid.uuid4().hex,
+            "sha256": blob_result["sha256"],
+            "path": blob_result["path"],
+            "archive_path": blob_result.get("archive_path"),
+            "captured_at": metadata.get("captured_at") or ingested_at,
+            "captured_source": "exif" if metadata.get("captured_at") else "ingesta",
+            "ingested_at": ingested_at,
+            "lat": metadata.get("lat"),
+            "lon": metadata.get("lon"),
+            "camera": metadata.get("camera"),
+            "width": metadata.get("width"),
+            "height": metadata.get("height"),
+            "size_bytes": blob_result["size"],
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "label": label,
+            "location": location,
+            "project_id": project_id,
+        }
+
+    def add(self, *args, **kwargs) -> dict:
+        """Registra una foto ya almacenada junto con la entidad a la que pertenece"""
+        row = self.make_row(*args, **kwargs)
+        self.extend([row])
+        return row
+
+    def extend(self, rows: list) -> None:
+        """Registra un lote de filas con una sola escritura (append) al archivo"""
+        if not rows:
+            return
+        lines = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+        with self._lock:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+            self._rows.extend(rows)
+            self._frame = None
+
+    def indexed(self) -> set:
+        """Pares (entity_type, entity_id, path) ya registrados, para el relleno de fotos antiguas"""
+        with self._lock:
+            return {(r["entity_type"], r["entity_id"], r["path"]) for r in self._rows}
+
+    def query(self, entity_type: str | None = None, project_id: str | None = None, text: str | None = None,
+              start: datetime | None = None, end: datetime | None = None, newest_first: bool = True) -> pd.DataFrame:
+        """Fotos filtradas por entidad, proyecto, texto (ubicación/etiqueta) y rango de captura"""
+        df = self._dataframe()
+        if df.empty:
+            return df
+        mask = pd.Series(True, index=df.index)
+        if entity_type:
+            mask &= df["entity_type"] == entity_type
+        if project_id:
+            mask &= df["project_id"] == project_id
+        if text:
+            needle = text.lower()
+            mask &= df["location"].fillna("").str.lower().str.contains(needle, regex=False) | \
+                df["label"].fillna("").str.lower().str.contains(needle, regex=False)
+        if start is not None:
+            mask &= df["captured_at"] >= pd.Timestamp(start)
+        if end is not None:
+            mask &= df["captured_at"] <= pd.Timestamp(end)
+        return df[mask].sort_values("captured_at", ascending=not newest_first)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _dataframe(self) -> pd.DataFrame:
+        with self._lock:
+            if self._frame is None:
+                frame = pd.DataFrame(self._rows, columns=PHOTO_INDEX_COLUMNS)
+                frame["captured_at"] = pd.to_datetime(frame["captured_at"], errors="coerce")
+                self._frame = frame
+            return self._frame
+
+    def _load(self) -> list:
+        rows = []
+        if self.index_path.exists():
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            rows.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            continue  # Línea truncada por un cierre abrupto: se descarta solo esa fila
+            except Exception as e:
+                logger.error(f"Error cargando índice de fotos: {e}")
+        return rows
+
+@st.cache_resource
+def get_photo_index() -> PhotoIndex:
+    """Instancia única del índice de fotos por proceso"""
+    return PhotoIndex(PHOTO_INDEX_FILE)
+
+# --- VERSIONES DE DOCUMENTOS (ALMACÉN POR FRAGMENTOS) ---
+
+# Tabla "gear" fija: los cortes deben ser los mismos entre ejecuciones para que los fragmentos se reutilicen
+_CDC_GEAR = np.random.default_rng(0x636F6E74).integers(0, 2**32, 256, dtype=np.uint64).astype(np.uint32)
+
+def content_defined_chunks(data) -> list:
+    """Corta data en fragmentos definidos por contenido; retorna [(inicio, fin), ...].
+
+    Hash "gear" de ventana de 32 bytes calculado con NumPy por duplicación de ventana
+    (5 pasadas en lugar de un bucle por byte): un corte se coloca donde los
+    CDC_AVG_BITS bits altos del hash son cero, respetando CDC_MIN_CHUNK y
+    CDC_MAX_CHUNK. Como los cortes dependen solo de los bytes vecinos, una edición
+    local en una revisión cambia únicamente los fragmentos que la rodean.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    total = len(buf)
+    if total <= CDC_MIN_CHUNK:
+        return [(0, total)] if total else []
+    
+    candidates = []
+    for block_start in range(0, total, CDC_BLOCK_SIZE):
+        context = min(block_start, 31)  # Los 31 bytes previos completan la ventana del inicio del bloque
+        block = buf[block_start - context:block_start + CDC_BLOCK_SIZE]
+        h = _CDC_GEAR[block]
+        width = 1
+        while width < 32:
+            shifted = np.zeros_like(h)
+            shifted[width:] = h[:-width] << np.uint32(width)
+            h += shifted
+            width *= 2
+        hits = np.flatnonzero((h[context:] >> np.uint32(32 - CDC_AVG_BITS)) == 0)
+        candidates.extend((hits + block_start + 1).tolist())
+    
+    bounds = []
+    start = 0
+    for cut in candidates:
+        while cut - start > CDC_MAX_CHUNK:
+            start += CDC_MAX_CHUNK
+            bounds.append(start)
+        if cut - start >= CDC_MIN_CHUNK and cut < total:
+            bounds.append(cut)
+            start = cut
+    while total - start > CDC_MAX_CHUNK:
+        start += CDC_MAX_CHUNK
+        bounds.append(start)
+    edges = [0] + bounds + [total]
+    return list(zip(edges[:-1], edges[1:]))
+
+def document_id(project_id: str | None, filename: str) -> str:
+    """Identificador del documento lógico: mismo proyecto y mismo nombre sin sufijo de versión"""
+    path = Path(filename.lower())
+    stem = re.sub(r"\s*\(\d+\)$", "", path.stem)  # "plano (1).pdf" de descargas repetidas
+    # Solo "v"/"rev" precedidos de un separador: "Sector 3" o "Floor3" son documentos distintos
+    stem = re.sub(r"(?:^|[\s_\-])(?:v|rev)\.?\s*\d+(?:[._]\d+)*$", "", stem).strip(" _-") or path.stem
+    return hashlib.sha256(f"{project_id or ''}/{stem}{path.suffix}".encode()).hexdigest()[:16]
+
+class DocumentVersionStore:
+    """Revisiones de documentos agrupadas por documento lógico, con almacenamiento por fragmentos.
+
+    Cada revisión se corta en fragmentos definidos por contenido; solo los fragmentos
+    que no existían se comprimen (zlib) y se guardan en un paquete por revisión en el
+    almacén de blobs. La revisión vigente conserva además su archivo completo para
+    servirlo directo; al llegar una nueva se libera el de la anterior, que queda
+    reconstruible desde los fragmentos. La revisión vigente de cada documento se
+    resuelve en O(1) con un diccionario en memoria.
+    """
+
+    def __init__(self, index_path: Path, revisions_dir: Path, blobs: BlobStore):
+        self.index_path = index_path
+        self.revisions_dir = revisions_dir
+        self.revisions_dir.mkdir(parents=True, exist_ok=True)
+        self.blobs = blobs
+        self._lock = threading.Lock()
+        self._index = self._load()
+        self._current = {doc_id: doc["latest"] for doc_id, doc in self._index["documents"].items()}
+
+    def is_current(self, record: dict) -> bool:
+        """True si el registro es la revisión vigente de su documento (o aún no tiene revisión guardada)"""
+        doc_id = record.get("Documento_Id")
+        if doc_id is None or record.get("Revisión") is None:
+            return True
+        return self._current.get(doc_id, record.get("Sync_Id")) == record.get("Sync_Id")
+
+    def add_revision(self, record: dict, data, blob_result: dict) -> dict:
+        """Registra el contenido ya guardado de record como nueva revisión vigente de su documento"""
+        doc_id = record["Documento_Id"]
+        spans = content_defined_chunks(data)
+        chunk_ids = [hashlib.sha256(data[a:b]).hexdigest()[:24] for a, b in spans]
+        with self._lock:
+            known = self._index["chunks"]
+            novel = {}
+            for chunk_id, span in zip(chunk_ids, spans):
+                if chunk_id not in known and chunk_id not in novel:
+                    novel[chunk_id] = span
+        
+        # Un paquete por revisión con sus fragmentos nuevos: un solo objeto que subir
+        pack = bytearray()
+        placements = {}
+        for chunk_id, (a, b) in novel.items():
+            compressed = zlib.compress(data[a:b])
+            placements[chunk_id] = (len(pack), len(compressed))
+            pack += compressed
+        pack_result = self.blobs.put(BufferReader(pack), ".pack", "application/octet-stream") if pack else None
+        
+        revision = {
+            "rev_id": record["Sync_Id"],
+            "version": record.get("Versión"),
+            "sha256": blob_result["sha256"],
+            "size": blob_result["size"],
+            "ext": Path(record.get("Archivo", "")).suffix.lower(),
+            "path": blob_result["path"],
+            "chunks": chunk_ids,
+            "new_chunks": len(novel),
+            "stored_bytes": len(pack),
+            "created_at": datetime.now().isoformat(),
+        }
+        released = None
+        with self._lock:
+            if pack_result:
+                self._index["packs"][pack_result["sha256"]] = pack_result["path"]
+                for chunk_id, (offset, length) in placements.items():
+                    self._index["chunks"].setdefault(chunk_id, [pack_result["sha256"], offset, length])
+            doc = self._index["documents"].setdefault(doc_id, {
+                "name": record.get("Archivo"), "project_id": record.get("project_id"), "revisions": [],
+            })
+            previous = doc["revisions"][-1] if doc["revisions"] else None
+            revision["number"] = len(doc["revisions"]) + 1
+            doc["revisions"].append(revision)
+            doc["name"] = record.get("Archivo")
+            doc["latest"] = revision["rev_id"]
+            self._current[doc_id] = revision["rev_id"]
+            if previous and previous["path"] and previous["sha256"] != revision["sha256"]:
+                released = previous["sha256"]
+                previous["path"] = None  # Desde ahora se reconstruye desde los fragmentos
+            self._save()
+        if released:
+            self.blobs.release(released)
+        logger.info(f"Revisión {revision['number']} de {record.get('Archivo')}: "
+                    f"{len(novel)}/{len(chunk_ids)} fragmentos nuevos, {len(pack)} bytes comprimidos")
+        return revision
+
+    def documents(self, project_id: str | None = None) -> list:
+        """Documentos lógicos (con su lista de revisiones), del más reciente al más antiguo"""
+        with self._lock:
+            docs = [
+                {"doc_id": doc_id, **doc} for doc_id, doc in self._index["documents"].items()
+                if project_id is None or doc.get("project_id") == project_id
+            ]
+        return sorted(docs, key=lambda d: d["revisions"][-1]["created_at"], reverse=True)
+
+    def materialize(self, doc_id: str, rev_id: str) -> Path | None:
+        """Archivo local con el contenido de una revisión: el vigente, o reconstruido desde los fragmentos"""
+        with self._lock:
+            doc = self._index["documents"].get(doc_id)
+            revision = next((r for r in doc["revisions"] if r["rev_id"] == rev_id), None) if doc else None
+            if revision is None:
+                return None
+            if revision["path"]:
+                path = revision["path"]
+            else:
+                path = None
+                placements = [self._index["chunks"][chunk_id] for chunk_id in revision["chunks"]]
+                packs = {pack_sha: self._index["packs"][pack_sha] for pack_sha, _, _ in placements}
+        if path:
+            return resolve_stored_path(path)
+        
+        target = self.revisions_dir / f"{revision['sha256']}{revision['ext']}"
+        if target.exists():
+            return target
+        pack_data = {}
+        for pack_sha, pack_path in packs.items():
+            local = resolve_stored_path(pack_path)
+            if local is None:
+                logger.error(f"Paquete de fragmentos no disponible: {pack_path}")
+                return None
+            pack_data[pack_sha] = local.read_bytes()
+        content = b"".join(zlib.decompress(pack_data[pack_sha][offset:offset + length]) for pack_sha, offset, length in placements)
+        if hashlib.sha256(content).hexdigest() != revision["sha256"]:
+            logger.error(f"Revisión {rev_id} reconstruida con hash distinto; se descarta")
+            return None
+        write_bytes_atomic(target, content)
+        return target
+
+    def stats(self) -> dict:
+        """Bytes lógicos de todas las revisiones frente a bytes realmente guardados"""
+        with self._lock:
+            revisions = [r for doc in self._index["documents"].values() for r in doc["revisions"]]
+        logical = sum(r["size"] for r in revisions)
+        stored = sum(r["stored_bytes"] for r in revisions)
+        full = sum(r["size"] for r in revisions if r["path"])
+        return {
+            "documents": len(self._current),
+            "revisions": len(revisions),
+            "logical_bytes": logical,
+            "chunk_bytes": stored,
+            "full_bytes": full,
+            "ratio": logical / (stored + full) if stored + full else 0.0,
+        }
+
+    def _save(self) -> None:
+        write_json_atomic(self.index_path, self._index)
+
+    def _load(self) -> dict:
+        if self.index_path.exists():
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.error(f"Error cargando índice de versiones: {e}")
+        return {"documents": {}, "chunks": {}, "packs": {}}
+
+@st.cache_resource
+def get_document_versions() -> DocumentVersionStore:
+    """Instancia única del almacén de versiones por proceso"""
+    return DocumentVersionStore(DOC_VERSIONS_FILE, DOC_REVISIONS_DIR, get_blob_store())
+
+# --- COLA OFFLINE DE SINCRONIZACIÓN (OUTBOX) ---
+
+def cloud_record(record: dict) -> dict:
+    """Copia de un registro para Firestore sin Sync_Estado (es estado local: en la nube nadie lo limpiaría)"""
+    return {key: value for key, value in record.items() if key != "Sync_Estado"}
+
+class OfflineOutbox:
+    """Cola persistente en disco para escrituras a Firestore/GCS que fallaron.
+
+    Cada operación se guarda como un JSON en OUTBOX_DIR (y su contenido binario
+    en un .bin) con una clave de idempotencia. Un hilo en segundo plano la
+    reintenta con backoff exponencial hasta que la nube la acepta.
+    """
+
+    def __init__(self, outbox_dir: Path):
+        self.outbox_dir = outbox_dir
+        self.outbox_dir.mkdir(parents=True, exist_ok=True)
+        self.db = None
+        self.bucket = None
+        self.last_sync = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stop = threading.Event()
+
+    def attach(self, db, bucket) -> None:
+        """Asocia los clientes de nube y arranca el worker si no está activo"""
+        self.db = db
+        self.bucket = bucket
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="outbox-worker", daemon=True)
+            self._worker.start()
+
+    def enqueue_document(self, collection: str, data: dict, doc_id: str) -> str:
+        """Encola un documento de Firestore (doc_id actúa como clave de idempotencia)"""
+        entry = {
+            "id": doc_id,
+            "kind": "firestore_set",
+            "collection": collection,
+            "data": cloud_record(data),
+        }
+        self._save_new_entry(entry)
+        logger.info(f"Documento {collection}/{doc_id} encolado en outbox")
+        return doc_id
+
+    def enqueue_blob(self, blob_name: str, source, content_type: str | None, session_url: str | None = None) -> str:
+        """Encola la subida de un blob a GCS (blob_name actúa como clave de idempotencia).
+
+        El contenido se copia por bloques a disco; session_url permite retomar
+        una sesión resumable ya iniciada en lugar de volver a subir todo.
+        """
+        entry_id = uuid.uuid4().hex
+        payload_path = self.outbox_dir / f"{entry_id}.bin"
+        source.seek(0)
+        stream_to_local(source, payload_path)
+        entry = {
+            "id": entry_id,
+            "kind": "gcs_upload",
+            "blob_name": blob_name,
+            "content_type": content_type,
+            "payload_file": payload_path.name,
+            "session_url": session_url,
+        }
+        self._save_new_entry(entry)
+        logger.info(f"Blob {blob_name} encolado en outbox")
+        return entry_id
+
+    def pending_entries(self) -> list:
+        """Devuelve las operaciones pendientes ordenadas por antigüedad"""
+        entries = []
+        for entry_path in self.outbox_dir.glob("*.json"):
+            try:
+                with open(entry_path, 'r', encoding='utf-8') as f:
+                    entries.append(json.load(f))
+            except Exception as e:
+                logger.warning(f"Entrada de outbox ilegible {entry_path.name}: {e}")
+        return sorted(entries, key=lambda e: e.get("created_at", ""))
+
+    def pending_documents(self, collection: str) -> list:
+        """Documentos aún no sincronizados de una colección (más recientes primero)"""
+        docs = [
+            dict(e["data"], Sync_Estado="Pendiente")
+            for e in self.pending_entries()
+            if e.get("kind") == "firestore_set" and e.get("collection") == collection
+        ]
+        return list(reversed(docs))
+
+    def discard_document(self, doc_id: str) -> bool:
+        """Descarta la escritura pendiente de doc_id porque una más nueva la reemplaza.
+
+        Toma el lock del worker: al volver, esa instantánea ya no se puede reproducir
+        después de la escritura nueva.
+        """
+        entry_path = self.outbox_dir / f"{doc_id}.json"
+        with self._lock:
+            if not entry_path.exists():
+                return False
+            entry_path.unlink(missing_ok=True)
+        logger.info(f"Outbox: escritura pendiente de {doc_id} reemplazada por una más reciente")
+        return True
+
+    def merge_pending(self, collection: str, docs: list) -> list:
+        """Pendientes de la colección seguidos de docs, sin repetir Sync_Id (la versión pendiente es la más nueva)"""
+        pending = self.pending_documents(collection)
+        pending_ids = {doc.get("Sync_Id") for doc in pending}
+        return pending + [doc for doc in docs if doc.get("Sync_Id") is None or doc.get("Sync_Id") not in pending_ids]
+
+    def status(self) -> dict:
+        """Resumen del estado de sincronización para la UI"""
+        entries = self.pending_entries()
+        return {
+            "pending": len(entries),
+            "retrying": sum(1 for e in entries if e.get("attempts", 0) > 0),
+            "last_sync": self.last_sync,
+            "last_error": self.last_error,
+        }
+
+    def replay_due(self, force: bool = False) -> int:
+        """Reintenta las operaciones cuyo backoff ya venció (o todas si force). Retorna cuántas se sincronizaron"""
+        if self.db is None and self.bucket is None:
+            return 0
+        synced = 0
+        now = datetime.now()
+        with self._lock:
+            for entry in self.pending_entries():
+                if not force and entry.get("next_attempt_at") and datetime.fromisoformat(entry["next_attempt_at"]) > now:
+                    continue
+                try:
+                    self._replay(entry)
+                    self._remove_entry(entry)
+                    synced += 1
+                    self.last_sync = datetime.now()
+                    self.last_error = None
+                except Exception as e:
+                    self._schedule_retry(entry, e)
+        if synced:
+            logger.info(f"Outbox: {synced} operaciones sincronizadas")
+        return synced
+
+    def _run(self) -> None:
+        while not self._stop.wait(OUTBOX_POLL_SECONDS):
+            try:
+                self.replay_due()
+            except Exception as e:
+                logger.error(f"Error en worker de outbox: {e}")
+
+    def _replay(self, entry: dict) -> None:
+        if entry["kind"] == "firestore_set":
+            if self.db is None:
+                raise RuntimeError("Firestore no disponible")
+            # set() con ID fijo es idempotente: reintentar nunca duplica
+            self.db.collection(entry["collection"]).document(entry["id"]).set(cloud_record(entry["data"]))
+        elif entry["kind"] == "gcs_upload":
+            if self.bucket is None:
+                raise RuntimeError("Cloud Storage no disponible")
+            if entry.get("session_url") is None and self.bucket.blob(entry["blob_name"]).exists():
+                return  # Un intento anterior sí llegó a la nube
+
+            def remember_session(session_url):
+                entry["session_url"] = session_url
+                write_json_atomic(self.outbox_dir / f"{entry['id']}.json", entry)
+
+            with open(self.outbox_dir / entry["payload_file"], 'rb') as payload:
+                try:
+                    stream_to_gcs(
+                        self.bucket, entry["blob_name"], payload, entry.get("content_type"),
+                        session_url=entry.get("session_url"), session_cb=remember_session,
+                    )
+                except requests.HTTPError as e:
+                    if e.response is None or e.response.status_code not in (404, 410):
+                        raise
+                    # La sesión resumable expiró: el próximo intento abre una nueva
+                    entry["session_url"] = None
+                    raise
+        else:
+            raise ValueError(f"Tipo de operación desconocido: {entry['kind']}")
+
+    def _save_new_entry(self, entry: dict) -> None:
+        entry.update({
+            "created_at": datetime.now().isoformat(),
+            "attempts": 0,
+            "next_attempt_at": None,
+            "last_error": None,
+        })
+        write_json_atomic(self.outbox_dir / f"{entry['id']}.json", entry)
+
+    def _schedule_retry(self, entry: dict, error: Exception) -> None:
+        entry["attempts"] = entry.get("attempts", 0) + 1
+        delay = min(OUTBOX_MAX_BACKOFF_SECONDS, OUTBOX_BASE_BACKOFF_SECONDS * 2 ** entry["attempts"])
+        delay += random.uniform(0, delay * 0.1)
+        entry["next_attempt_at"] = (datetime.now() + timedelta(seconds=delay)).isoformat()
+        entry["last_error"] = str(error)
+        self.last_error = str(error)
+        write_json_atomic(self.outbox_dir / f"{entry['id']}.json", entry)
+        logger.warning(f"Outbox: reintento {entry['attempts']} de {entry['id']} en {delay:.0f}s ({error})")
+
+    def _remove_entry(self, entry: dict) -> None:
+        if entry.get("payload_file"):
+            (self.outbox_dir / entry["payload_file"]).unlink(missing_ok=True)
+        (self.outbox_dir / f"{entry['id']}.json").unlink(missing_ok=True)
+
+@st.cache_resource
+def get_outbox() -> OfflineOutbox:
+    """Instancia única del outbox por proceso (sobrevive a los reruns)"""
+    return OfflineOutbox(OUTBOX_DIR)
+
+# --- SERVICIO DE SUBIDAS EN SEGUNDO PLANO ---
+
+class UploadService:
+    """Pool acotado de hilos que comprime y sube fotos/documentos sin bloquear la sesión.
+
+    Cada trabajo actualiza en sitio el registro asociado (File_Path/Foto_Path y
+    Upload_Estado) al terminar. Si la cola está llena, el trabajo se ejecuta en
+    primer plano para no perder datos.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, label: str, kind: str, record: dict, path_field: str, store_fn, on_done=None) -> str:
+        """Encola un trabajo de subida y retorna su ID de inmediato"""
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "label": label,
+            "kind": kind,
+            "status": "pending",
+            "progress": 0.0,
+            "created_at": datetime.now(),
+            "finished_at": None,
+            "result_path": None,
+            "error": None,
+        }
+        with self._lock:
+            self._prune()
+            self.jobs[job_id] = job
+        record["Upload_Id"] = job_id
+        
+        if self._slots.acquire(blocking=False):
+            future = self._executor.submit(self._run, job, record, path_field, store_fn, on_done)
+            future.add_done_callback(lambda _: self._slots.release())
+        else:
+            logger.warning("Cola de subidas llena; procesando en primer plano")
+            self._run(job, record, path_field, store_fn, on_done)
+        return job_id
+
+    def get_jobs(self, job_ids: list) -> list:
+        """Retorna los trabajos conocidos de la lista de IDs (en orden)"""
+        with self._lock:
+            return [dict(self.jobs[job_id]) for job_id in job_ids if job_id in self.jobs]
+
+    def _run(self, job: dict, record: dict, path_field: str, store_fn, on_done) -> None:
+        job["status"] = "uploading"
+        try:
+            result_path = store_fn(job)
+            record[path_field] = result_path
+            record["Upload_Estado"] = "Completado"
+            job.update(status="done", progress=1.0, result_path=result_path)
+        except Exception as e:
+            logger.error(f"Error en subida en segundo plano {job['label']}: {e}")
+            record["Upload_Estado"] = "Error"
+            if path_field == "Foto_Path":
+                record["Tiene_Foto"] = "Error"
+            job.update(status="error", error=str(e))
+        finally:
+            job["finished_at"] = datetime.now()
+        if on_done:
+            try:
+                on_done(record)
+            except Exception as e:
+                logger.error(f"Error finalizando subida {job['label']}: {e}")
+
+    def _prune(self) -> None:
+        limit = datetime.now() - timedelta(minutes=UPLOAD_JOB_RETENTION_MINUTES)
+        for job_id in [j["id"] for j in self.jobs.values() if j["finished_at"] and j["finished_at"] < limit]:
+            del self.jobs[job_id]
+
+@st.cache_resource
+def get_upload_service() -> UploadService:
+    """Instancia única del servicio de subidas por proceso"""
+    return UploadService(UPLOAD_WORKERS, UPLOAD_QUEUE_SIZE)
+
+# --- SERVICIO DE PROCESAMIENTO DE IMÁGENES (POOL DE PROCESOS) ---
+
+class ImageProcessingService:
+    """Pool acotado de procesos para el trabajo de PIL (compresión, orientación EXIF, derivados, hash).
+
+    PIL retiene el GIL en gran parte de la decodificación/codificación, así que los
+    lotes de fotos se reparten entre procesos para escalar con los núcleos. Las
+    funciones viven en image_service para que los workers puedan importarlas. Si la
+    cola está llena, o el pool se cae, el trabajo se ejecuta en el hilo que lo pide.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def submit(self, fn, *args) -> Future:
+        """Encola fn(*args) en el pool y retorna un Future"""
+        if not self._slots.acquire(blocking=False):
+            logger.warning("Cola de imágenes llena; procesando en el hilo actual")
+            return self._run_inline(fn, *args)
+        try:
+            with self._lock:
+                future = self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._restart()
+            return self._run_inline(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def map(self, fn, items: list, *args) -> list:
+        """Aplica fn a cada elemento en paralelo y retorna los resultados en orden"""
+        futures = [self.submit(fn, item, *args) for item in items]
+        results = []
+        for item, future in zip(items, futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                self._restart()
+                results.append(fn(item, *args))
+        return results
+
+    def process_photos(self, photos: list, max_size_kb: int = 500, output_format: str = PHOTO_OUTPUT_FORMAT) -> list:
+        """Lote de fotos → [{data, sha256, format, variants, stats}] en el mismo orden"""
+        return self.map(process_photo, photos, max_size_kb, output_format)
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn: el proceso de Streamlit tiene hilos activos y fork no es seguro con ellos
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _restart(self) -> None:
+        logger.error("Pool de imágenes caído; reiniciando")
+        with self._lock:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._new_executor()
+
+    def _run_inline(self, fn, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+@st.cache_resource
+def get_image_service() -> ImageProcessingService:
+    """Instancia única del pool de imágenes por proceso"""
+    return ImageProcessingService(IMAGE_WORKERS, IMAGE_QUEUE_SIZE)
+
+# --- EXTRACCIÓN DE METADATOS DE PLANOS ---
+
+class PlanMetadataService:
+    """Extrae en segundo plano el resumen de metadatos de cada plano subido (capas, entidades, páginas).
+
+    El análisis corre en el pool de procesos; un hilo coordinador escribe el resumen
+    en el registro (Metadatos) y lo deja en una caché en disco por SHA-256, así que
+    volver a subir el mismo contenido no lo analiza de nuevo. Lleva métricas de
+    rendimiento y fallos.
+    """
+
+    def __init__(self, cache_path: Path, max_workers: int):
+        self.cache_path = cache_path
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="metadata")
+        self._lock = threading.Lock()
+        self._cache = self._load()
+        self._stats = {"queued": 0, "processed": 0, "failed": 0, "cache_hits": 0, "bytes": 0, "busy_seconds": 0.0}
+        self._failures = []
+
+    def submit(self, record: dict, data, ext: str, on_done=None) -> None:
+        """Programa la extracción para record (con SHA256 ya calculado); on_done(record) al terminar"""
+        with self._lock:
+            cached = self._cache.get(record.get("SHA256"))
+            if cached is None:
+                self._stats["queued"] += 1
+            else:
+                self._stats["cache_hits"] += 1
+        if cached is not None:
+            record.update(Metadatos=cached, Metadatos_Estado="Completado")
+            if on_done:
+                on_done(record)
+            return
+        record["Metadatos_Estado"] = "Pendiente"
+        self._executor.submit(self._run, record, data, ext, on_done)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["recent_failures"] = list(self._failures)
+        stats["mb_per_second"] = stats["bytes"] / (1024 * 1024) / stats["busy_seconds"] if stats["busy_seconds"] else 0.0
+        stats["avg_ms"] = stats["busy_seconds"] * 1000 / stats["processed"] if stats["processed"] else 0.0
+        return stats
+
+    def _run(self, record: dict, data, ext: str, on_done) -> None:
+        start = time.perf_counter()
+        try:
+            metadata = get_image_service().submit(extract_plan_metadata, bytes(data), ext).result()
+            metadata["extracted_at"] = datetime.now().isoformat()
+            record.update(Metadatos=metadata, Metadatos_Estado="Completado")
+            with self._lock:
+                self._stats["processed"] += 1
+                self._stats["bytes"] += len(data)
+                self._stats["busy_seconds"] += time.perf_counter() - start
+                if record.get("SHA256"):
+                    self._cache[record["SHA256"]] = metadata
+                    write_json_atomic(self.cache_path, self._cache)
+        except Exception as e:
+            logger.error(f"Error extrayendo metadatos de {record.get('Archivo')}: {e}")
+            record["Metadatos_Estado"] = "Error"
+            with self._lock:
+                self._stats["failed"] += 1
+                self._failures = (self._failures + [{"Archivo": record.get("Archivo"), "Error": str(e)}])[-PLAN_METADATA_FAILURE_LOG:]
+        finally:
+            with self._lock:
+                self._stats["queued"] -= 1
+        if on_done:
+            try:
+                on_done(record)
+            except Exception as e:
+                logger.error(f"Error finalizando metadatos de {record.get('Archivo')}: {e}")
+
+    def _load(self) -> dict:
+        if self.cache_path.exists():
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.error(f"Error cargando caché de metadatos de planos: {e}")
+        return {}
+
+@st.cache_resource
+def get_plan_metadata_service() -> PlanMetadataService:
+    """Instancia única del extractor de metadatos por proceso"""
+    return PlanMetadataService(PLAN_METADATA_FILE, PLAN_METADATA_WORKERS)
+
+# --- CACHÉ DE DATAFRAMES POR REVISIÓN ---
+
+def build_typed_frame(collection: str, records: list) -> pd.DataFrame:
+    """DataFrame de una colección con los tipos de FRAME_SCHEMAS (números y fechas ya convertidos)"""
+    frame = pd.DataFrame(records)
+    schema = FRAME_SCHEMAS.get(collection, {})
+    for column in schema.get("numeric", []):
+        if column in frame.columns:
+            frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    for column in schema.get("integer", []):
+        if column in frame.columns:
+            frame[column] = pd.to_numeric(frame[column], errors="coerce").astype("Int64")
+    for column in schema.get("datetime", []):
+        if column in frame.columns:
+            frame[column] = pd.to_datetime(frame[column], errors="coerce", format="ISO8601")
+    return frame
+
+def records_fingerprint(records: list) -> str:
+    """Huella de qué registros trae una ventana limitada de Firestore (limit(100) mantiene el conteo
+    aunque llegue uno nuevo): ids, Timestamp y si siguen en el outbox. Los cambios en sitio
+    renuevan la revisión de la colección, no pasan por aquí.
+    """
+    state = tuple((r.get("Sync_Id"), r.get("Timestamp"), r.get("Sync_Estado")) for r in records)
+    return f"{len(records)}:{hash(state):x}"
+
+class FrameCache:
+    """LRU de DataFrames tipados por (colección, revisión), acotado por entradas y memoria.
+
+    La revisión es un token que DataManager renueva en cada escritura, así que una
+    entrada nunca queda obsoleta: las revisiones viejas simplemente dejan de pedirse y
+    salen por LRU. Se entrega una copia superficial para que agregar columnas en una
+    vista no altere la entrada compartida.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (colección, revisión) -> (DataFrame, bytes)
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "build_ms": 0.0}
+
+    def get(self, collection: str, revision: str, records: list) -> pd.DataFrame:
+        key = (collection, revision)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return cached[0].copy(deep=False)
+            self._stats["misses"] += 1
+        
+        start = time.perf_counter()
+        frame = build_typed_frame(collection, records)
+        size = int(frame.memory_usage(deep=True).sum())
+        with self._lock:
+            self._stats["build_ms"] += (time.perf_counter() - start) * 1000
+            if key not in self._entries:
+                self._entries[key] = (frame, size)
+                self._bytes += size
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats["evictions"] += 1
+        return frame.copy(deep=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), memory_bytes=self._bytes,
+                         collections=sorted({collection for collection, _ in self._entries}))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+@st.cache_resource
+def get_frame_cache() -> FrameCache:
+    """Instancia única de la caché de DataFrames por proceso (compartida entre sesiones)"""
+    return FrameCache(FRAME_CACHE_MAX_ENTRIES, FRAME_CACHE_MAX_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_shared_revisions() -> dict:
+    """Tokens de revisión de las colecciones que viven en Firestore, comunes a todas las sesiones del proceso"""
+    return {}
+
+# --- CURVA S (AVANCE PLANIFICADO VS REAL) ---
+
+def spread_cumulative(starts: np.ndarray, ends: np.ndarray, amounts: np.ndarray, horizon: int) -> np.ndarray:
+    """Acumulado diario (días 0..horizon) de montos repartidos de forma uniforme entre starts y ends.
+
+    Cada monto aporta una tasa constante en [inicio, fin): las tasas se suman con un
+    arreglo de diferencias (bincount) y dos cumsum, en O(registros + días).
+    """
+    rates = amounts / (ends - starts)
+    diff = np.bincount(starts, weights=rates, minlength=horizon + 1) - np.bincount(ends, weights=rates, minlength=horizon + 1)
+    daily = np.cumsum(diff)[:horizon]
+    return np.concatenate(([0.0], np.cumsum(daily)))
+
+def numeric_column(frame: pd.DataFrame, column: str, default: float = 0.0) -> pd.Series:
+    """Columna numérica de un frame de registros (valores faltantes o inválidos -> default)"""
+    if column not in frame.columns:
+        return pd.Series(default, index=frame.index, dtype=float)
+    return pd.to_numeric(frame[column], errors="coerce").fillna(default).astype(float)
+
+def activity_schedule(activities: list) -> pd.DataFrame:
+    """Fechas (días desde la primera fecha_inicio), duración y peso de las actividades con fecha de inicio válida.
+
+    Sin fecha_fin (o anterior al inicio) se asume un día. El peso es "peso" si es positivo;
+    si no, la duración planificada en días.
+    """
+    frame = pd.DataFrame(activities)
+    if frame.empty or "fecha_inicio" not in frame.columns:
+        return pd.DataFrame()
+    start = pd.to_datetime(frame["fecha_inicio"], format="%d/%m/%Y", errors="coerce")
+    end = pd.to_datetime(frame.get("fecha_fin", pd.Series(index=frame.index, dtype=object)), format="%d/%m/%Y", errors="coerce")
+    valid = start.notna().to_numpy()
+    if not valid.any():
+        return pd.DataFrame()
+    frame, start, end = frame[valid], start[valid], end[valid]
+    end = end.where(end > start, start + pd.Timedelta(days=1))
+    origin = start.min()
+    schedule = pd.DataFrame({
+        "start": (start - origin).dt.days.to_numpy(),
+        "end": (end - origin).dt.days.to_numpy(),
+        "avance": numeric_column(frame, "avance").clip(0, 100).to_numpy() / 100,
+    }, index=frame.index)
+    schedule["duration"] = schedule["end"] - schedule["start"]
+    peso = numeric_column(frame, "peso").to_numpy()
+    schedule["weight"] = np.where(peso > 0, peso, schedule["duration"])
+    schedule.attrs["origin"] = origin
+    return schedule
+
+def compute_s_curve(activities: list, today, freq: str = "W") -> pd.DataFrame:
+    """Curvas S acumuladas (% del peso total) planificada y real, en bins diarios ("D") o semanales ("W").
+
+    Planificado: cada actividad reparte su peso de forma uniforme entre fecha_inicio y fecha_fin.
+    Real: el avance registrado se reparte desde fecha_inicio hasta hoy, o hasta fecha_fin si la
+    actividad está terminada y su fin ya pasó. La curva real se corta en hoy.
+    """
+    schedule = activity_schedule(activities)
+    if schedule.empty:
+        return pd.DataFrame(columns=["Planificado", "Real"])
+    origin = schedule.attrs["origin"]
+    starts, ends = schedule["start"].to_numpy(), schedule["end"].to_numpy()
+    weights, avance = schedule["weight"].to_numpy(dtype=float), schedule["avance"].to_numpy()
+    today_idx = (pd.Timestamp(today) - origin).days
+    horizon = int(max(ends.max(), today_idx, 1))
+    
+    planned = spread_cumulative(starts, ends, weights, horizon)
+    finished = (avance >= 1) & (ends <= today_idx)
+    actual_ends = np.where(finished, ends, np.maximum(today_idx, starts + 1))
+    actual = spread_cumulative(starts, actual_ends, weights * avance, int(max(horizon, actual_ends.max())))[:horizon + 1]
+    total = weights.sum()
+    
+    curve = pd.DataFrame({"Planificado": planned / total * 100, "Real": actual / total * 100},
+                         index=pd.date_range(origin, periods=horizon + 1, freq="D"))
+    curve.index.name = "Fecha"
+    curve.loc[curve.index > pd.Timestamp(today), "Real"] = np.nan
+    if freq == "W":
+        curve = curve.resample("W").last()
+    return curve.round(2)
+
+@st.cache_data(max_entries=S_CURVE_CACHE_ENTRIES, show_spinner=False)
+def cached_s_curve(project_id, revision: str, today, freq: str, _activities: list) -> pd.DataFrame:
+    """compute_s_curve memorizada por proyecto y revisión de actividades (el día entra en la clave por la curva real)"""
+    return compute_s_curve(_activities, today, freq)
+
+# --- VALOR GANADO (EVM) ---
+
+def evm_indices(frame: pd.DataFrame) -> pd.DataFrame:
+    """Agrega variaciones e índices (CV, SV, CPI, SPI, EAC, ETC, VAC) a un frame con bac, pv, ev y ac.
+
+    CPI y SPI quedan en NaN sin costo real o valor planificado. Sin un CPI positivo
+    (sin gasto, o sin valor ganado aún) EAC = AC + (BAC - EV): el trabajo restante al costo presupuestado.
+    """
+    frame = frame.copy()
+    bac, pv, ev, ac = (frame[col].to_numpy(dtype=float) for col in ("bac", "pv", "ev", "ac"))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cpi = np.where(ac > 0, ev / ac, np.nan)
+        spi = np.where(pv > 0, ev / pv, np.nan)
+        eac = np.where(cpi > 0, bac / cpi, ac + (bac - ev))
+    frame["cv"] = ev - ac
+    frame["sv"] = ev - pv
+    frame["cpi"] = cpi
+    frame["spi"] = spi
+    frame["eac"] = eac
+    frame["etc"] = np.maximum(eac - ac, 0)
+    frame["vac"] = bac - eac
+    return frame
+
+def compute_activity_evm(activities: list, budget: dict, today) -> pd.DataFrame:
+    """PV, EV y AC por actividad, vectorizado.
+
+    BAC: "presupuesto" de la actividad si es positivo; si no, el presupuesto de su "categoria"
+    que no está asignado explícitamente se reparte según el peso de la curva S (peso o duración).
+    PV: BAC por la fracción planificada a hoy (lineal entre fecha_inicio y fecha_fin).
+    EV: BAC por el avance. AC: "costo_real" imputado a la actividad más el gasto de la categoría
+    sin actividad, repartido según EV (o BAC si aún no hay avance).
+    """
+    columns = ["id", "nombre", "categoria", "bac", "pv", "ev", "ac"]
+    if not activities:
+        return pd.DataFrame(columns=columns)
+    frame = pd.DataFrame(activities)
+    result = pd.DataFrame({
+        "id": frame.get("id"),
+        "nombre": frame.get("nombre", ""),
+        "categoria": frame.get("categoria"),
+    }, index=frame.index)
+    result["avance"] = numeric_column(frame, "avance").clip(0, 100) / 100
+    explicit = numeric_column(frame, "presupuesto").clip(lower=0)
+    cost = numeric_column(frame, "costo_real").clip(lower=0)
+    
+    # Fracción planificada a hoy y peso (actividades sin fechas válidas: sin PV, peso de un día)
+    schedule = activity_schedule(activities)
+    planned = pd.Series(0.0, index=frame.index)
+    weight = pd.Series(1.0, index=frame.index)
+    if not schedule.empty:
+        today_idx = (pd.Timestamp(today) - schedule.attrs["origin"]).days
+        planned[schedule.index] = ((today_idx - schedule["start"]) / schedule["duration"]).clip(0, 1)
+        weight[schedule.index] = schedule["weight"]
+    
+    categories = budget.get("categories", {})
+    category_budget = result["categoria"].map({cat: values["budget"] for cat, values in categories.items()}).fillna(0).astype(float)
+    category_spent = result["categoria"].map({cat: values["executed"] for cat, values in categories.items()}).fillna(0).astype(float)
+    by_category = result["categoria"].fillna("")
+    
+    implicit = explicit <= 0
+    unassigned = (category_budget - explicit.groupby(by_category).transform("sum")).clip(lower=0)
+    implicit_weight = weight.where(implicit, 0).groupby(by_category).transform("sum")
+    share = (weight / implicit_weight.where(implicit_weight > 0)).fillna(0)
+    result["bac"] = np.where(implicit, unassigned * share * result["categoria"].notna(), explicit)
+    result["pv"] = result["bac"] * planned
+    result["ev"] = result["bac"] * result["avance"]
+    
+    # Gasto de la categoría no imputado a actividades: según EV, o BAC sin avance, o partes iguales
+    residual = (category_spent - cost.groupby(by_category).transform("sum")).clip(lower=0) * result["categoria"].notna()
+    basis = result["ev"].where(result["ev"].groupby(by_category).transform("sum") > 0, result["bac"])
+    basis = basis.where(basis.groupby(by_category).transform("sum") > 0, 1.0)
+    result["ac"] = cost + residual * basis / basis.groupby(by_category).transform("sum")
+    return result[columns]
+
+def compute_evm(activities: list, budget: dict, today) -> dict:
+    """Valor ganado por actividad, categoría de presupuesto y proyecto.
+
+    Por categoría, BAC y AC son el presupuesto y el gasto registrados; PV y EV suman sus
+    actividades. El proyecto suma las categorías más las actividades fuera de ellas (sin
+    categoría o con una que no está en el presupuesto) que tienen presupuesto o costo propios.
+    """
+    by_activity = evm_indices(compute_activity_evm(activities, budget, today))
+    categories = budget.get("categories", {})
+    by_category = pd.DataFrame({
+        "bac": [float(cat["budget"]) for cat in categories.values()],
+        "ac": [float(cat["executed"]) for cat in categories.values()],
+    }, index=pd.Index(list(categories), name="categoria"))
+    linked = by_activity.groupby("categoria")[["pv", "ev"]].sum()
+    by_category = by_category.join(linked).fillna({"pv": 0.0, "ev": 0.0})[["bac", "pv", "ev", "ac"]]
+    unlinked = ~by_activity["categoria"].isin(list(categories))
+    outside = by_activity.loc[unlinked, ["bac", "pv", "ev", "ac"]].sum()
+    project = evm_indices((by_category.sum() + outside).to_frame().T).iloc[0]
+    return {
+        "activities": by_activity,
+        "categories": evm_indices(by_category),
+        "project": project,
+        "unlinked_activities": int((unlinked & (by_activity["bac"] == 0)).sum()),
+    }
+
+def evm_record(values) -> dict:
+    """Índices EVM como dict serializable (NaN -> None)"""
+    return {field: None if pd.isna(values[field]) else round(float(values[field]), 4) for field in EVM_FIELDS}
+
+@st.cache_data(max_entries=S_CURVE_CACHE_ENTRIES, show_spinner=False)
+def cached_activity_evm(project_id, revisions: tuple, today, _activities: list, _budget: dict) -> pd.DataFrame:
+    """Valor ganado por actividad memorizado por proyecto, revisiones de actividades y presupuesto, y día"""
+    return compute_evm(_activities, _budget, today)["activities"]
+
+# --- RUTA CRÍTICA (CPM) ---
+
+class CriticalPathSchedule:
+    """Red de actividades con precedencias fin-inicio: fechas tempranas y tardías, holguras y ruta crítica.
+
+    Los tiempos son días desde el origen del proyecto. El inicio temprano es el máximo entre
+    la fecha_inicio planificada (release) y el fin temprano de las predecesoras. Para las
+    fechas tardías se guarda la "cola" de cada actividad (su duración más la cola mayor de sus
+    sucesoras): LS = término del proyecto - cola, así que un cambio en el término no obliga a
+    recorrer la red hacia atrás. El cálculo completo es O(V + E) (orden topológico de Kahn);
+    update() solo recorre las actividades alcanzadas por el cambio.
+    """
+
+    def __init__(self, durations: dict, release: dict, predecessors: dict, origin=None):
+        self.origin = origin
+        self.duration = dict(durations)
+        self.release = {node: release.get(node, 0) for node in self.duration}
+        self.preds = {node: [] for node in self.duration}
+        self.succs = {node: [] for node in self.duration}
+        for node, preds in predecessors.items():
+            if node in self.duration:
+                self._set_predecessors(node, preds)
+        self.recompute()
+
+    def _set_predecessors(self, node, preds) -> None:
+        for pred in self.preds[node]:
+            self.succs[pred].remove(node)
+        self.preds[node] = list(dict.fromkeys(pred for pred in preds if pred in self.duration and pred != node))
+        for pred in self.preds[node]:
+            self.succs[pred].append(node)
+
+    def topological_order(self) -> list:
+        """Orden de Kahn; ValueError si las precedencias forman un ciclo"""
+        indegree = {node: len(preds) for node, preds in self.preds.items()}
+        queue = deque(node for node, degree in indegree.items() if degree == 0)
+        order = []
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for succ in self.succs[node]:
+                indegree[succ] -= 1
+                if indegree[succ] == 0:
+                    queue.append(succ)
+        if len(order) < len(self.duration):
+            cycle = sorted(node for node, degree in indegree.items() if degree > 0)
+            raise ValueError(f"Las predecesoras forman un ciclo entre las actividades {cycle[:10]}")
+        return order
+
+    def recompute(self) -> None:
+        """Pasadas hacia adelante y hacia atrás sobre toda la red"""
+        order = self.topological_order()
+        self.position = {node: i for i, node in enumerate(order)}
+        self.early_start, self.early_finish, self.tail = {}, {}, {}
+        for node in order:
+            self._forward(node)
+        for node in reversed(order):
+            self._backward(node)
+
+    def _forward(self, node) -> bool:
+        """Recalcula el inicio/fin temprano de node; True si su fin temprano cambió"""
+        start = max([self.release[node]] + [self.early_finish[pred] for pred in self.preds[node]])
+        finish = start + self.duration[node]
+        changed = self.early_finish.get(node) != finish
+        self.early_start[node], self.early_finish[node] = start, finish
+        return changed
+
+    def _backward(self, node) -> bool:
+        """Recalcula la cola de node; True si cambió"""
+        tail = self.duration[node] + max([0] + [self.tail[succ] for succ in self.succs[node]])
+        changed = self.tail.get(node) != tail
+        self.tail[node] = tail
+        return changed
+
+    def creates_cycle(self, node, predecessors) -> bool:
+        """True si dar estas predecesoras a node cerraría un ciclo (alguna ya depende de node)"""
+        targets = {pred for pred in predecessors if pred in self.duration and pred != node}
+        stack, seen = [node], {node}
+        while stack and targets:
+            for succ in self.succs.get(stack.pop(), []):
+                if succ in targets:
+                    return True
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append(succ)
+        return False
+
+    def update(self, node, duration=None, release=None, predecessors=None) -> int:
+        """Aplica el cambio de una actividad (nueva, modificada o con otras predecesoras).
+
+        Propaga hacia adelante por las sucesoras y hacia atrás por las predecesoras en orden
+        topológico, deteniéndose donde los valores no cambian. Si una precedencia nueva
+        contradice el orden vigente se recalcula la red completa. Retorna cuántas actividades
+        se recalcularon; ValueError (sin modificar la red) si el cambio crea un ciclo.
+        """
+        if predecessors is not None and self.creates_cycle(node, predecessors):
+            raise ValueError(f"La actividad {node} no puede depender de una de sus sucesoras")
+        if node not in self.duration:
+            self.duration[node], self.release[node] = 1, 0
+            self.preds[node], self.succs[node] = [], []
+            self.position[node] = len(self.position)
+        if duration is not None:
+            self.duration[node] = duration
+        if release is not None:
+            self.release[node] = release
+        old_preds = list(self.preds[node])
+        if predecessors is not None:
+            self._set_predecessors(node, predecessors)
+            if any(self.position[pred] > self.position[node] for pred in self.preds[node]):
+                self.recompute()
+                return len(self.duration)
+        
+        visited = 0
+        heap = [(self.position[node], node)]
+        queued = {node}
+        while heap:  # Sucesoras en orden topológico
+            _, current = heapq.heappop(heap)
+            visited += 1
+            if self._forward(current) or current == node:
+                for succ in self.succs[current]:
+                    if succ not in queued:
+                        queued.add(succ)
+                        heapq.heappush(heap, (self.position[succ], succ))
+        heap = [(-self.position[current], current) for current in {node, *old_preds, *self.preds[node]}]
+        heapq.heapify(heap)
+        queued = {current for _, current in heap}
+        while heap:  # Predecesoras en orden topológico inverso
+            _, current = heapq.heappop(heap)
+            visited += 1
+            if self._backward(current) or current == node:
+                for pred in self.preds[current]:
+                    if pred not in queued:
+                        queued.add(pred)
+                        heapq.heappush(heap, (-self.position[pred], pred))
+        return visited
+
+    def copy(self) -> "CriticalPathSchedule":
+        """Copia independiente de la red, O(V + E) sin recalcular (update() sobre ella no toca el original)"""
+        clone = CriticalPathSchedule.__new__(CriticalPathSchedule)
+        clone.origin = self.origin
+        clone.duration, clone.release = dict(self.duration), dict(self.release)
+        clone.preds = {node: list(preds) for node, preds in self.preds.items()}
+        clone.succs = {node: list(succs) for node, succs in self.succs.items()}
+        clone.position = dict(self.position)
+        clone.early_start, clone.early_finish, clone.tail = dict(self.early_start), dict(self.early_finish), dict(self.tail)
+        return clone
+
+    @property
+    def project_finish(self) -> int:
+        return max(self.early_finish.values(), default=0)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Fechas tempranas y tardías, holgura total y libre y marca de ruta crítica por actividad"""
+        nodes = list(self.duration)
+        if not nodes:
+            return pd.DataFrame(columns=["id", "duracion", "es", "ef", "ls", "lf", "holgura_total", "holgura_libre", "critica"])
+        finish = self.project_finish
+        frame = pd.DataFrame({
+            "id": nodes,
+            "duracion": [self.duration[node] for node in nodes],
+            "es": [self.early_start[node] for node in nodes],
+            "ef": [self.early_finish[node] for node in nodes],
+            "ls": [finish - self.tail[node] for node in nodes],
+            "successor_es": [min((self.early_start[succ] for succ in self.succs[node]), default=finish) for node in nodes],
+        })
+        frame["lf"] = frame["ls"] + frame["duracion"]
+        frame["holgura_total"] = frame["ls"] - frame["es"]
+        frame["holgura_libre"] = frame["successor_es"] - frame["ef"]
+        frame["critica"] = frame["holgura_total"] <= 0
+        if self.origin is not None:
+            for column in ("es", "ef", "ls", "lf"):
+                frame[f"fecha_{column}"] = self.origin + pd.to_timedelta(frame[column], unit="D")
+        return frame.drop(columns="successor_es")
+
+def activity_network(activities: list) -> dict:
+    """Duraciones, fecha mínima de inicio y predecesoras por id de actividad (entradas de CriticalPathSchedule).
+
+    Sin fechas válidas una actividad dura un día y puede empezar en el origen.
+    """
+    schedule = activity_schedule(activities)
+    durations = schedule["duration"].astype(int).to_dict() if not schedule.empty else {}
+    starts = schedule["start"].astype(int).to_dict() if not schedule.empty else {}
+    nodes = [activity.get("id", position) for position, activity in enumerate(activities)]
+    predecessors = {node: activity.get("predecesoras") or [] for node, activity in zip(nodes, activities)}
+    release = {node: starts.get(position, 0) for position, node in enumerate(nodes)}
+    durations = {node: durations.get(position, 1) for position, node in enumerate(nodes)}
+    return {"durations": durations, "release": release, "predecessors": predecessors,
+            "origin": schedule.attrs.get("origin") if not schedule.empty else None}
+
+class ScheduleCache:
+    """Redes de ruta crítica por proyecto con la revisión de actividades que reflejan (LRU, compartida entre sesiones).
+
+    Una red guardada no se modifica: otras sesiones pueden estar leyéndola (to_frame) sin
+    lock. Para actualizarla se trabaja sobre una copy() y se reemplaza con put().
+    """
+
+    def __init__(self, max_projects: int):
+        self.max_projects = max_projects
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # project_id -> (revisión, CriticalPathSchedule)
+
+    def get(self, project_id, revision: str):
+        with self._lock:
+            entry = self._entries.get(project_id)
+            if entry is None or entry[0] != revision:
+                return None
+            self._entries.move_to_end(project_id)
+            return entry[1]
+
+    def put(self, project_id, revision: str, schedule: CriticalPathSchedule) -> None:
+        with self._lock:
+            self._entries[project_id] = (revision, schedule)
+            self._entries.move_to_end(project_id)
+            while len(self._entries) > self.max_projects:
+                self._entries.popitem(last=False)
+
+@st.cache_resource
+def get_schedule_cache() -> ScheduleCache:
+    """Instancia única de la caché de redes CPM por proceso"""
+    return ScheduleCache(SCHEDULE_CACHE_MAX_PROJECTS)
+
+# --- SIMULACIÓN MONTE CARLO (PLAZO Y COSTO) ---
+
+def risk_impacts(risks: list, budget_total: float) -> np.ndarray:
+    """Matriz (riesgos x 3) de probabilidad, días de atraso y costo de cada riesgo.
+
+    Usa "impacto_dias" e "impacto_costo" si el riesgo los trae; si no, los estima según su
+    nivel de impacto (RISK_IMPACT_DAYS y RISK_IMPACT_COST_SHARE del presupuesto).
+    """
+    rows = []
+    for risk in risks:
+        impact = risk.get("impacto", "Medio")
+        rows.append((
+            RISK_PROBABILITIES.get(risk.get("probabilidad"), RISK_PROBABILITIES["Media"]),
+            risk.get("impacto_dias") or RISK_IMPACT_DAYS.get(impact, 0),
+            risk.get("impacto_costo") or RISK_IMPACT_COST_SHARE.get(impact, 0) * budget_total,
+        ))
+    return np.array(rows, dtype=float).reshape(-1, 3)
+
+def simulate_schedule_risk(network: dict, progress: dict, risks: np.ndarray, cost: dict, today,
+                           iterations: int = MONTE_CARLO_ITERATIONS, seed: int = 0) -> dict:
+    """Distribución de la fecha de término y del costo final por Monte Carlo.
+
+    Cada iteración sortea el trabajo pendiente de cada actividad con una triangular
+    (MONTE_CARLO_DURATION_FACTORS), recorre la red en orden topológico vectorizando sobre
+    las iteraciones (el trabajo pendiente de una actividad sin terminar no se ejecuta antes
+    de hoy: una actividad atrasada termina hoy más lo que le falta) y suma los días de los
+    riesgos que ocurren. El costo es AC + (BAC - EV) por una triangular más el costo de
+    los riesgos ocurridos. Las iteraciones se procesan en bloques de MONTE_CARLO_CELL_BUDGET
+    celdas para acotar la memoria.
+    """
+    start_time = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    schedule = CriticalPathSchedule(**network)
+    order = schedule.topological_order()
+    position = {node: i for i, node in enumerate(order)}
+    base = np.array([schedule.duration[node] for node in order], dtype=float)
+    release = np.array([schedule.release[node] for node in order], dtype=float)
+    done = np.clip(np.array([progress.get(node, 0) for node in order], dtype=float) / 100, 0, 1)
+    preds = [np.array([position[pred] for pred in schedule.preds[node]], dtype=np.intp) for node in order]
+    origin = pd.Timestamp(network["origin"]) if network["origin"] is not None else pd.Timestamp(today)
+    today_idx = (pd.Timestamp(today) - origin).days
+    pending = done < 1
+    
+    finish = np.empty(iterations)
+    chunk = max(1, min(iterations, MONTE_CARLO_CELL_BUDGET // max(len(order), 1)))
+    for begin in range(0, iterations, chunk):
+        size = min(chunk, iterations - begin)
+        factors = rng.triangular(*MONTE_CARLO_DURATION_FACTORS, size=(len(order), size))
+        remaining = base[:, None] * (1 - done[:, None]) * factors
+        durations = base[:, None] * done[:, None] + remaining
+        early_finish = np.empty_like(durations)
+        for i in range(len(order)):
+            start = release[i] if not len(preds[i]) else np.maximum(release[i], early_finish[preds[i]].max(axis=0))
+            early_finish[i] = start + durations[i]
+            if pending[i]:
+                np.maximum(early_finish[i], today_idx + remaining[i], out=early_finish[i])
+        finish[begin:begin + size] = early_finish.max(axis=0) if len(order) else today_idx
+    
+    occurred = rng.random((iterations, len(risks))) < risks[:, 0]
+    finish += occurred @ risks[:, 1]
+    remaining = max(cost["bac"] - cost["ev"], 0)
+    total_cost = cost["ac"] + remaining * rng.triangular(*MONTE_CARLO_COST_FACTORS, size=iterations) + occurred @ risks[:, 2]
+    
+    finish_days = np.percentile(finish, MONTE_CARLO_PERCENTILES)
+    cost_values = np.percentile(total_cost, MONTE_CARLO_PERCENTILES)
+    deterministic = schedule.project_finish
+    counts, edges = np.histogram(finish, bins=30)
+    return {
+        "iterations": iterations,
+        "activities": len(order),
+        "risks": len(risks),
+        "computed_at": datetime.now().isoformat(),
+        "duration_ms": round((time.perf_counter() - start_time) * 1000, 1),
+        "deterministic_finish": (origin + pd.Timedelta(days=deterministic)).date(),
+        "on_time_probability": float((finish <= deterministic).mean()),
+        "finish": {f"p{pct}": (origin + pd.Timedelta(days=float(np.ceil(days)))).date()
+                   for pct, days in zip(MONTE_CARLO_PERCENTILES, finish_days)},
+        "cost": {f"p{pct}": float(value) for pct, value in zip(MONTE_CARLO_PERCENTILES, cost_values)},
+        "finish_histogram": pd.DataFrame({"Iteraciones": counts},
+                                         index=pd.Index(origin + pd.to_timedelta(np.round(edges[:-1]), unit="D"), name="Fecha de término")),
+    }
+
+class SimulationService:
+    """Ejecuta simulaciones Monte Carlo en un hilo de fondo y guarda los resultados por clave de revisión (LRU).
+
+    La clave incluye las revisiones de actividades, riesgos y presupuesto y el día, así que
+    un resultado nunca queda obsoleto: al cambiar los datos se pide otra clave. Mientras una
+    simulación corre, get retorna None. Una clave que falló no se vuelve a simular hasta
+    pasados MONTE_CARLO_RETRY_SECONDS (error() retorna el motivo mientras tanto).
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="simulation")
+        self._lock = threading.Lock()
+        self._results = OrderedDict()  # clave -> resultado
+        self._running = {}  # clave -> Future
+        self._failures = OrderedDict()  # clave -> (time.time() del fallo, mensaje)
+        self._stats = {"runs": 0, "failed": 0, "busy_ms": 0.0, "last_error": None}
+
+    def get(self, key: tuple) -> dict | None:
+        with self._lock:
+            if key not in self._results:
+                return None
+            self._results.move_to_end(key)
+            return self._results[key]
+
+    def submit(self, key: tuple, fn, *args, **kwargs) -> None:
+        """Programa fn(*args, **kwargs) para key si no hay ya un resultado o una ejecución en curso"""
+        with self._lock:
+            if key in self._results or key in self._running or self._recent_failure(key):
+                return
+            self._running[key] = self._executor.submit(self._run, key, fn, args, kwargs)
+
+    def is_running(self, key: tuple) -> bool:
+        with self._lock:
+            return key in self._running
+
+    def error(self, key: tuple) -> str | None:
+        """Motivo del último fallo de key si aún está dentro del plazo de reintento"""
+        with self._lock:
+            failure = self._recent_failure(key)
+            return failure[1] if failure else None
+
+    def _recent_failure(self, key: tuple):
+        failure = self._failures.get(key)
+        return failure if failure and time.time() - failure[0] < MONTE_CARLO_RETRY_SECONDS else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(cached=len(self._results), running=len(self._running))
+        stats["avg_ms"] = stats["busy_ms"] / stats["runs"] if stats["runs"] else 0.0
+        return stats
+
+    def _run(self, key: tuple, fn, args: tuple, kwargs: dict) -> None:
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+            with self._lock:
+                self._results[key] = result
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+                self._failures.pop(key, None)
+                self._stats["runs"] += 1
+                self._stats["busy_ms"] += (time.perf_counter() - start) * 1000
+        except Exception as e:
+            logger.error(f"Error en simulación Monte Carlo {key}: {e}")
+            with self._lock:
+                self._failures[key] = (time.time(), str(e))
+                while len(self._failures) > self.max_entries:
+                    self._failures.popitem(last=False)
+                self._stats["failed"] += 1
+                self._stats["last_error"] = str(e)
+        finally:
+            with self._lock:
+                self._running.pop(key, None)
+
+@st.cache_resource
+def get_simulation_service() -> SimulationService:
+    """Instancia única del simulador en segundo plano por proceso"""
+    return SimulationService(MONTE_CARLO_CACHE_ENTRIES)
+
+# --- GESTOR DE DATOS ---
+
+class DataManager:
+    def __init__(self):
+        self.use_gcp = False
+        self.db = None
+        self.bucket = None
+        
+        if GCP_LIB_AVAILABLE:
+            try:
+                if "gcp_service_account" in st.secrets:
+                    creds_dict = dict(st.secrets["gcp_service_account"])
+                    creds = service_account.Credentials.from_service_account_info(creds_dict)
+                    self.db = firestore.Client(credentials=creds)
+                    
+                    # Inicializar bucket si está configurado
+                    if "gcp_bucket_name" in st.secrets:
+                        self.bucket = storage.Client(credentials=creds).bucket(st.secrets["gcp_bucket_name"])
+                    
+                    self.use_gcp = True
+                    logger.info("Conexión a GCP establecida correctamente")
+            except Exception as e:
+                logger.error(f"Error conectando a GCP: {e}")
+                self.use_gcp = False
+        
+        # Cola offline: reintenta en segundo plano lo que no llegó a la nube
+        self.outbox = get_outbox()
+        self.blobs = get_blob_store()
+        self.blob_cache = get_blob_cache()
+        self.file_server = get_file_server()
+        if self.use_gcp:
+            self.outbox.attach(self.db, self.bucket)
+            if self.bucket is not None:
+                self.blobs.attach(self.bucket, self.outbox)
+                self.blob_cache.attach(self.bucket)
+                self.file_server.attach(self.bucket)
+        
+        # Estado Local
+        if not self.use_gcp:
+            if 'local_docs' not in st.session_state:
+                st.session_state.local_docs = [
+                    {"Archivo": "Plano_Estructural.pdf", "Versión": "v4.2", "Fecha": "28 Nov", "Estado": "Aprobado"},
+                    {"Archivo": "Detalles_Sanitarios.dwg", "Versión": "v2.1", "Fecha": "27 Nov", "Estado": "Revisión"}
+                ]
+            if 'local_inspections' not in st.session_state:
+                st.session_state.local_inspections = [
+                    {"Fecha": "Hoy 10:30", "Actividad": "Recepción Enfierradura", "Auditor": "María Torres", "Resultado": "Aprobado"}
+                ]
+
+    def save_inspection(self, data, photo=None, extra_photos=None):
+        """Guarda una inspección; las fotos se procesan en lote y suben en segundo plano"""
+        try:
+            photos = [p for p in [photo] + list(extra_photos or []) if p is not None]
+            data["Tiene_Foto"] = "Sí" if photos else "No"
+            if photos:
+                data["Foto_Path"] = None
+                data["Fotos"] = []
+            
+            # Agregar timestamp consistente
+            data["Timestamp"] = datetime.now().isoformat()
+            data["Fecha"] = format_date(datetime.now())
+            # Clave de idempotencia: el mismo ID se usa en la nube y en los reintentos
+            data.setdefault("Sync_Id", uuid.uuid4().hex)
+            data.setdefault("project_id", self.get_current_project_id())
+            
+            if photos:
+                # Se marca antes de persistir para que el registro nazca como "Pendiente"
+                data["Upload_Estado"] = "Pendiente"
+
+            if self.use_gcp:
+                try:
+                    self.db.collection("inspections").document(data["Sync_Id"]).set(cloud_record(data))
+                    st.toast("Guardado en Nube", icon="☁️")
+                    logger.info("Inspección guardada en Firestore")
+                except Exception as e:
+                    logger.error(f"Error guardando en Firestore: {e}")
+                    data["Sync_Estado"] = "Pendiente"
+                    self.outbox.enqueue_document("inspections", data, data["Sync_Id"])
+                    st.warning("Sin conexión con la nube. La inspección quedó en cola y se sincronizará automáticamente.")
+                    st.toast("Guardado en cola offline", icon="⏳")
+            else:
+                st.session_state.local_inspections.insert(0, data)
+                self._touch(st.session_state, "inspections")
+                st.toast("Guardado Localmente", icon="💾")
+                logger.info("Inspección guardada localmente")
+            self._update_record_kpis("inspection", data)
+            
+            # Procesar y guardar fotos en segundo plano
+            if photos:
+                photo_bytes = [p.getvalue() for p in photos]
+                touch = self._revision_toucher("inspections")
+                job_id = get_upload_service().submit(
+                    label=f"{len(photos)} foto(s) {data.get('Actividad', 'inspección')}",
+                    kind="photo",
+                    record=data,
+                    path_field="Foto_Path",
+                    store_fn=lambda job: self._store_inspection_photos(photo_bytes, data, job),
+                    on_done=lambda record: self._sync_record("inspections", record, touch),
+                )
+                st.session_state.setdefault("upload_job_ids", []).append(job_id)
+            
+            # Registrar en bitácora
+            self.add_audit_entry(
+                action="save_inspection",
+                entity_type="inspection",
+                entity_id=data.get("Actividad"),
+                details={"resultado": data.get("Resultado"), "tipo": data.get("Tipo")}
+            )
+        except Exception as e:
+            logger.error(f"Error en save_inspection: {e}")
+            st.error(f"Error al guardar la inspección: {str(e)}")
+
+    def _store_inspection_photos(self, photos: list, record: dict, job: dict) -> str:
+        """Procesa el lote de fotos en el pool de imágenes y las guarda en el almacén de blobs.
+
+        Se ejecuta en el pool de subidas; retorna la ruta de la primera foto (Foto_Path).
+        """
+        processed = get_image_service().process_photos(photos)
+        paths = []
+        originals = []
+        photo_index = get_photo_index()
+        rows = []
+        for index, (item, original) in enumerate(zip(processed, photos), start=1):
+            result = store_processed_photo(item, original)
+            rows.append(photo_index.make_row(
+                item["metadata"], result, "inspection", record["Sync_Id"],
+                label=record.get("Actividad"), location=record.get("Ubicacion"), project_id=record.get("project_id"),
+            ))
+            paths.append(result["path"])
+            originals.append(result["archive_path"])
+            if result["pending"]:
+                record["Sync_Estado"] = "Pendiente"
+            job["progress"] = index / len(processed)
+        photo_index.extend(rows)
+        record["Fotos"] = paths
+        record["Fotos_Originales"] = originals
+        record["SHA256"] = processed[0]["sha256"]
+        logger.info(f"{len(paths)} foto(s) de inspección guardadas")
+        return paths[0]
+
+    def report_incident(self, description: str, photos: list) -> dict:
+        """Registra un incidente; sus fotos se procesan en lote y suben en segundo plano"""
+        record = {
+            "Sync_Id": uuid.uuid4().hex,
+            "Descripcion": description,
+            "Reportado_Por": st.session_state.user_info['name'],
+            "Timestamp": datetime.now().isoformat(),
+            "project_id": self.get_current_project_id(),
+            "Tiene_Foto": "Sí" if photos else "No",
+        }
+        if photos:
+            record["Foto_Path"] = None
+            record["Upload_Estado"] = "Pendiente"
+            photo_bytes = [p.getvalue() for p in photos]
+            job_id = get_upload_service().submit(
+                label=f"{len(photos)} foto(s) incidente",
+                kind="photo",
+                record=record,
+                path_field="Foto_Path",
+                store_fn=lambda job: self._store_incident_photos(photo_bytes, record, job),
+            )
+            st.session_state.setdefault("upload_job_ids", []).append(job_id)
+        logger.warning(f"Incidente reportado por {record['Reportado_Por']}")
+        return record
+
+    def _store_incident_photos(self, photos: list, record: dict, job: dict) -> str:
+        """Procesa y guarda las fotos de un incidente en el pool de subidas; retorna la ruta de la primera"""
+        processed = get_image_service().process_photos(photos)
+        paths = []
+        photo_index = get_photo_index()
+        rows = []
+        for index, (item, original) in enumerate(zip(processed, photos), start=1):
+            result = store_processed_photo(item, original)
+            rows.append(photo_index.make_row(
+                item["metadata"], result, "incident", record["Sync_Id"],
+                label=record["Descripcion"][:120] or "Incidente", project_id=record.get("project_id"),
+            ))
+            paths.append(result["path"])
+            job["progress"] = index / len(processed)
+        photo_index.extend(rows)
+        record["Fotos"] = paths
+        logger.info(f"{len(paths)} foto(s) de incidente guardadas")
+        return paths[0]
+
+    def backfill_photo_index(self) -> int:
+        """Registra en el índice las fotos guardadas antes de que existiera (inspecciones y documentos escaneados).
+
+        Los metadatos se leen del original archivado cuando lo hay (la versión de
+        entrega ya no conserva EXIF). Retorna el número de fotos agregadas.
+        """
+        photo_index = get_photo_index()
+        known = photo_index.indexed()
+        candidates = []
+        for record in self.get_inspections():
+            paths = record.get("Fotos") or ([record["Foto_Path"]] if record.get("Foto_Path") else [])
+            originals = record.get("Fotos_Originales") or []
+            for position, path in enumerate(paths):
+                archive = originals[position] if position < len(originals) else None
+                candidates.append(("inspection", record, path, archive, record.get("Actividad"), record.get("Ubicacion")))
+        for record in self.get_docs():
+            path = record.get("File_Path")
+            if path and Path(path).suffix.lower() in ALLOWED_IMAGE_TYPES:
+                candidates.append(("document", record, path, None, record.get("Archivo"), None))
+        
+        rows = []
+        for entity_type, record, path, archive, label, location in candidates:
+            entity_id = record.get("Sync_Id") or record.get("Timestamp")
+            if not entity_id or path.startswith("http") or (entity_type, entity_id, path) in known:
+                continue
+            local = resolve_stored_path(path)
+            if local is None:
+                continue
+            try:
+                image_bytes = local.read_bytes()
+                archive_local = resolve_stored_path(archive)
+                source_bytes = archive_local.read_bytes() if archive_local is not None else image_bytes
+                metadata = get_image_service().submit(extract_photo_metadata, source_bytes).result()
+            except Exception as e:
+                logger.warning(f"Error leyendo foto antigua {path}: {e}")
+                continue
+            blob = {"sha256": hashlib.sha256(image_bytes).hexdigest(), "path": path, "size": len(image_bytes), "archive_path": archive}
+            rows.append(photo_index.make_row(
+                metadata, blob, entity_type, entity_id, label=label, location=location,
+                project_id=record.get("project_id"), ingested_at=record.get("Timestamp"),
+            ))
+            known.add((entity_type, entity_id, path))
+        photo_index.extend(rows)
+        logger.info(f"{len(rows)} foto(s) antiguas agregadas al índice de fotos")
+        return len(rows)
+
+    def _sync_record(self, collection: str, record: dict, touch=None) -> None:
+        """Re-escribe en Firestore un registro cuya subida terminó (idempotente por Sync_Id).
+
+        touch (de _revision_toucher) renueva la revisión de la colección: el registro cambió en sitio.
+        """
+        if self.use_gcp:  # En modo local el registro en sesión ya se actualizó en sitio
+            # Una instantánea anterior en el outbox pisaría File_Path/Foto_Path al reproducirse
+            self.outbox.discard_document(record["Sync_Id"])
+            try:
+                self.db.collection(collection).document(record["Sync_Id"]).set(cloud_record(record))
+            except Exception as e:
+                logger.error(f"Error actualizando {collection}/{record['Sync_Id']} en Firestore: {e}")
+                record["Sync_Estado"] = "Pendiente"
+                self.outbox.enqueue_document(collection, record, record["Sync_Id"])
+        if touch:
+            touch()
+
+    def get_inspections(self):
+        """Obtiene todas las inspecciones"""
+        try:
+            if self.use_gcp:
+                docs = self.db.collection("inspections").order_by("Timestamp", direction=firestore.Query.DESCENDING).limit(100).stream()
+                return self.outbox.merge_pending("inspections", [doc.to_dict() for doc in docs])
+            return st.session_state.local_inspections
+        except Exception as e:
+            logger.error(f"Error obteniendo inspecciones: {e}")
+            st.error("Error al cargar inspecciones")
+            if self.use_gcp:
+                return self.outbox.pending_documents("inspections")
+            return st.session_state.local_inspections if 'local_inspections' in st.session_state else []
+
+    def upload_file(self, uploaded_file, metadata):
+        """Valida y registra un archivo; la subida continúa en segundo plano"""
+        try:
+            # Validar archivo (una sola inspección del buffer, sin copias)
+            ingested = ingest_upload(uploaded_file)
+            if metadata.get("source") == "camera":
+                # Documentos escaneados con la cámara: fotos, con el límite de tamaño de imágenes
+                is_valid, message = validate_ingested(ingested, MAX_IMAGE_SIZE_MB, ALLOWED_IMAGE_TYPES)
+            else:
+                is_valid, message = validate_ingested(ingested, MAX_FILE_SIZE_MB, ALLOWED_FILE_TYPES)
+            if not is_valid:
+                st.error(message)
+                return False
+            
+            # Registrar en base de datos (File_Path se completa al terminar la subida)
+            new_doc = {
+                "Archivo": uploaded_file.name,
+                "Versión": metadata.get("version", "v1.0"),
+                "Fecha": datetime.now().strftime("%d/%m/%Y"),
+                "Estado": "Pendiente",
+                "File_Path": None,
+                "Timestamp": datetime.now().isoformat(),
+                "Sync_Id": uuid.uuid4().hex,
+                "Upload_Estado": "Pendiente",
+                "project_id": self.get_current_project_id()
+            }
+            if ingested["ext"] in DELTA_DOCUMENT_TYPES:
+                # Revisiones del mismo plano (v4.2, v4.3...) comparten documento lógico
+                new_doc["Documento_Id"] = document_id(new_doc["project_id"], uploaded_file.name)
+            
+            if self.use_gcp:
+                try:
+                    self.db.collection("documents").document(new_doc["Sync_Id"]).set(cloud_record(new_doc))
+                except Exception as e:
+                    logger.error(f"Error guardando documento en Firestore: {e}")
+                    new_doc["Sync_Estado"] = "Pendiente"
+                    self.outbox.enqueue_document("documents", new_doc, new_doc["Sync_Id"])
+            else:
+                if 'local_docs' not in st.session_state:
+                    st.session_state.local_docs = []
+                st.session_state.local_docs.insert(0, new_doc)
+                self._touch(st.session_state, "docs")
+            self._update_record_kpis("document", new_doc)
+            
+            # Guardar archivo en segundo plano: el mismo buffer, leído por bloques una sola vez
+            content_type = ingested["content_type"]
+            source = BufferReader(ingested["buffer"])
+            touch = self._revision_toucher("docs")
+            job_id = get_upload_service().submit(
+                label=uploaded_file.name,
+                kind="document",
+                record=new_doc,
+                path_field="File_Path",
+                store_fn=lambda job: self._store_document(source, ingested["ext"], content_type, new_doc, job),
+                on_done=lambda record: self._finish_document(record, source, ingested["ext"], touch),
+            )
+            st.session_state.setdefault("upload_job_ids", []).append(job_id)
+            
+            st.toast("Archivo registrado, subiendo en segundo plano", icon="📂")
+            # Registrar en bitácora
+            self.add_audit_entry(
+                action="upload_file",
+                entity_type="document",
+                entity_id=new_doc.get("Archivo"),
+                details={"version": new_doc.get("Versión"), "estado": new_doc.get("Estado")}
+            )
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error en upload_file: {e}")
+            st.error(f"Error al subir archivo: {str(e)}")
+            return False
+
+    def _store_document(self, source, file_ext: str, content_type: str | None, record: dict, job: dict) -> str:
+        """Guarda un documento en el almacén de blobs por bloques (se ejecuta en el pool de subidas)"""
+        total_size = get_stream_size(source) or 1
+        
+        def report_progress(done_bytes):
+            job["progress"] = min(done_bytes / total_size, 1.0)
+        
+        result = self.blobs.put(source, file_ext, content_type, progress_cb=report_progress)
+        if file_ext in ALLOWED_IMAGE_TYPES:
+            # Documentos escaneados con la cámara
+            source.seek(0)
+            image_bytes = bytes(source.read())
+            store_photo_variants(result, image_bytes)
+            get_photo_index().add(
+                get_image_service().submit(extract_photo_metadata, image_bytes).result(), result,
+                "document", record["Sync_Id"], label=record.get("Archivo"), project_id=record.get("project_id"),
+            )
+        elif record.get("Documento_Id"):
+            source.seek(0)
+            try:
+                revision = get_document_versions().add_revision(record, source.read(), result)
+                record["Revisión"] = revision["number"]
+            except Exception as e:
+                # El archivo completo ya quedó guardado: solo se pierde el historial por fragmentos
+                logger.error(f"Error registrando revisión de {record.get('Archivo')}: {e}")
+        record["Tamaño_Bytes"] = result["size"]
+        record["SHA256"] = result["sha256"]
+        if result["pending"]:
+            record["Sync_Estado"] = "Pendiente"
+        if file_ext in DELTA_DOCUMENT_TYPES:
+            record["Metadatos_Estado"] = "Pendiente"  # Se extraen en _finish_document, con File_Path ya asignado
+        logger.info(f"Documento guardado: {result['path']} ({'duplicado' if result['deduplicated'] else 'nuevo'})")
+        return result["path"]
+
+    def _finish_document(self, record: dict, source, file_ext: str, touch=None) -> None:
+        """Cierre de la subida de un documento: sincroniza el registro y, si es un plano, programa sus metadatos.
+
+        La extracción se programa después de que UploadService asignó File_Path/Upload_Estado
+        y de su escritura a Firestore, así que la escritura de los metadatos siempre es la última.
+        """
+        self._sync_record("documents", record, touch)
+        if file_ext in DELTA_DOCUMENT_TYPES and record.get("Upload_Estado") == "Completado":
+            source.seek(0)
+            get_plan_metadata_service().submit(
+                record, source.read(), file_ext, on_done=lambda r: self._sync_record("documents", r, touch)
+            )
+
+    def get_docs(self):
+        """Obtiene todos los documentos"""
+        try:
+            if self.use_gcp:
+                docs = self.db.collection("documents").order_by("Timestamp", direction=firestore.Query.DESCENDING).limit(100).stream()
+                return self.outbox.merge_pending("documents", [doc.to_dict() for doc in docs])
+            return st.session_state.local_docs
+        except Exception as e:
+            logger.error(f"Error obteniendo documentos: {e}")
+            if self.use_gcp:
+                return self.outbox.pending_documents("documents")
+            return st.session_state.local_docs if 'local_docs' in st.session_state else []
+    
+    # --- MÉTODOS PARA GESTIÓN DE PROYECTOS Y DATOS ---
+    
+    def get_db(self):
+        """Obtiene la base de datos completa"""
+        if self.use_gcp:
+            # En GCP se obtendría de Firestore
+            return get_default_db()
+        if 'json_db' not in st.session_state:
+            st.session_state.json_db = load_json_db()
+        return st.session_state.json_db
+    
+    def save_db(self, db_data):
         """Guarda la base de datos"""
         if self.use_gcp:
             # En GCP se guardaría en Firestore
@@ -1568,6 +4352,8 @@ class DataManager:
         for project in projects:
             if project.get("id") == project_id:
                 project["data"] = project_data
+                self._refresh_evm(project_data)
+                self._evaluate_alerts(db, project_id, project_data)
                 self.save_db(db)
                 return True
         return False
@@ -1648,6 +4434,10 @@ class DataManager:
         activity_data["id"] = len(project_data["activities"]) + 1
         activity_data["created_at"] = datetime.now().isoformat()
         project_data["activities"].append(activity_data)
+        self._update_kpis(project_data, "activity", new=activity_data)
+        previous_revision = self.get_revision("activities")
+        self._touch(project_data, "activities")
+        self._update_schedule(previous_revision, activity_data)
         self.save_current_project_data(project_data)
         # Registrar en bitácora
         self.add_audit_entry(
@@ -1669,6 +4459,8 @@ class DataManager:
         personnel_data["id"] = len(project_data["personnel"]) + 1
         personnel_data["created_at"] = datetime.now().isoformat()
         project_data["personnel"].append(personnel_data)
+        self._update_kpis(project_data, "personnel", new=personnel_data)
+        self._touch(project_data, "personnel")
         self.save_current_project_data(project_data)
         # Registrar en bitácora
         self.add_audit_entry(
@@ -1691,6 +4483,8 @@ class DataManager:
         improvement_data["created_at"] = datetime.now().isoformat()
         improvement_data["status"] = "Pendiente"
         project_data["improvements"].append(improvement_data)
+        self._update_kpis(project_data, "improvement", new=improvement_data)
+        self._touch(project_data, "improvements")
         self.save_current_project_data(project_data)
         # Registrar en bitácora
         self.add_audit_entry(
@@ -1711,8 +4505,11 @@ class DataManager:
         project_data = self.get_current_project_data()
         for improvement in project_data.get("improvements", []):
             if improvement.get("id") == improvement_id:
+                previous = dict(improvement)
                 improvement["status"] = new_status
                 improvement["updated_at"] = datetime.now().isoformat()
+                self._update_kpis(project_data, "improvement", new=improvement, old=previous)
+                self._touch(project_data, "improvements")
                 self.save_current_project_data(project_data)
                 # Registrar en bitácora
                 self.add_audit_entry(
@@ -1724,25 +4521,391 @@ class DataManager:
                 return True
         return False
     
-    def update_budget(self, category, amount):
-        """Actualiza el presupuesto ejecutado del proyecto actual"""
+    def update_budget(self, category, amount, activity_id=None):
+        """Actualiza el presupuesto ejecutado del proyecto actual (opcionalmente imputado a una actividad).
+
+        Un gasto imputado a una actividad debe ser de la categoría de esa actividad; si no
+        coincide no se registra (el AC de la categoría y el de la actividad quedarían descuadrados).
+        """
         project_data = self.get_current_project_data()
         budget = project_data.get("budget", get_default_project_data()["budget"])
         if category in budget["categories"]:
+            activity = None
+            if activity_id is not None:
+                activity = next((a for a in project_data["activities"] if a.get("id") == activity_id), None)
+                if activity is None or activity.get("categoria") != category:
+                    logger.warning(f"Gasto de {category} rechazado: la actividad {activity_id} no pertenece a esa categoría")
+                    return False
             budget["categories"][category]["executed"] += amount
             budget["executed"] += amount
             project_data["budget"] = budget
+            self._touch(project_data, "budget")
+            if activity is not None:
+                activity["costo_real"] = activity.get("costo_real", 0) + amount
+                self._touch(project_data, "activities")
             self.save_current_project_data(project_data)
             # Registrar en bitácora
             self.add_audit_entry(
                 action="update_budget",
                 entity_type="budget",
                 entity_id=category,
-                details={"monto": amount}
+                details={"monto": amount, "actividad": activity_id}
             )
             return True
         return False
     
+    # --- VALOR GANADO ---
+    def _refresh_evm(self, project_data: dict) -> dict:
+        """Recalcula los índices EVM del proyecto si cambiaron actividades, presupuesto o el día.
+
+        Guarda el resumen por proyecto y categoría en project_data["evm"] y un punto diario en
+        project_data["evm_history"] (el del día se reemplaza), que es lo que leen los paneles.
+        """
+        revisions = project_data.setdefault("data_revisions", {})
+        today = datetime.now().date()
+        inputs = [revisions.setdefault("activities", uuid.uuid4().hex), revisions.setdefault("budget", uuid.uuid4().hex),
+                  today.isoformat()]
+        state = project_data.get("evm") or {}
+        if state.get("version") == EVM_VERSION and state.get("inputs") == inputs:
+            return state
+        
+        evm = compute_evm(project_data.get("activities", []),
+                          project_data.get("budget", get_default_project_data()["budget"]), today)
+        state = {
+            "version": EVM_VERSION,
+            "inputs": inputs,
+            "computed_at": datetime.now().isoformat(),
+            "project": evm_record(evm["project"]),
+            "categories": {category: evm_record(row) for category, row in evm["categories"].iterrows()},
+            "unlinked_activities": evm["unlinked_activities"],
+        }
+        project_data["evm"] = state
+        point = {"fecha": today.isoformat(), **{field: state["project"][field] for field in ("pv", "ev", "ac", "cpi", "spi", "eac")}}
+        history = project_data.setdefault("evm_history", [])
+        if history and history[-1]["fecha"] == point["fecha"]:
+            history[-1] = point
+        else:
+            history.append(point)
+        del history[:-EVM_HISTORY_MAX_POINTS]
+        return state
+
+    def get_evm(self) -> dict:
+        """Índices EVM guardados del proyecto actual (se recalculan y guardan solo si quedaron desactualizados)"""
+        project_data = self.get_current_project_data()
+        state = project_data.get("evm") or {}
+        if self._refresh_evm(project_data) is not state and self.get_current_project_id():
+            self.save_current_project_data(project_data)
+        return project_data["evm"]
+
+    def get_evm_history(self) -> pd.DataFrame:
+        """Serie diaria de PV, EV, AC, CPI, SPI y EAC del proyecto actual, indexada por fecha"""
+        self.get_evm()
+        history = pd.DataFrame(self.get_current_project_data().get("evm_history", []))
+        if history.empty:
+            return history
+        history["fecha"] = pd.to_datetime(history["fecha"])
+        return history.set_index("fecha").astype(float)
+
+    def get_activity_evm(self) -> pd.DataFrame:
+        """Valor ganado e índices por actividad del proyecto actual (memorizado por revisión)"""
+        return cached_activity_evm(self.get_current_project_id(),
+                                   (self.get_revision("activities"), self.get_revision("budget")),
+                                   datetime.now().date(), self.get_activities(), self.get_budget())
+    
+    # --- SIMULACIÓN DE RIESGO ---
+    def get_schedule_risk(self, iterations: int = MONTE_CARLO_ITERATIONS) -> dict | None:
+        """Simulación Monte Carlo de plazo y costo del proyecto actual, o None mientras corre en segundo plano.
+
+        El resultado se guarda por revisión de actividades, riesgos y presupuesto (y el día),
+        así que solo se vuelve a simular cuando cambian los datos.
+        """
+        project_id = self.get_current_project_id()
+        key = self._schedule_risk_key(iterations)
+        service = get_simulation_service()
+        result = service.get(key)
+        if result is None and not service.is_running(key):
+            activities = self.get_activities()
+            risks = [risk for risk in self.get_risks() if risk.get("project_id") == project_id]
+            evm = self.get_evm()["project"]
+            network = activity_network(activities)
+            progress = dict(zip(network["durations"], numeric_column(pd.DataFrame(activities), "avance"))) if activities else {}
+            service.submit(key, simulate_schedule_risk, network, progress, risk_impacts(risks, evm["bac"]), evm,
+                           datetime.now().date(), iterations=iterations, seed=zlib.crc32(repr(key).encode()))
+        return result
+
+    def get_schedule_risk_error(self, iterations: int = MONTE_CARLO_ITERATIONS) -> str | None:
+        """Motivo del fallo de la simulación vigente (None si no falló o ya se puede reintentar)"""
+        return get_simulation_service().error(self._schedule_risk_key(iterations))
+
+    def _schedule_risk_key(self, iterations: int) -> tuple:
+        return (self.get_current_project_id(), self.get_revision("activities"), self.get_revision("risks"),
+                self.get_revision("budget"), datetime.now().date().isoformat(), iterations)
+    
+    # --- RUTA CRÍTICA ---
+    def update_activity(self, activity_id, changes: dict) -> bool:
+        """Modifica una actividad del proyecto actual (avance, fechas, predecesoras...) y actualiza su red CPM"""
+        project_data = self.get_current_project_data()
+        activity = next((a for a in project_data["activities"] if a.get("id") == activity_id), None)
+        if activity is None:
+            return False
+        if "predecesoras" in changes and self.get_critical_path().creates_cycle(activity_id, changes["predecesoras"]):
+            logger.warning(f"Predecesoras rechazadas para la actividad {activity_id}: forman un ciclo")
+            return False
+        old = dict(activity)
+        activity.update(changes)
+        self._update_kpis(project_data, "activity", new=activity, old=old)
+        previous_revision = self.get_revision("activities")
+        self._touch(project_data, "activities")
+        self._update_schedule(previous_revision, activity)
+        self.save_current_project_data(project_data)
+        self.add_audit_entry(
+            action="update_activity",
+            entity_type="activity",
+            entity_id=activity_id,
+            details={key: value for key, value in changes.items() if old.get(key) != value}
+        )
+        return True
+
+    def _update_schedule(self, previous_revision: str, activity: dict) -> None:
+        """Lleva la red CPM en caché a la nueva revisión aplicando solo el cambio de activity.
+
+        Si no hay red para la revisión anterior, o la actividad empieza antes del origen de la
+        red, no se hace nada: la próxima lectura la reconstruye completa. El cambio se aplica
+        a una copia, que reemplaza a la red compartida bajo el lock de la caché.
+        """
+        cache = get_schedule_cache()
+        project_id = self.get_current_project_id()
+        schedule = cache.get(project_id, previous_revision)
+        if schedule is None:
+            return
+        network = activity_network([activity])
+        node = activity.get("id")
+        release = network["release"][node]
+        if network["origin"] is not None:
+            if schedule.origin is None or network["origin"] < schedule.origin:
+                return
+            release += (network["origin"] - schedule.origin).days
+        schedule = schedule.copy()
+        try:
+            schedule.update(node, network["durations"][node], release, network["predecessors"][node])
+        except ValueError as e:
+            logger.warning(f"Red CPM sin actualizar: {e}")
+            return
+        cache.put(project_id, self.get_revision("activities"), schedule)
+
+    def get_critical_path(self) -> CriticalPathSchedule:
+        """Red CPM del proyecto actual para la revisión vigente de sus actividades (se construye si no está en caché)"""
+        cache = get_schedule_cache()
+        project_id, revision = self.get_current_project_id(), self.get_revision("activities")
+        schedule = cache.get(project_id, revision)
+        if schedule is None:
+            network = activity_network(self.get_activities())
+            try:
+                schedule = CriticalPathSchedule(**network)
+            except ValueError as e:
+                logger.error(f"Red CPM del proyecto {project_id} sin precedencias: {e}")
+                schedule = CriticalPathSchedule(network["durations"], network["release"], {}, network["origin"])
+            cache.put(project_id, revision, schedule)
+        return schedule
+
+    def get_critical_path_frame(self) -> pd.DataFrame:
+        """Fechas CPM, holguras y ruta crítica por actividad del proyecto actual, con su nombre"""
+        frame = self.get_critical_path().to_frame()
+        names = {activity.get("id"): activity.get("nombre", "") for activity in self.get_activities()}
+        frame.insert(1, "nombre", frame["id"].map(names))
+        return frame
+    
+    # --- DATAFRAMES EN CACHÉ ---
+    def _touch(self, container, collection: str) -> None:
+        """Renueva el token de revisión de una colección tras escribirla (sus DataFrames en caché dejan de usarse)"""
+        container.setdefault("data_revisions", {})[collection] = uuid.uuid4().hex
+
+    def _revision_container(self, collection: str):
+        """Dónde vive el token de revisión: datos del proyecto, base global, sesión o el proceso (Firestore)"""
+        if collection in ("activities", "personnel", "improvements", "milestones", "budget"):
+            return self.get_current_project_data()
+        if collection in ("risks", "alerts"):
+            return self.get_db()
+        return get_shared_revisions() if self.use_gcp else st.session_state
+
+    def _revision_toucher(self, collection: str):
+        """Función que renueva la revisión de collection desde un hilo en segundo plano.
+
+        El diccionario de revisiones se resuelve aquí, en el hilo de la sesión: los
+        trabajos en segundo plano no tienen acceso a st.session_state.
+        """
+        revisions = self._revision_container(collection).setdefault("data_revisions", {})
+        
+        def touch():
+            revisions[collection] = uuid.uuid4().hex
+        return touch
+
+    def get_revision(self, collection: str) -> str:
+        """Token de revisión vigente de una colección"""
+        container = self._revision_container(collection)
+        return container.setdefault("data_revisions", {}).setdefault(collection, uuid.uuid4().hex)
+
+    def get_s_curve(self, freq: str = "W") -> pd.DataFrame:
+        """Curva S del proyecto actual, recalculada solo si cambian sus actividades (o el día)"""
+        return cached_s_curve(self.get_current_project_id(), self.get_revision("activities"), datetime.now().date(),
+                              freq, self.get_activities())
+
+    def get_frame(self, collection: str, records: list | None = None) -> pd.DataFrame:
+        """DataFrame tipado de una colección, reutilizado mientras su revisión no cambie.
+
+        records evita volver a leer la colección si quien llama ya la tiene. Las subidas en
+        segundo plano renuevan la revisión de inspecciones y documentos al actualizarlos en
+        sitio; en Firestore se suma una huella de los registros de la ventana leída.
+        """
+        if records is None:
+            records = getattr(self, f"get_{collection}")()
+        revision = self.get_revision(collection)
+        if self.use_gcp and collection in ("inspections", "docs"):
+            revision = f"{revision}:{records_fingerprint(records)}"
+        return get_frame_cache().get(collection, revision, records)
+
+    # --- ACUMULADOS DE KPIs ---
+    def _update_kpis(self, project_data: dict, kind: str, new: dict | None = None, old: dict | None = None) -> None:
+        """Aplica en O(1) el cambio de un registro a los acumulados (quien llama guarda project_data)"""
+        aggregates = project_data.get("kpi_aggregates")
+        if not aggregates or aggregates.get("version") != KPI_AGGREGATES_VERSION:
+            return  # Se reconstruyen completos en la próxima lectura
+        for record, sign in ((old, -1), (new, 1)):
+            if record is not None:
+                for key, value in kpi_contribution(kind, record).items():
+                    aggregates[key] += sign * value
+        aggregates["updated_at"] = datetime.now().isoformat()
+
+    def _update_record_kpis(self, kind: str, record: dict, old: dict | None = None) -> None:
+        """Acumulados de registros que no viven en project_data (inspecciones, documentos).
+
+        En Firestore se guardan con el proyecto; en modo local se llevan en la sesión, igual
+        que los registros (los guardados en database.json no coincidirían tras reiniciar).
+        """
+        project_id = record.get("project_id")
+        if project_id is None or project_id != self.get_current_project_id():
+            return
+        project_data = self.get_current_project_data()
+        if self.use_gcp:
+            self._update_kpis(project_data, kind, new=record, old=old)
+        else:
+            counts = st.session_state.setdefault("record_kpis", {}).get(project_id)
+            if counts is None:
+                self._session_record_kpis(project_id)  # Se cuentan desde la sesión, que ya incluye record
+            else:
+                for item, sign in ((old, -1), (record, 1)):
+                    if item is not None:
+                        for key, value in kpi_contribution(kind, item).items():
+                            counts[key] += sign * value
+        self.save_current_project_data(project_data)  # Re-evalúa las alertas con los nuevos conteos
+
+    def _session_record_kpis(self, project_id) -> dict:
+        """Conteos de inspecciones y documentos de un proyecto desde las colecciones de la sesión (modo local)"""
+        counts = st.session_state.setdefault("record_kpis", {})
+        if project_id not in counts:
+            aggregates = self._collect_kpi_aggregates(project_id, {}, include_unassigned=project_id == self.get_current_project_id())
+            counts[project_id] = {key: aggregates[key] for key in RECORD_KPI_KEYS}
+        return counts[project_id]
+
+    def _with_record_kpis(self, project_id, aggregates: dict) -> dict:
+        """Acumulados con los conteos de inspecciones y documentos del mismo alcance que esos registros"""
+        if self.use_gcp:
+            return aggregates
+        return {**aggregates, **self._session_record_kpis(project_id)}
+
+    def get_kpi_aggregates(self) -> dict:
+        """Acumulados de KPIs del proyecto actual (se reconstruyen si faltan o cambió su versión)"""
+        aggregates = self.get_current_project_data().get("kpi_aggregates")
+        if not aggregates or aggregates.get("version") != KPI_AGGREGATES_VERSION:
+            aggregates = self.rebuild_kpi_aggregates()
+        return self._with_record_kpis(self.get_current_project_id(), aggregates)
+
+    def rebuild_kpi_aggregates(self) -> dict:
+        """Recalcula los acumulados recorriendo las colecciones (migración o reparación).
+
+        Inspecciones y documentos sin project_id (anteriores a ese campo) se cuentan en el proyecto actual.
+        """
+        project_id = self.get_current_project_id()
+        project_data = self.get_current_project_data()
+        aggregates = self._collect_kpi_aggregates(project_id, project_data, include_unassigned=True)
+        project_data["kpi_aggregates"] = aggregates
+        self.save_current_project_data(project_data)
+        logger.info(f"Acumulados de KPIs reconstruidos para el proyecto {project_id}")
+        return aggregates
+
+    def _collect_kpi_aggregates(self, project_id, project_data: dict, include_unassigned: bool = False,
+                                inspections: list | None = None, docs: list | None = None) -> dict:
+        """Acumulados de un proyecto calculados desde sus colecciones (no los guarda)"""
+        owners = (None, project_id) if include_unassigned else (project_id,)
+        inspections = self.get_inspections() if inspections is None else inspections
+        docs = self.get_docs() if docs is None else docs
+        aggregates = get_default_kpi_aggregates()
+        sources = [
+            ("activity", project_data.get("activities", [])),
+            ("personnel", project_data.get("personnel", [])),
+            ("improvement", project_data.get("improvements", [])),
+            ("inspection", [r for r in inspections if r.get("project_id") in owners]),
+            ("document", [r for r in docs if r.get("project_id") in owners]),
+        ]
+        for kind, records in sources:
+            for record in records:
+                for key, value in kpi_contribution(kind, record).items():
+                    aggregates[key] += value
+        aggregates["updated_at"] = datetime.now().isoformat()
+        return aggregates
+
+    # --- PORTAFOLIO (TODOS LOS PROYECTOS) ---
+    def get_portfolio_frame(self) -> pd.DataFrame:
+        """Indicadores de todos los proyectos (una fila por proyecto), de solo lectura: no guarda nada.
+
+        Se arma una tabla columnar con los acumulados de KPIs y el presupuesto de cada
+        proyecto y los indicadores se calculan en una sola pasada vectorizada
+        (compute_portfolio_kpis). Los proyectos sin acumulados vigentes se calculan en
+        memoria desde sus colecciones.
+        """
+        db = self.get_db()
+        current_id = self.get_current_project_id()
+        rows = []
+        shared = {}
+        for project in db.get("projects", []):
+            data = project.get("data") or get_default_project_data()
+            aggregates = data.get("kpi_aggregates")
+            if not aggregates or aggregates.get("version") != KPI_AGGREGATES_VERSION:
+                if not shared:
+                    shared = {"inspections": self.get_inspections(), "docs": self.get_docs()}
+                aggregates = self._collect_kpi_aggregates(project["id"], data, project["id"] == current_id, **shared)
+            aggregates = self._with_record_kpis(project["id"], aggregates)
+            budget = data.get("budget") or {}
+            active_alerts = (data.get("alert_state") or {}).get("active", {}).values()
+            rows.append({
+                **{key: aggregates.get(key, 0) for key in get_default_kpi_aggregates() if key not in ("version", "updated_at")},
+                "project_id": project["id"],
+                "name": project.get("name", "Sin nombre"),
+                "status": project.get("status", "Activo"),
+                "location": project.get("location", ""),
+                "construction_type": project.get("construction_type", ""),
+                "budget_total": budget.get("total", 0),
+                "budget_executed": budget.get("executed", 0),
+                "critical_alerts": sum(alert["severity"] == "critical" for alert in active_alerts),
+            })
+        if not rows:
+            return pd.DataFrame()
+        
+        frame = pd.DataFrame.from_records(rows, index="project_id")
+        portfolio = frame[["name", "status", "location", "construction_type"]].join(compute_portfolio_kpis(frame))
+        portfolio["critical_alerts"] = frame["critical_alerts"]
+        
+        # Riesgos por proyecto en una sola agrupación (los anteriores a project_id no se asignan a ninguno)
+        risks = self.get_frame("risks")
+        portfolio["risks"] = 0
+        portfolio["high_risks"] = 0
+        if not risks.empty and "project_id" in risks.columns:
+            portfolio["risks"] = risks.groupby("project_id").size().reindex(portfolio.index, fill_value=0)
+            if "nivel" in risks.columns:
+                high = risks[risks["nivel"].isin(["Alto", "Crítico"])]
+                portfolio["high_risks"] = high.groupby("project_id").size().reindex(portfolio.index, fill_value=0)
+        return portfolio
+
     def get_budget(self):
         """Obtiene información del presupuesto del proyecto actual"""
         project_data = self.get_current_project_data()
@@ -1754,6 +4917,7 @@ class DataManager:
         milestone_data["id"] = len(project_data["milestones"]) + 1
         milestone_data["created_at"] = datetime.now().isoformat()
         project_data["milestones"].append(milestone_data)
+        self._touch(project_data, "milestones")
         self.save_current_project_data(project_data)
         # Registrar en bitácora
         self.add_audit_entry(
@@ -1772,9 +4936,7 @@ class DataManager:
     def add_alert(self, alert_data):
         """Agrega una alerta"""
         db = self.get_db()
-        alert_data["id"] = len(db["alerts"]) + 1
-        alert_data["created_at"] = datetime.now().isoformat()
-        db["alerts"].append(alert_data)
+        self._record_alert(db, alert_data)
         self.save_db(db)
         return True
     
@@ -1783,6 +4945,127 @@ class DataManager:
         db = self.get_db()
         return db.get("alerts", [])
     
+    # --- ALERTAS POR REGLAS (EVALUADAS AL ESCRIBIR) ---
+    def _record_alert(self, db: dict, alert_data: dict) -> int:
+        """Agrega una alerta a db sin guardarla (quien llama guarda db); retorna su ID"""
+        alerts = db.setdefault("alerts", [])
+        alert_data["id"] = len(alerts) + 1
+        alert_data["created_at"] = datetime.now().isoformat()
+        alerts.append(alert_data)
+        self._touch(db, "alerts")
+        return alert_data["id"]
+
+    def _resolve_alert(self, db: dict, alert_id: int | None, when: datetime) -> None:
+        """Marca como resuelta una alerta registrada"""
+        if alert_id is None:
+            return
+        for alert in reversed(db.get("alerts", [])):
+            if alert.get("id") == alert_id:
+                alert.update(estado="Resuelta", resolved_at=when.isoformat())
+                self._touch(db, "alerts")
+                return
+
+    def _apply_alerts(self, db: dict, project_id, project_data: dict, metrics: dict, hits: pd.DataFrame, families) -> int:
+        """Actualiza las alertas vigentes de un proyecto con las reglas disparadas; retorna cuántas se registraron.
+
+        Una regla que sigue en el mismo nivel no genera otra alerta (solo se refresca el texto),
+        y volver a un nivel ya registrado dentro de ALERT_COOLDOWN_HOURS tampoco. Las reglas que
+        dejan de cumplirse o cambian de nivel resuelven su alerta anterior.
+        """
+        state = project_data.setdefault("alert_state", {})
+        active = state.setdefault("active", {})
+        last_logged = state.setdefault("last_logged", {})
+        now = datetime.now()
+        fired = {hit["rule"]: hit for hit in hits.to_dict("records")}
+        logged = 0
+        for family in families:
+            current = active.get(family)
+            hit = fired.get(family)
+            if current is not None and (hit is None or hit["severity"] != current["severity"]):
+                self._resolve_alert(db, current.get("alert_id"), now)
+                del active[family]
+                current = None
+            if hit is None:
+                continue
+            if current is not None:
+                current["message"] = hit["message"]
+                continue
+            entry = {"rule": family, "severity": hit["severity"], "title": hit["title"], "message": hit["message"],
+                     "since": now.isoformat(), "alert_id": None}
+            if hit["severity"] in ALERT_PERSISTED_SEVERITIES:
+                key = f"{family}:{hit['severity']}"
+                last = last_logged.get(key)
+                if last is None or now - datetime.fromisoformat(last) >= timedelta(hours=ALERT_COOLDOWN_HOURS):
+                    entry["alert_id"] = self._record_alert(db, {
+                        "project_id": project_id,
+                        "rule": family,
+                        "severity": hit["severity"],
+                        "title": hit["title"],
+                        "message": hit["message"],
+                        "estado": "Activa",
+                    })
+                    last_logged[key] = now.isoformat()
+                    logged += 1
+            active[family] = entry
+        state["inputs"] = metrics
+        state["version"] = ALERT_RULES_VERSION
+        return logged
+
+    def _evaluate_alerts(self, db: dict, project_id, project_data: dict) -> None:
+        """Re-evalúa solo las reglas cuyas métricas cambiaron desde la última evaluación del proyecto"""
+        aggregates = project_data.get("kpi_aggregates")
+        if not aggregates or aggregates.get("version") != KPI_AGGREGATES_VERSION:
+            return  # Se evalúan al reconstruir los acumulados
+        budget = project_data.get("budget", get_default_project_data()["budget"])
+        metrics = alert_metrics_frame({project_id: compute_kpis(self._with_record_kpis(project_id, aggregates), budget)})
+        values = metrics.loc[project_id].to_dict()
+        state = project_data.get("alert_state") or {}
+        families = set(COMPILED_ALERT_RULES["family_metrics"])
+        if state.get("version") == ALERT_RULES_VERSION:
+            previous = state.get("inputs", {})
+            changed = {metric for metric, value in values.items() if previous.get(metric) != value}
+            families = {family for family in families if COMPILED_ALERT_RULES["family_metrics"][family] & changed}
+        if families:
+            self._apply_alerts(db, project_id, project_data, values, evaluate_alert_rules(metrics, families), families)
+
+    def evaluate_all_alerts(self) -> int:
+        """Evalúa todas las reglas en todos los proyectos en una sola pasada vectorizada.
+
+        Se usa al cambiar ALERT_RULES (ALERT_RULES_VERSION) o a pedido; retorna las alertas registradas.
+        """
+        db = self.get_db()
+        projects = {
+            project["id"]: project["data"] for project in db.get("projects", [])
+            if (project.get("data") or {}).get("kpi_aggregates", {}).get("version") == KPI_AGGREGATES_VERSION
+        }
+        metrics = alert_metrics_frame({
+            project_id: compute_kpis(self._with_record_kpis(project_id, data["kpi_aggregates"]),
+                                     data.get("budget", get_default_project_data()["budget"]))
+            for project_id, data in projects.items()
+        })
+        hits = evaluate_alert_rules(metrics)
+        families = set(COMPILED_ALERT_RULES["family_metrics"])
+        logged = 0
+        for project_id, data in projects.items():
+            logged += self._apply_alerts(db, project_id, data, metrics.loc[project_id].to_dict(),
+                                         hits[hits["project_id"] == project_id], families)
+        self.save_db(db)
+        logger.info(f"Reglas de alerta evaluadas en {len(projects)} proyectos: {logged} alertas nuevas")
+        return logged
+
+    def get_active_alerts(self) -> list:
+        """Alertas vigentes del proyecto actual, de la más grave a la menos grave (no evalúa reglas)"""
+        if not self.get_current_project_id():
+            return []
+        self.get_kpi_aggregates()  # Si hay que reconstruir los acumulados, al guardarlos se evalúan las reglas
+        state = self.get_current_project_data().get("alert_state") or {}
+        if state.get("version") != ALERT_RULES_VERSION:
+            self.evaluate_all_alerts()
+            state = self.get_current_project_data().get("alert_state") or {}
+        severities, families = list(ALERT_SEVERITY_ICONS), list(COMPILED_ALERT_RULES["family_metrics"])
+        return sorted(state.get("active", {}).values(),
+                      key=lambda alert: (severities.index(alert["severity"]), families.index(alert["rule"])))
+    
     # --- RIESGOS, BITÁCORA Y SNAPSHOTS ---
     def add_risk(self, risk_data: dict) -> bool:
         """Agrega un riesgo a la matriz de riesgos global"""
@@ -1791,8 +5074,10 @@ class DataManager:
             risks = db.get("risks", [])
             risk_data["id"] = len(risks) + 1
             risk_data["created_at"] = datetime.now().isoformat()
+            risk_data.setdefault("project_id", self.get_current_project_id())
             risks.append(risk_data)
             db["risks"] = risks
+            self._touch(db, "risks")
             self.save_db(db)
             return True
         except Exception as e:
@@ -2008,73 +5293,374 @@ def logout():
     st.session_state.last_activity = None
     st.rerun()
 
-# --- VISTAS ---
+def render_sync_status() -> None:
+    """Indicador de sincronización con la nube para el sidebar"""
+    status = dm.outbox.status()
+    if status["pending"] == 0:
+        if dm.use_gcp:
+            st.caption("☁️ Datos sincronizados con la nube")
+        return
+    st.warning(f"⏳ {status['pending']} registro(s) pendientes de sincronizar")
+    if status["last_error"]:
+        st.caption(f"Último error: {status['last_error'][:80]}")
+    if dm.use_gcp and st.button(f"{get_icon_symbol('refresh')} Sincronizar ahora", use_container_width=True, key="btn_sync_outbox"):
+        with st.spinner("Sincronizando..."):
+            synced = dm.outbox.replay_due(force=True)
+        if synced:
+            st.toast(f"{synced} registro(s) sincronizados", icon="☁️")
+        st.rerun()
 
-def view_dashboard_admin():
-    render_header_with_icon("Dashboard Ejecutivo", "dashboard")
+def _upload_progress_panel(kind: str, was_active: bool) -> None:
+    """Cuerpo del panel de progreso (se re-ejecuta como fragmento mientras haya subidas activas)"""
+    jobs = [j for j in get_upload_service().get_jobs(st.session_state.get("upload_job_ids", [])) if j["kind"] == kind]
+    active = any(j["status"] in ("pending", "uploading") for j in jobs)
+    for job in jobs[-5:]:
+        if job["status"] in ("pending", "uploading"):
+            st.progress(job["progress"], text=f"⏳ Subiendo {job['label']}...")
+        elif job["status"] == "done":
+            st.caption(f"✅ {job['label']} subido")
+        else:
+            st.caption(f"❌ {job['label']}: {job['error']}")
+    if was_active and not active:
+        # Todas las subidas terminaron: refrescar la página completa para ver las rutas finales
+        st.rerun()
+
+def rerun_section() -> None:
+    """Re-ejecuta solo la sección (st.fragment) en curso; si se llamó en una ejecución completa, toda la página"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def _lazy_tabs_panel(key: str, tabs: dict) -> None:
+    labels = list(tabs)
+    if st.session_state.get(key) not in labels:
+        # Primera visita, o se des-seleccionó la pestaña activa: volver a la última mostrada
+        st.session_state[key] = st.session_state.get(f"{key}_last", labels[0])
+    active = st.segmented_control("Sección", labels, key=key, label_visibility="collapsed")
+    st.session_state[f"{key}_last"] = active
+    tabs[active]()
+
+def render_lazy_tabs(key: str, tabs: dict) -> None:
+    """Reemplazo de st.tabs que ejecuta solo la pestaña activa ({etiqueta: función}).
+
+    st.tabs corre el cuerpo de todas las pestañas en cada ejecución; aquí la pestaña
+    elegida se guarda en session_state y cambiar de pestaña solo re-ejecuta este bloque.
+    """
+    st.fragment(_lazy_tabs_panel)(key, tabs)
+
+def render_upload_progress(kind: str) -> None:
+    """Muestra el progreso de las subidas en segundo plano de esta sesión"""
+    jobs = [j for j in get_upload_service().get_jobs(st.session_state.get("upload_job_ids", [])) if j["kind"] == kind]
+    if not jobs:
+        return
+    active = any(j["status"] in ("pending", "uploading") for j in jobs)
+    st.fragment(_upload_progress_panel, run_every=UPLOAD_POLL_SECONDS if active else None)(kind, active)
+
+def render_file_download(path: str, filename: str, key: str) -> None:
+    """Botón de descarga directa (URL firmada o archivo estático); si no hay enlace, descarga a pedido vía la app"""
+    label = f'{get_icon_symbol("download")} {filename}'
+    url = get_file_server().url_for(path, filename)
+    if url:
+        st.link_button(label, url, use_container_width=True)
+        return
     
-    # Mostrar información del proyecto actual
-    current_project_id = dm.get_current_project_id()
-    if current_project_id:
-        current_project = dm.get_project(current_project_id)
-        if current_project:
-            st.info(f'🏗️ **Proyecto:** {current_project.get("name", "Sin nombre")} | 📍 {current_project.get("location", "N/A")}')
+    # Respaldo: los bytes pasan por la app (desde la caché local si el archivo está en GCS)
+    prepared = st.session_state.get(f"{key}_prepared")
+    if prepared is None or prepared[0] != path:
+        if not st.button(f"Preparar {filename}", key=f"{key}_prepare", use_container_width=True):
+            return
+        prepared = (path, resolve_stored_path(path))
+        st.session_state[f"{key}_prepared"] = prepared
+    if prepared[1] is not None and prepared[1].exists():
+        st.download_button(label, data=prepared[1].read_bytes(), file_name=filename, use_container_width=True, key=f"{key}_file")
     else:
-        st.warning("⚠️ No hay proyecto seleccionado. Ve a \"Proyectos\" para crear o seleccionar uno.")
+        st.warning("El archivo no está disponible en este momento")
+
+# --- GALERÍA DE FOTOS ---
+
+def load_photo_for_display(path: str, display_width: int):
+    """Derivado de una foto listo para st.image: ruta local, desde la caché si está en GCS (None si no está disponible)"""
+    source = resolve_stored_path(get_photo_variant(path, display_width))
+    return str(source) if source else None
+
+def _photo_caption(row: dict) -> str:
+    captured = row["captured_at"].strftime("%d/%m/%Y") if pd.notna(row["captured_at"]) else "sin fecha"
+    return f"{row.get('label') or 'Foto'} · {captured}"
+
+@st.dialog("Foto en resolución completa", width="large")
+def show_full_photo(row: dict) -> None:
+    source = load_photo_for_display(row["path"], max(PHOTO_VARIANTS.values()) * 2)
+    if source is None:
+        st.info("📷 *Imagen no disponible*")
+        return
+    st.image(source, caption=_photo_caption(row), use_container_width=True)
+    details = [f"📐 {row['width']}x{row['height']}" if pd.notna(row.get("width")) else None,
+               f"📷 {row['camera']}" if row.get("camera") else None,
+               f"📍 {row['lat']:.5f}, {row['lon']:.5f}" if pd.notna(row.get("lat")) else None,
+               f"🏗️ {row['location']}" if row.get("location") else None]
+    st.caption(" | ".join(d for d in details if d))
+    original = row.get("archive_path") if isinstance(row.get("archive_path"), str) else row["path"]
+    render_file_download(original, f"foto_{row['photo_id'][:8]}{Path(original).suffix}", f"photo_download_{row['photo_id']}")
+
+def _photo_gallery_panel(key: str, project_id: str | None, page_size: int, columns: int) -> None:
+    origins = {"Todas": ["inspection", "incident"], "Inspecciones": ["inspection"], "Incidentes": ["incident"]}
+    col_origin, col_text = st.columns([1, 2])
+    with col_origin:
+        origin = st.selectbox("Origen", list(origins), key=f"{key}_origin")
+    with col_text:
+        text = st.text_input("Buscar", placeholder="Ubicación o actividad", key=f"{key}_text")
+    
+    photos = get_photo_index().query(project_id=project_id, text=text.strip() or None)
+    if not photos.empty:
+        photos = photos[photos["entity_type"].isin(origins[origin])]
+    if photos.empty:
+        st.info("📸 Aún no hay fotos de avance para este proyecto")
         return
     
+    page_key = f"{key}_page"
+    total_pages = -(-len(photos) // page_size)
+    page = min(st.session_state.get(page_key, 0), total_pages - 1)
+    st.session_state[page_key] = page
+    
+    # Solo se cargan las miniaturas de la página visible
+    grid = st.columns(columns)
+    for position, row in enumerate(photos.iloc[page * page_size:(page + 1) * page_size].to_dict("records")):
+        with grid[position % columns]:
+            source = load_photo_for_display(row["path"], GALLERY_THUMB_WIDTH)
+            if source is None:
+                st.info(f"📷 {_photo_caption(row)}\n\n*Imagen no disponible*")
+                continue
+            st.image(source, caption=_photo_caption(row), use_container_width=True)
+            if st.button("Ver completa", key=f"{key}_full_{row['photo_id']}", use_container_width=True):
+                show_full_photo(row)
+    
+    if total_pages > 1:
+        col_prev, col_info, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            st.button("◀", key=f"{key}_prev", disabled=page == 0, use_container_width=True,
+                      on_click=lambda: st.session_state.update({page_key: page - 1}))
+        with col_info:
+            st.caption(f"Página {page + 1} de {total_pages} · {len(photos)} fotos")
+        with col_next:
+            st.button("▶", key=f"{key}_next", disabled=page >= total_pages - 1, use_container_width=True,
+                      on_click=lambda: st.session_state.update({page_key: page + 1}))
+
+def render_photo_gallery(key: str, project_id: str | None, page_size: int = GALLERY_PAGE_SIZE, columns: int = 3) -> None:
+    """Galería paginada desde el índice de fotos; paginar y filtrar solo re-ejecuta la galería"""
+    st.fragment(_photo_gallery_panel)(key, project_id, page_size, columns)
+
+# --- BENCHMARKS DE RENDIMIENTO ---
+
+def _measure_allocations(fn) -> dict:
+    """Ejecuta fn midiendo el pico de memoria asignada (tracemalloc) y el tiempo"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        fn()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"Bytes asignados (pico)": peak, "Tiempo (ms)": round(elapsed * 1000, 1)}
+
+def benchmark_upload_ingestion(size_mb: int = 20) -> pd.DataFrame:
+    """Compara la memoria asignada por subida: ruta anterior vs ingesta con buffer único"""
+    payload = b"%PDF-1.7\n" + os.urandom(size_mb * 1024 * 1024)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        
+        def legacy_path(source):
+            # Validación, vista previa y guardado pedían el contenido por separado
+            len(source.getvalue())
+            len(source.getvalue())
+            (tmp_dir / "legacy.pdf").write_bytes(source.getvalue())
+        
+        def ingest_path(source):
+            ingested = ingest_upload(source)
+            validate_ingested(ingested, size_mb + 1, ALLOWED_FILE_TYPES)
+            stream_to_local(BufferReader(ingested["buffer"]), tmp_dir / "ingest.pdf")
+        
+        def getbuffer_path(source):
+            view = source.getbuffer()
+            (tmp_dir / "getbuffer.pdf").write_bytes(view)
+            view.release()
+        
+        results = []
+        for label, fn in [
+            ("Anterior (getvalue x3 + write_bytes)", legacy_path),
+            ("Ingesta única (memoryview + bloques)", ingest_path),
+            ("getbuffer() (referencia)", getbuffer_path),
+        ]:
+            # BytesIO con bytes iniciales se comporta como UploadedFile (copy-on-write)
+            source = BytesIO(payload)
+            source.name = "benchmark.pdf"
+            row = {"Ruta": label, "Tamaño archivo (MB)": size_mb}
+            row.update(_measure_allocations(lambda: fn(source)))
+            row["Asignado / archivo"] = round(row["Bytes asignados (pico)"] / len(payload), 3)
+            results.append(row)
+    return pd.DataFrame(results)
+
+def _legacy_compress_image(image_bytes: bytes, max_size_kb: int = 500) -> tuple[bytes, int]:
+    """Compresor anterior (resolución completa, calidad 85 → 25 de a 10), solo para comparar"""
+    img = to_rgb(Image.open(BytesIO(image_bytes)))
+    encodes = 0
+    quality = 85
+    output = BytesIO()
+    while quality > 20:
+        output.seek(0)
+        output.truncate(0)
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+        encodes += 1
+        if len(output.getvalue()) / 1024 <= max_size_kb:
+            break
+        quality -= 10
+    return output.getvalue(), encodes
+
+def synthetic_site_photo(width: int = 4000, height: int = 3000) -> bytes:
+    """Foto sintética de 12 MP (gradientes + ruido) para cuando no hay un corpus real"""
+    noise = Image.effect_noise((width, height), 48)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    img = Image.merge('RGB', (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=95)
+    return output.getvalue()
+
+def load_photo_corpus(limit: int = 20) -> list:
+    """Fotos de obra ya guardadas localmente, como lista de (nombre, bytes)"""
+    paths = sorted(
+        p for p in list(PHOTOS_DIR.glob("*")) + list(BLOBS_DIR.glob("*/*"))
+        if p.suffix.lower() in ALLOWED_IMAGE_TYPES
+    )
+    return [(p.name, p.read_bytes()) for p in paths[:limit]]
+
+def benchmark_image_compression(corpus: list, max_size_kb: int = 500) -> pd.DataFrame:
+    """Latencia, codificaciones y tamaño de salida por foto y formato: compresor anterior vs nuevo"""
+    rows = []
+    for name, image_bytes in corpus:
+        start = time.perf_counter()
+        legacy_output, legacy_encodes = _legacy_compress_image(image_bytes, max_size_kb)
+        rows.append({
+            "Foto": name, "Motor": "Anterior", "Formato": "JPEG",
+            "Entrada (KB)": round(len(image_bytes) / 1024),
+            "Tiempo (ms)": round((time.perf_counter() - start) * 1000, 1),
+            "Codificaciones": legacy_encodes,
+            "Salida (KB)": round(len(legacy_output) / 1024),
+            "Calidad": None, "Resolución": None,
+        })
+        for output_format in PHOTO_FORMATS:
+            _, stats = compress_image_with_stats(image_bytes, max_size_kb, output_format=output_format)
+            rows.append({
+                "Foto": name, "Motor": "Nuevo", "Formato": output_format.upper(),
+                "Entrada (KB)": round(len(image_bytes) / 1024),
+                "Tiempo (ms)": round(stats["total_ms"], 1),
+                "Codificaciones": stats["encodes"],
+                "Salida (KB)": round(stats["output_bytes"] / 1024),
+                "Calidad": stats["quality"],
+                "Resolución": f"{stats['width']}x{stats['height']}",
+            })
+    return pd.DataFrame(rows)
+
+def benchmark_batch_processing(corpus: list, batch_size: int = 8) -> pd.DataFrame:
+    """Tiempo de un lote de fotos: procesamiento en serie vs pool de procesos"""
+    photos = [image_bytes for _, image_bytes in corpus]
+    photos = (photos * batch_size)[:batch_size]
+    service = get_image_service()
+    service.process_photos(photos[:1])  # Calentar los workers (spawn importa PIL en cada uno)
+    rows = []
+    for label, run in [
+        ("Serie (hilo del script)", lambda: [process_photo(p) for p in photos]),
+        (f"Pool de procesos ({service.max_workers} workers)", lambda: service.process_photos(photos)),
+    ]:
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        rows.append({"Modo": label, "Fotos": len(photos), "Tiempo (s)": round(elapsed, 2),
+                     "Fotos/s": round(len(photos) / elapsed, 2), "Núcleos": os.cpu_count()})
+    return pd.DataFrame(rows)
+
+def synthetic_activity_network(size: int, max_predecessors: int = 3, window: int = 50, seed: int = 0) -> dict:
+    """Red sintética de actividades: cada una depende de hasta max_predecessors de las window anteriores"""
+    rng = random.Random(seed)
+    return {
+        "durations": {node: rng.randint(1, 30) for node in range(size)},
+        "release": {node: rng.randint(0, size // 20) for node in range(size)},
+        "predecessors": {node: rng.sample(range(max(0, node - window), node), min(node, rng.randint(0, max_predecessors)))
+                         for node in range(size)},
+    }
+
+def benchmark_critical_path(sizes: tuple = (1000, 10000, 50000), updates: int = 200) -> pd.DataFrame:
+    """Cálculo CPM completo vs actualización incremental (cambio de duración de una actividad) por tamaño de red"""
+    rows = []
+    for size in sizes:
+        network = synthetic_activity_network(size)
+        start = time.perf_counter()
+        schedule = CriticalPathSchedule(**network)
+        full_ms = (time.perf_counter() - start) * 1000
+        rng = random.Random(size)
+        visited = []
+        start = time.perf_counter()
+        for _ in range(updates):
+            visited.append(schedule.update(rng.randrange(size), duration=rng.randint(1, 30)))
+        incremental_ms = (time.perf_counter() - start) * 1000 / updates
+        rows.append({
+            "Actividades": size,
+            "Dependencias": sum(len(preds) for preds in network["predecessors"].values()),
+            "Cálculo completo (ms)": round(full_ms, 1),
+            "Actualización incremental (ms)": round(incremental_ms, 3),
+            "Actividades recalculadas (mediana)": int(np.median(visited)),
+            "Críticas": int(schedule.to_frame()["critica"].sum()),
+        })
+    return pd.DataFrame(rows)
+
+# --- VISTAS ---
+
+def build_dashboard_report(project: dict, kpis: dict) -> dict:
+    """Resumen del dashboard para el reporte descargable y los snapshots históricos"""
+    return {
+        "proyecto": project.get("name", "Sin nombre"),
+        "fecha_generacion": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "kpis": {
+            "avance_fisico_pct": round(kpis["physical_progress"], 1),
+            "presupuesto_ejecutado_pct": round(kpis["budget_percent"], 1),
+            "presupuesto_total": kpis["budget_total"],
+            "presupuesto_ejecutado": kpis["budget_executed"],
+            "asistencia_estimadaa_pct": round(kpis["attendance_percent"], 1),
+            "tasa_aprobacion_calidad_pct": round(kpis["qa_approval_rate"], 1),
+            "actividades_registradas": kpis["total_activities"],
+            "personal_registrado": kpis["total_personnel"],
+            "documentos_totales": kpis["total_docs"],
+            "documentos_pendientes": kpis["pending_docs"],
+            "mejoras_totales": kpis["total_improvements"],
+            "mejoras_pendientes": kpis["pending_improvements"],
+        }
+    }
+
+def _dashboard_kpi_panel(project: dict, baseline: dict) -> None:
+    """KPIs del proyecto (panel en vivo); los deltas se miden contra la última ejecución completa del dashboard"""
     # --- KPIs PRINCIPALES (DATOS REALES DEL PROYECTO) ---
     st.markdown(f'<h3>{get_icon("chart", "md")} Indicadores Clave (KPIs)</h3>', unsafe_allow_html=True)
     
-    # Cargar datos del proyecto actual
-    activities = dm.get_activities()
-    activities_df = pd.DataFrame(activities) if activities else pd.DataFrame()
-    
-    budget = dm.get_budget()
-    personnel = dm.get_personnel()
-    inspections = dm.get_inspections()
-    inspections_df = pd.DataFrame(inspections) if inspections else pd.DataFrame()
-    docs = dm.get_docs()
-    docs_df = pd.DataFrame(docs) if docs else pd.DataFrame()
-    improvements = dm.get_improvements()
-    improvements_df = pd.DataFrame(improvements) if improvements else pd.DataFrame()
+    # Acumulados mantenidos por DataManager en cada alta/cambio: no se recorre ninguna colección
+    kpis = compute_kpis(dm.get_kpi_aggregates(), dm.get_budget())
     
     # 1) Avance físico: promedio del campo "avance" de las actividades
-    if not activities_df.empty and "avance" in activities_df.columns:
-        physical_progress = float(activities_df["avance"].mean())
-    else:
-        physical_progress = 0.0
-    
-    prev_progress = st.session_state.get("kpi_prev_physical_progress")
+    physical_progress = kpis["physical_progress"]
+    prev_progress = baseline.get("physical_progress")
     delta_progress = physical_progress - prev_progress if prev_progress is not None else None
-    st.session_state["kpi_prev_physical_progress"] = physical_progress
     
     # 2) Presupuesto ejecutado: porcentaje real respecto al total
-    budget_total = budget.get("total", 0)
-    budget_executed = budget.get("executed", 0)
-    budget_percent = (budget_executed / budget_total * 100) if budget_total > 0 else 0.0
-    
-    prev_exec = st.session_state.get("kpi_prev_budget_executed")
+    budget_executed = kpis["budget_executed"]
+    budget_percent = kpis["budget_percent"]
+    prev_exec = baseline.get("budget_executed")
     delta_budget = (budget_executed - prev_exec) if prev_exec is not None else None
-    st.session_state["kpi_prev_budget_executed"] = budget_executed
     
     # 3) Asistencia estimada: personal "Activo" sobre total registrado
-    if personnel:
-        pers_df = pd.DataFrame(personnel)
-        total_personal = len(pers_df)
-        activos = (pers_df.get("estado", "") == "Activo").sum() if "estado" in pers_df.columns else total_personal
-        attendance_percent = (activos / total_personal * 100) if total_personal > 0 else 0.0
-    else:
-        attendance_percent = 0.0
+    attendance_percent = kpis["attendance_percent"]
     
     # 4) Inspecciones de calidad: porcentaje de inspecciones "Aprobado"
-    if not inspections_df.empty and "Resultado" in inspections_df.columns:
-        total_insp = len(inspections_df)
-        aprobadas = (inspections_df["Resultado"] == "Aprobado").sum()
-        qa_approval_rate = (aprobadas / total_insp * 100) if total_insp > 0 else 0.0
-    else:
-        total_insp = 0
-        qa_approval_rate = 0.0
+    qa_approval_rate = kpis["qa_approval_rate"]
     
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
     
@@ -2116,20 +5702,12 @@ def view_dashboard_admin():
     # --- SEGUNDA FILA DE KPIs (VOLUMEN DE GESTIÓN) ---
     kpi5, kpi6, kpi7, kpi8 = st.columns(4)
     
-    total_activities = len(activities_df) if not activities_df.empty else 0
-    total_personnel = len(personnel) if personnel else 0
-    total_docs = len(docs_df) if not docs_df.empty else 0
-    pending_docs = (
-        (docs_df["Estado"] != "Aprobado").sum()
-        if not docs_df.empty and "Estado" in docs_df.columns
-        else 0
-    )
-    total_improvements = len(improvements_df) if not improvements_df.empty else 0
-    pending_improvements = (
-        improvements_df["status"].isin(["Pendiente", "En Evaluación"]).sum()
-        if not improvements_df.empty and "status" in improvements_df.columns
-        else 0
-    )
+    total_activities = kpis["total_activities"]
+    total_personnel = kpis["total_personnel"]
+    total_docs = kpis["total_docs"]
+    pending_docs = kpis["pending_docs"]
+    total_improvements = kpis["total_improvements"]
+    pending_improvements = kpis["pending_improvements"]
     
     with kpi5:
         st.metric(
@@ -2162,34 +5740,12 @@ def view_dashboard_admin():
             delta_color="inverse",
             help="Mejoras o incidencias en estado 'Pendiente' o 'En Evaluación'. El delta muestra el total de mejoras registradas."
         )
-    
-    # --- RESUMEN PARA REPORTE DESCARGABLE ---
-    dashboard_report = {
-        "proyecto": current_project.get("name", "Sin nombre") if current_project_id else "N/A",
-        "fecha_generacion": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "kpis": {
-            "avance_fisico_pct": round(physical_progress, 1),
-            "presupuesto_ejecutado_pct": round(budget_percent, 1),
-            "presupuesto_total": budget_total,
-            "presupuesto_ejecutado": budget_executed,
-            "asistencia_estimadaa_pct": round(attendance_percent, 1),
-            "tasa_aprobacion_calidad_pct": round(qa_approval_rate, 1),
-            "actividades_registradas": total_activities,
-            "personal_registrado": total_personnel,
-            "documentos_totales": total_docs,
-            "documentos_pendientes": pending_docs,
-            "mejoras_totales": total_improvements,
-            "mejoras_pendientes": pending_improvements,
-        }
-    }
-    # Guardar snapshot en DB para históricos
-    try:
-        dm.add_dashboard_snapshot(dashboard_report)
-    except Exception as e:
-        logger.warning(f"No se pudo guardar snapshot de dashboard: {e}")
-    
-    # Botón para descargar reporte del dashboard
+
+    # Botón para descargar reporte del dashboard (con los KPIs de esta ejecución del panel)
+    dashboard_report = build_dashboard_report(project, kpis)
     col_title, col_download_report = st.columns([3, 1])
+    with col_title:
+        st.caption(f"Actualizado a las {datetime.now().strftime('%H:%M:%S')}")
     with col_download_report:
         if st.button(f"{get_icon_symbol('download')} Generar Reporte", use_container_width=True, key="btn_download_dashboard_report"):
             # Exportar como JSON y CSV comprimidos en memoria
@@ -2213,9 +5769,9 @@ def view_dashboard_admin():
                 use_container_width=True,
                 key="download_dashboard_csv"
             )
-    
-    st.divider()
-    
+
+def _dashboard_history_panel() -> None:
+    """Histórico de KPIs desde los snapshots guardados"""
     # --- HISTÓRICO DE KPIs (SNAPSHOTS) ---
     st.markdown(f'<h3>{get_icon("chart", "md")} Histórico de KPIs</h3>', unsafe_allow_html=True)
     snapshots = dm.get_dashboard_snapshots()
@@ -2262,26 +5818,25 @@ def view_dashboard_admin():
         st.dataframe(hist_df, use_container_width=True, hide_index=True, height=220)
     else:
         st.info("Aún no hay snapshots históricos del dashboard. Se irán generando automáticamente cada vez que visites este panel.")
-    
-    st.divider()
-    
+
+def render_s_curve() -> None:
+    """Curva S planificada vs real del proyecto actual (calculada desde fechas y avance de las actividades)"""
+    curve = dm.get_s_curve()
+    if curve.empty:
+        st.info("Registra actividades con fecha de inicio para ver la curva de avance.")
+        return
+    st.line_chart(curve, use_container_width=True)
+    st.caption("% del peso total de las actividades. La curva real reparte el avance actual "
+               "entre el inicio de cada actividad y hoy (no hay historial de avance).")
+
+def _dashboard_charts_panel() -> None:
+    """Curva de avance y ejecución presupuestaria por categoría"""
     # --- GRÁFICOS Y VISUALIZACIONES ---
     col_chart1, col_chart2 = st.columns(2)
     
     with col_chart1:
         st.markdown(f'<h3>{get_icon("chart", "md")} Curva de Avance</h3>', unsafe_allow_html=True)
-        # Datos simulados para la curva S
-        days = pd.date_range(start='2024-01-01', end='2024-12-31', freq='D')
-        progress_data = pd.DataFrame({
-            'Fecha': days[:len(days)//2],
-            'Avance_Planificado': [min(100, i*0.15) for i in range(len(days)//2)],
-            'Avance_Real': [min(100, i*0.14) for i in range(len(days)//2)]
-        })
-        st.line_chart(
-            progress_data.set_index('Fecha'),
-            use_container_width=True
-        )
-        st.caption("Línea azul: Planificado | Línea naranja: Real")
+        render_s_curve()
     
     with col_chart2:
         st.subheader("💰 Ejecución Presupuestaria")
@@ -2298,15 +5853,122 @@ def view_dashboard_admin():
             use_container_width=True
         )
         st.caption("Porcentaje ejecutado por categoría")
+
+def format_index(value) -> str:
+    """CPI/SPI para métricas ("—" si no hay datos para calcularlo)"""
+    return "—" if value is None or pd.isna(value) else f"{value:.2f}"
+
+def render_evm_metrics(project: dict) -> None:
+    """Fila de métricas de valor ganado del proyecto (CPI, SPI, EAC y VAC)"""
+    col_cpi, col_spi, col_eac, col_vac = st.columns(4)
+    with col_cpi:
+        st.metric("CPI (costo)", format_index(project["cpi"]), help="EV / AC: > 1 bajo presupuesto")
+    with col_spi:
+        st.metric("SPI (plazo)", format_index(project["spi"]), help="EV / PV: > 1 adelantado")
+    with col_eac:
+        st.metric("Costo estimado al término (EAC)", f"${project['eac']:,.0f}")
+    with col_vac:
+        st.metric("Variación al término (VAC)", f"${project['vac']:,.0f}")
+
+def _dashboard_evm_panel() -> None:
+    """Valor ganado del proyecto: índices, desglose por categoría, serie diaria y detalle por actividad"""
+    st.markdown(f'<h3>{get_icon("money", "md")} Valor Ganado (EVM)</h3>', unsafe_allow_html=True)
+    evm = dm.get_evm()
+    render_evm_metrics(evm["project"])
+    if evm["unlinked_activities"]:
+        st.caption(f"{evm['unlinked_activities']} actividades sin categoría ni presupuesto no aportan valor ganado.")
+    
+    col_categories, col_history = st.columns(2)
+    with col_categories:
+        categories = pd.DataFrame.from_dict(evm["categories"], orient="index")
+        st.dataframe(
+            categories[["bac", "pv", "ev", "ac", "cpi", "spi", "eac"]].rename_axis("Categoría").reset_index(),
+            use_container_width=True, hide_index=True,
+            column_config={col: st.column_config.NumberColumn(col.upper(), format="$%.0f") for col in ("bac", "pv", "ev", "ac", "eac")}
+            | {col: st.column_config.NumberColumn(col.upper(), format="%.2f") for col in ("cpi", "spi")},
+        )
+    with col_history:
+        history = dm.get_evm_history()
+        if len(history) > 1:
+            st.line_chart(history[["pv", "ev", "ac"]], use_container_width=True)
+            st.caption("Serie diaria de PV, EV y AC (un punto por día con cambios o consultas)")
+        else:
+            st.info("La serie de valor ganado se irá construyendo día a día.")
     
-    st.divider()
-    
+    with st.expander("Detalle por actividad"):
+        activities = dm.get_activity_evm()
+        if activities.empty:
+            st.info("No hay actividades registradas.")
+        else:
+            st.dataframe(activities.drop(columns=["id"]), use_container_width=True, hide_index=True)
+
+def _dashboard_schedule_panel() -> None:
+    """Ruta crítica: término calculado, actividades críticas y holguras"""
+    st.markdown(f'<h3>{get_icon("calendar", "md")} Ruta Crítica</h3>', unsafe_allow_html=True)
+    schedule = dm.get_critical_path_frame()
+    if schedule.empty:
+        st.info("Registra actividades con fechas y predecesoras para calcular la ruta crítica.")
+        return
+    critical = schedule[schedule["critica"]]
+    col_finish, col_critical, col_float = st.columns(3)
+    with col_finish:
+        finish = schedule["fecha_ef"].max() if "fecha_ef" in schedule.columns else None
+        st.metric("Término según ruta crítica", finish.strftime("%d/%m/%Y") if finish is not None else f"Día {schedule['ef'].max()}")
+    with col_critical:
+        st.metric("Actividades críticas", f"{len(critical)} de {len(schedule)}")
+    with col_float:
+        st.metric("Holgura total promedio", f"{schedule['holgura_total'].mean():.1f} días")
+    
+    columns = [col for col in ["nombre", "duracion", "fecha_es", "fecha_ef", "fecha_lf", "holgura_total", "holgura_libre", "critica"]
+               if col in schedule.columns]
+    st.dataframe(
+        schedule.sort_values(["holgura_total", "es"])[columns],
+        use_container_width=True, hide_index=True, height=260,
+        column_config={
+            "nombre": "Actividad", "duracion": "Duración (días)",
+            "fecha_es": st.column_config.DateColumn("Inicio temprano", format="DD/MM/YYYY"),
+            "fecha_ef": st.column_config.DateColumn("Fin temprano", format="DD/MM/YYYY"),
+            "fecha_lf": st.column_config.DateColumn("Fin tardío", format="DD/MM/YYYY"),
+            "holgura_total": "Holgura total", "holgura_libre": "Holgura libre", "critica": "Crítica",
+        },
+    )
+    st.caption("Un atraso en una actividad crítica mueve el término del proyecto; las demás lo absorben hasta su holgura total.")
+
+def _dashboard_simulation_panel() -> None:
+    """Simulación Monte Carlo de término y costo (corre en segundo plano; el panel muestra el último resultado)"""
+    st.markdown(f'<h3>{get_icon("chart", "md")} Riesgo de Plazo y Costo (Monte Carlo)</h3>', unsafe_allow_html=True)
+    result = dm.get_schedule_risk()
+    if result is None:
+        error = dm.get_schedule_risk_error()
+        if error:
+            st.warning(f"⚠️ La simulación falló ({error}); se reintentará en unos minutos.")
+            return
+        st.info(f"Simulando {MONTE_CARLO_ITERATIONS:,} escenarios en segundo plano...")
+        if st.button("Ver resultado", key="btn_simulation_refresh"):
+            rerun_section()
+        return
+    col_p50, col_p80, col_on_time, col_cost = st.columns(4)
+    with col_p50:
+        st.metric("Término P50", result["finish"]["p50"].strftime("%d/%m/%Y"))
+    with col_p80:
+        st.metric("Término P80", result["finish"]["p80"].strftime("%d/%m/%Y"))
+    with col_on_time:
+        st.metric("Prob. de cumplir ruta crítica", f"{result['on_time_probability'] * 100:.0f}%",
+                  help=f"Término determinista: {result['deterministic_finish'].strftime('%d/%m/%Y')}")
+    with col_cost:
+        st.metric("Costo final P80", f"${result['cost']['p80']:,.0f}", help=f"P50: ${result['cost']['p50']:,.0f}")
+    st.bar_chart(result["finish_histogram"], use_container_width=True)
+    st.caption(f"{result['iterations']:,} iteraciones · {result['activities']} actividades · {result['risks']} riesgos "
+               f"· {result['duration_ms']:.0f} ms")
+
+def _dashboard_activities_panel() -> None:
+    """Tabla de estado de las actividades principales"""
     # --- ESTADO DE PROYECTOS/ACTIVIDADES ---
     st.markdown(f'<h3>{get_icon("building", "md")} Estado de Actividades Principales</h3>', unsafe_allow_html=True)
     
     activities = dm.get_activities()
     if activities:
-        activities_df = pd.DataFrame(activities)
+        activities_df = dm.get_frame("activities", activities)
         if not activities_df.empty:
             # Mapear columnas
             display_df = pd.DataFrame({
@@ -2350,9 +6012,9 @@ def view_dashboard_admin():
         })
         st.dataframe(activities_df, use_container_width=True, hide_index=True, height=100)
         st.info("💡 Agrega actividades usando el formulario en la sección 'Gestión de Información'")
-    
-    st.divider()
-    
+
+def _dashboard_team_panel() -> None:
+    """Personal activo por rol e inspecciones recientes (panel en vivo)"""
     # --- PERSONAL Y ASISTENCIA ---
     col_personal, col_inspecciones = st.columns(2)
     
@@ -2360,7 +6022,7 @@ def view_dashboard_admin():
         st.markdown(f'<h3>{get_icon("team", "md")} Personal en Obra</h3>', unsafe_allow_html=True)
         personnel = dm.get_personnel()
         if personnel:
-            pers_df = pd.DataFrame(personnel)
+            pers_df = dm.get_frame("personnel", personnel)
             if not pers_df.empty and 'rol' in pers_df.columns:
                 # Agrupar por rol
                 role_counts = pers_df[pers_df['estado'] == 'Activo']['rol'].value_counts()
@@ -2389,7 +6051,7 @@ def view_dashboard_admin():
         st.markdown(f'<h3>{get_icon("quality", "md")} Inspecciones Recientes</h3>', unsafe_allow_html=True)
         inspections = dm.get_inspections()
         if inspections:
-            recent_inspections = pd.DataFrame(inspections[:5])
+            recent_inspections = dm.get_frame("inspections", inspections).head(5)
             if 'Fecha' in recent_inspections.columns and 'Resultado' in recent_inspections.columns:
                 st.dataframe(
                     recent_inspections[['Fecha', 'Actividad', 'Resultado']],
@@ -2406,100 +6068,17 @@ def view_dashboard_admin():
                 st.info("No hay datos suficientes de inspecciones")
         else:
             st.info("No hay inspecciones registradas aún")
-    
-    st.divider()
-    
+
+def _dashboard_alerts_panel() -> None:
+    """Alertas vigentes del proyecto (panel en vivo): las reglas se evalúan al escribir, aquí solo se leen"""
     # --- ALERTAS Y NOTIFICACIONES ---
     st.markdown(f'<h3>{get_icon("alert", "md")} Alertas y Notificaciones</h3>', unsafe_allow_html=True)
     
-    # Generar alertas "inteligentes" en base a los datos actuales del proyecto
-    critical_alerts = []
-    warning_alerts = []
-    info_alerts = []
-    positive_alerts = []
-    
-    # 1) Riesgo de cronograma (avance físico vs presupuesto)
-    #   - Crítico: avance físico más de 15 pts por debajo del financiero
-    #   - Advertencia: más de 7 pts por debajo
-    if physical_progress + 15 < budget_percent and physical_progress > 0:
-        critical_alerts.append(
-            "🔴 **CRÍTICO**: El avance físico está significativamente por debajo del avance financiero. "
-            "Revisa el cronograma y prioriza actividades críticas."
-        )
-    elif physical_progress + 7 < budget_percent:
-        warning_alerts.append(
-            "🟡 **ATENCIÓN**: El avance físico está algo rezagado respecto al presupuesto ejecutado."
-        )
-    
-    # 2) Presupuesto cercano al límite
-    #   - Crítico: ≥ 95% del presupuesto
-    #   - Advertencia: ≥ 85% del presupuesto
-    if budget_percent >= 95:
-        critical_alerts.append(
-            "🔴 **CRÍTICO**: El proyecto ha ejecutado ≥95% del presupuesto. Revisa sobrecostos y posibles ajustes."
-        )
-    elif budget_percent >= 85:
-        warning_alerts.append(
-            "🟡 **IMPORTANTE**: El proyecto ha ejecutado más del 85% del presupuesto."
-        )
-    
-    # 3) Calidad (inspecciones)
-    #   - Crítico: tasa de aprobación < 75%
-    #   - Advertencia: 75–90%
-    if total_insp > 0:
-        if qa_approval_rate < 75:
-            critical_alerts.append(
-                f"🔴 **CRÍTICO**: Solo el {qa_approval_rate:.1f}% de las inspecciones fueron aprobadas. "
-                "Revisa las no conformidades más frecuentes."
-            )
-        elif qa_approval_rate < 90:
-            warning_alerts.append(
-                f"🟡 **ATENCIÓN**: Tasa de aprobación de inspecciones {qa_approval_rate:.1f}%. Revisa observaciones frecuentes."
-            )
-        else:
-            positive_alerts.append(
-                f"🟢 **CALIDAD**: {qa_approval_rate:.1f}% de inspecciones aprobadas."
-            )
-    
-    # 4) Documentos y planos pendientes
-    if pending_docs > 0:
-        warning_alerts.append(
-            f"🟡 **DOCUMENTOS**: Hay {pending_docs} documentos pendientes de aprobación."
-        )
-    
-    # 5) Mejoras / incidencias
-    if pending_improvements > 0:
-        warning_alerts.append(
-            f"🟡 **MEJORAS**: {pending_improvements} mejoras o incidencias requieren revisión."
-        )
-    elif total_improvements > 0:
-        positive_alerts.append(
-            "🟢 **MEJORAS**: Todas las mejoras registradas han sido atendidas."
-        )
-    
-    # 6) Asistencia
-    #   - Crítico: < 75%
-    #   - Advertencia: 75–90%
-    if attendance_percent < 75:
-        critical_alerts.append(
-            f"🔴 **ASISTENCIA**: Asistencia estimada baja ({attendance_percent:.1f}%). Puede afectar productividad."
-        )
-    elif attendance_percent < 90:
-        warning_alerts.append(
-            f"🟡 **ASISTENCIA**: Asistencia estimada {attendance_percent:.1f}%. Monitorea ausencias y rotación."
-        )
-    else:
-        positive_alerts.append(
-            f"🟢 **ASISTENCIA**: Buena asistencia estimada ({attendance_percent:.1f}%)."
-        )
-    
-    # 7) Volumen de trabajo y registro
-    if total_activities == 0:
-        info_alerts.append("🔵 **INFO**: Aún no hay actividades registradas. Usa la sección 'Gestión de Información'.")
-    if total_personnel == 0:
-        info_alerts.append("🔵 **INFO**: No hay personal registrado para el proyecto actual.")
-    if total_docs == 0:
-        info_alerts.append("🔵 **INFO**: No hay planos/documentos registrados aún.")
+    messages = {severity: [] for severity in ALERT_SEVERITY_ICONS}
+    for alert in dm.get_active_alerts():
+        messages[alert["severity"]].append(f"{ALERT_SEVERITY_ICONS[alert['severity']]} **{alert['title']}**: {alert['message']}")
+    critical_alerts, warning_alerts = messages["critical"], messages["warning"]
+    positive_alerts, info_alerts = messages["success"], messages["info"]
     
     alert_col1, alert_col2 = st.columns(2)
     
@@ -2517,8 +6096,23 @@ def view_dashboard_admin():
         for msg in info_alerts:
             st.info(msg)
     
-    st.divider()
-    
+    # Historial persistido por el motor de reglas (con deduplicación y enfriamiento)
+    alerts_df = dm.get_frame("alerts")
+    if not alerts_df.empty and "project_id" in alerts_df.columns:
+        project_alerts = alerts_df[alerts_df["project_id"] == dm.get_current_project_id()]
+        if not project_alerts.empty:
+            with st.expander(f"🕑 Historial de alertas ({len(project_alerts)})"):
+                display_cols = ["created_at", "title", "message", "estado", "resolved_at"]
+                available_cols = [c for c in display_cols if c in project_alerts.columns]
+                st.dataframe(
+                    project_alerts.sort_values("created_at", ascending=False)[available_cols],
+                    use_container_width=True,
+                    hide_index=True,
+                    height=220
+                )
+
+def _dashboard_audit_panel() -> None:
+    """Últimas entradas de la bitácora (panel en vivo)"""
     # --- HISTORIAL DE CAMBIOS CLAVE (BITÁCORA) ---
     st.markdown(f'<h3>{get_icon("documents", "md")} Historial de Cambios Clave</h3>', unsafe_allow_html=True)
     audit_entries = dm.get_audit_log()
@@ -2551,9 +6145,9 @@ def view_dashboard_admin():
             )
     else:
         st.info("Aún no hay movimientos registrados en la bitácora.")
-    
-    st.divider()
-    
+
+def _dashboard_risks_panel() -> None:
+    """Formulario y matriz de riesgos; guardar un riesgo solo re-ejecuta esta sección"""
     # --- MATRIZ DE RIESGOS DEL PROYECTO ---
     st.markdown(f'<h3>{get_icon("alert", "md")} Matriz de Riesgos del Proyecto</h3>', unsafe_allow_html=True)
     
@@ -2566,6 +6160,10 @@ def view_dashboard_admin():
             risk_area = st.selectbox("Área", ["Plazo", "Costo", "Calidad", "Seguridad", "Ambiental", "Contratos", "Otro"])
             risk_probability = st.selectbox("Probabilidad", ["Baja", "Media", "Alta"])
             risk_impact = st.selectbox("Impacto", ["Bajo", "Medio", "Alto", "Crítico"])
+            risk_days = st.number_input("Atraso si ocurre (días)", min_value=0, value=0,
+                                        help="0 = estimado según el nivel de impacto")
+            risk_cost = st.number_input("Costo si ocurre ($)", min_value=0.0, value=0.0, step=100000.0,
+                                        help="0 = estimado según el nivel de impacto")
             risk_owner = st.text_input("Responsable", placeholder="Ej: Jefe de Obra")
             risk_mitigation = st.text_area("Plan de Mitigación", placeholder="Acciones para reducir probabilidad o impacto...")
             
@@ -2589,12 +6187,14 @@ def view_dashboard_admin():
                         "impacto": risk_impact,
                         "nivel": risk_level,
                         "score": risk_score,
+                        "impacto_dias": risk_days or None,
+                        "impacto_costo": risk_cost or None,
                         "responsable": risk_owner,
                         "mitigacion": risk_mitigation,
                     }
                     if dm.add_risk(risk_data):
                         show_success_message("Riesgo registrado correctamente", 2)
-                        st.rerun()
+                        rerun_section()
                     else:
                         show_error_message("No se pudo guardar el riesgo. Intenta nuevamente.")
                 else:
@@ -2603,7 +6203,7 @@ def view_dashboard_admin():
     with col_risk_table:
         risks = dm.get_risks()
         if risks:
-            risks_df = pd.DataFrame(risks)
+            risks_df = dm.get_frame("risks", risks)
             if not risks_df.empty:
                 # Ordenar por nivel de riesgo (score)
                 if "score" in risks_df.columns:
@@ -2633,9 +6233,9 @@ def view_dashboard_admin():
                 )
         else:
             st.info("Aún no hay riesgos registrados. Utiliza el formulario para agregar el primero.")
-    
-    st.divider()
-    
+
+def _dashboard_docs_panel() -> None:
+    """Documentos recientes con exportación (panel en vivo)"""
     # --- DOCUMENTOS Y PLANOS ---
     st.markdown(f'<h3>{get_icon("documents", "md")} Documentos Recientes</h3>', unsafe_allow_html=True)
     
@@ -2646,7 +6246,7 @@ def view_dashboard_admin():
     if docs:
         col_docs, col_download = st.columns([3, 1])
         with col_download:
-            docs_df = pd.DataFrame(docs)
+            docs_df = dm.get_frame("docs", docs)
             csv = docs_df.to_csv(index=False).encode('utf-8')
             st.download_button(
                 label=f'{get_icon_symbol("download")} Exportar',
@@ -2657,7 +6257,7 @@ def view_dashboard_admin():
                 key="export_docs"
             )
     if docs:
-        recent_docs = pd.DataFrame(docs[:5])
+        recent_docs = dm.get_frame("docs", docs).head(5)
         display_cols = ["Archivo", "Versión", "Fecha", "Estado"]
         available_cols = [col for col in display_cols if col in recent_docs.columns]
         st.dataframe(
@@ -2667,9 +6267,9 @@ def view_dashboard_admin():
         )
     else:
         st.info("No hay documentos registrados aún")
-    
-    st.divider()
-    
+
+def _dashboard_day_summary() -> None:
+    """Resumen del día"""
     # --- RESUMEN DEL DÍA ---
     st.markdown(f'<h3>{get_icon("calendar", "md")} Resumen del Día</h3>', unsafe_allow_html=True)
     summary_col1, summary_col2, summary_col3 = st.columns(3)
@@ -2685,391 +6285,601 @@ def view_dashboard_admin():
     with summary_col3:
         st.metric("Reuniones Programadas", "1")
         st.metric("Tareas Completadas", "8")
+
+def _manage_activities_panel() -> None:
+    """Formulario y listado de actividades"""
+    st.write("**Agregar Nueva Actividad**")
+    with st.form("form_activity", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            act_name = st.text_input("Nombre de la Actividad *", placeholder="Ej: Hormigonado Torre A - Piso 8")
+            act_responsible = st.text_input("Responsable *", placeholder="Ej: Equipo Alfa")
+            act_location = st.text_input("Ubicación", placeholder="Ej: Torre A - Piso 8")
+        with col2:
+            act_progress = st.number_input("Avance (%)", min_value=0, max_value=100, value=0)
+            act_status = st.selectbox("Estado *", ["Pendiente", "En Curso", "Retrasado", "Completado"])
+            act_priority = st.selectbox("Prioridad", ["Baja", "Media", "Alta", "Crítica"])
+            act_weight = st.number_input("Peso relativo", min_value=0.0, value=0.0, step=1.0,
+                                         help="Peso en la curva S; 0 = proporcional a la duración")
+        
+        col3, col4 = st.columns(2)
+        with col3:
+            act_category = st.selectbox("Categoría de presupuesto", ["Sin categoría"] + list(dm.get_budget()["categories"]))
+        with col4:
+            act_budget = st.number_input("Presupuesto de la actividad ($)", min_value=0.0, value=0.0, step=1000.0,
+                                         help="0 = parte proporcional del presupuesto no asignado de la categoría")
+        
+        act_start = st.date_input("Fecha de Inicio", value=datetime.now().date())
+        act_end = st.date_input("Fecha de Fin Planificada")
+        activity_names = {activity["id"]: activity.get("nombre", f"Actividad {activity['id']}") for activity in dm.get_activities()}
+        act_predecessors = st.multiselect("Predecesoras", list(activity_names), format_func=activity_names.get,
+                                          help="Actividades que deben terminar antes de que esta empiece")
+        act_notes = st.text_area("Notas adicionales", placeholder="Observaciones, comentarios...")
+        
+        submitted = st.form_submit_button("Guardar Actividad", type="primary", use_container_width=True)
+        
+        if submitted:
+            if act_name and act_responsible:
+                activity_data = {
+                    "nombre": act_name,
+                    "responsable": act_responsible,
+                    "ubicacion": act_location,
+                    "avance": act_progress,
+                    "estado": act_status,
+                    "prioridad": act_priority,
+                    "peso": act_weight or None,
+                    "categoria": None if act_category == "Sin categoría" else act_category,
+                    "presupuesto": act_budget or None,
+                    "predecesoras": act_predecessors,
+                    "fecha_inicio": act_start.strftime("%d/%m/%Y"),
+                    "fecha_fin": act_end.strftime("%d/%m/%Y") if act_end else None,
+                    "notas": act_notes,
+                    "created_by": st.session_state.user_info['name']
+                }
+                with st.spinner("Guardando actividad..."):
+                    if dm.add_activity(activity_data):
+                        show_success_message(f'Actividad "{act_name}" agregada correctamente', 2)
+                        time.sleep(0.5)
+                        rerun_section()
+                    else:
+                        show_error_message("Error al guardar la actividad. Intenta nuevamente.")
+            else:
+                show_error_message("Completa los campos obligatorios (*)")
+    
+    if activity_names:
+        st.write("**Actualizar Actividad**")
+        # Fuera del formulario: al elegir otra actividad se recargan sus valores actuales
+        upd_id = st.selectbox("Actividad", list(activity_names), format_func=activity_names.get, key="activity_update_id")
+        current = next(a for a in dm.get_activities() if a["id"] == upd_id)
+        statuses = ["Pendiente", "En Curso", "Retrasado", "Completado"]
+        with st.form(f"form_activity_update_{upd_id}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                upd_progress = st.number_input("Avance (%)", min_value=0, max_value=100, value=int(current.get("avance") or 0))
+                upd_status = st.selectbox("Estado", statuses, index=statuses.index(current["estado"]) if current.get("estado") in statuses else 0)
+            with col2:
+                upd_end = st.date_input("Fecha de Fin Planificada", value=None)
+                upd_predecessors = st.multiselect(
+                    "Predecesoras", [a for a in activity_names if a != upd_id], format_func=activity_names.get,
+                    default=[a for a in current.get("predecesoras") or [] if a in activity_names and a != upd_id],
+                )
+            if st.form_submit_button("Actualizar Actividad", use_container_width=True):
+                changes = {"avance": upd_progress, "estado": upd_status, "predecesoras": upd_predecessors}
+                if upd_end:
+                    changes["fecha_fin"] = upd_end.strftime("%d/%m/%Y")
+                if dm.update_activity(upd_id, changes):
+                    show_success_message(f'Actividad "{activity_names[upd_id]}" actualizada', 2)
+                    time.sleep(0.5)
+                    rerun_section()
+                else:
+                    show_error_message("No se pudo actualizar: una de las predecesoras depende de esta actividad.")
+    
+    st.divider()
+    st.write("**Actividades Registradas**")
+    activities = dm.get_activities()
+    if activities:
+        activities_df = dm.get_frame("activities", activities)
+        if not activities_df.empty:
+            display_cols = ["nombre", "responsable", "avance", "estado", "fecha_inicio", "fecha_fin"]
+            available_cols = [col for col in display_cols if col in activities_df.columns]
+            if available_cols:
+                st.dataframe(
+                    activities_df[available_cols],
+                    use_container_width=True,
+                    hide_index=True,
+                    height=200
+                )
+    else:
+        st.info("No hay actividades registradas aún")
+
+def _manage_personnel_panel() -> None:
+    """Registro y listado de personal"""
+    st.markdown(f'<h4>{get_icon("user", "sm")} Registrar Personal</h4>', unsafe_allow_html=True)
+    with st.form("form_personnel", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            pers_name = st.text_input("Nombre Completo *", placeholder="Ej: Juan Pérez", help="Nombre completo del trabajador")
+            pers_role = st.selectbox("Rol/Cargo *", ["Albañil", "Carpintero", "Electricista", "Plomero", "Supervisor", "Ingeniero", "Arquitecto", "Otro"], help="Cargo o especialidad")
+            pers_team = st.text_input("Equipo", placeholder="Ej: Equipo Alfa", help="Equipo o cuadrilla asignada")
+        with col2:
+            pers_phone = st.text_input("Teléfono", placeholder="+56 9 1234 5678", help="Número de contacto")
+            pers_email = st.text_input("Email", placeholder="juan.perez@empresa.cl", help="Correo electrónico")
+            pers_status = st.selectbox("Estado", ["Activo", "Inactivo", "Vacaciones", "Licencia"], help="Estado actual del trabajador")
+        
+        # Campos adicionales
+        pers_dni = st.text_input("DNI/RUT", placeholder="12.345.678-9", help="Documento de identidad")
+        pers_start_date = st.date_input("Fecha de Ingreso", value=datetime.now().date(), help="Fecha en que comenzó a trabajar")
+        
+        submitted = st.form_submit_button(f'{get_icon_symbol("add")} Registrar Personal', type="primary", use_container_width=True)
+        
+        if submitted:
+            if pers_name and pers_role:
+                with st.spinner("Registrando personal..."):
+                    personnel_data = {
+                        "nombre": pers_name,
+                        "rol": pers_role,
+                        "equipo": pers_team,
+                        "telefono": pers_phone,
+                        "email": pers_email,
+                        "dni": pers_dni,
+                        "fecha_ingreso": pers_start_date.strftime("%d/%m/%Y"),
+                        "estado": pers_status,
+                        "created_by": st.session_state.user_info['name']
+                    }
+                    if dm.add_personnel(personnel_data):
+                        st.success(f'✅ **Personal "{pers_name}" registrado correctamente**')
+                        time.sleep(0.5)
+                        rerun_section()
+            else:
+                st.error("⚠️ **Completa los campos obligatorios (*)**")
+    
+    st.divider()
+    
+    # Sección de personal registrado con opción de descarga
+    col_header, col_export = st.columns([3, 1])
+    with col_header:
+        st.markdown(f'<h4>{get_icon("team", "sm")} Personal Registrado</h4>', unsafe_allow_html=True)
+    with col_export:
+        personnel = dm.get_personnel()
+        if personnel:
+            pers_df = dm.get_frame("personnel", personnel)
+            if not pers_df.empty:
+                csv = pers_df.to_csv(index=False).encode('utf-8')
+                st.download_button(
+                    label=f'{get_icon_symbol("download")} Exportar',
+                    data=csv,
+                    file_name=f"personal_{datetime.now().strftime('%Y%m%d')}.csv",
+                    mime="text/csv",
+                    use_container_width=True,
+                    key="export_personnel"
+                )
+    
+    personnel = dm.get_personnel()
+    if personnel:
+        pers_df = dm.get_frame("personnel", personnel)
+        if not pers_df.empty:
+            display_cols = ["nombre", "rol", "equipo", "estado", "fecha_ingreso"]
+            available_cols = [col for col in display_cols if col in pers_df.columns]
+            if available_cols:
+                st.dataframe(
+                    pers_df[available_cols],
+                    use_container_width=True,
+                    hide_index=True,
+                    height=200
+                )
+    else:
+        st.info("No hay personal registrado aún")
+
+def _manage_budget_panel() -> None:
+    """Registro de gastos y desglose por categoría"""
+    st.write("**Actualizar Presupuesto Ejecutado**")
+    budget = dm.get_budget()
+    
+    st.write(f"**Presupuesto Total:** ${budget['total']:,.0f}")
+    st.write(f"**Ejecutado:** ${budget['executed']:,.0f} ({budget['executed']/budget['total']*100:.1f}%)")
+    st.progress(budget['executed']/budget['total'])
+    
+    with st.form("form_budget", clear_on_submit=True):
+        budget_category = st.selectbox("Categoría *", list(budget['categories'].keys()))
+        activities = dm.get_activities()
+        activity_names = {activity["id"]: activity.get("nombre", f"Actividad {activity['id']}") for activity in activities}
+        activity_categories = {activity["id"]: activity.get("categoria") for activity in activities}
+        budget_activity = st.selectbox("Actividad (opcional)", [None] + list(activity_names),
+                                       format_func=lambda activity_id: "Gasto general de la categoría" if activity_id is None else activity_names[activity_id])
+        budget_amount = st.number_input("Monto Ejecutado ($)", min_value=0.0, value=0.0, step=1000.0)
+        budget_notes = st.text_area("Descripción", placeholder="Detalle del gasto...")
+        
+        submitted = st.form_submit_button("Registrar Gasto", type="primary", use_container_width=True)
+        
+        if submitted:
+            if budget_amount > 0:
+                if budget_amount > budget['categories'][budget_category]['budget']:
+                    show_warning_message(f"El monto excede el presupuesto asignado para {budget_category}")
+                elif budget_activity is not None and activity_categories[budget_activity] != budget_category:
+                    show_warning_message(
+                        f"{activity_names[budget_activity]} pertenece a la categoría "
+                        f"{activity_categories[budget_activity] or '(sin categoría)'}, no a {budget_category}"
+                    )
+                else:
+                    with st.spinner("Registrando gasto..."):
+                        if dm.update_budget(budget_category, budget_amount, budget_activity):
+                            show_success_message(f'Gasto de ${budget_amount:,.0f} registrado en {budget_category}', 2)
+                            time.sleep(0.5)
+                            rerun_section()
+                        else:
+                            show_error_message("Error al registrar el gasto. Intenta nuevamente.")
+            else:
+                show_error_message("Ingresa un monto válido mayor a cero")
+    
+    st.divider()
+    st.write("**Desglose por Categoría**")
+    budget_cats = budget['categories']
+    budget_df = pd.DataFrame({
+        'Categoría': list(budget_cats.keys()),
+        'Presupuestado': [budget_cats[cat]['budget'] for cat in budget_cats],
+        'Ejecutado': [budget_cats[cat]['executed'] for cat in budget_cats]
+    })
+    budget_df['% Ejecutado'] = (budget_df['Ejecutado'] / budget_df['Presupuestado'] * 100).round(1)
+    budget_df['Restante'] = budget_df['Presupuestado'] - budget_df['Ejecutado']
+    
+    st.dataframe(
+        budget_df,
+        use_container_width=True,
+        hide_index=True
+    )
+
+def _manage_milestones_panel() -> None:
+    """Formulario y listado de hitos"""
+    st.write("**Agregar Hito del Proyecto**")
+    with st.form("form_milestone", clear_on_submit=True):
+        mil_name = st.text_input("Nombre del Hito *", placeholder="Ej: Finalización Estructura Torre A")
+        mil_date = st.date_input("Fecha Planificada *", value=datetime.now().date())
+        mil_description = st.text_area("Descripción", placeholder="Detalles del hito...")
+        mil_status = st.selectbox("Estado", ["Planificado", "En Progreso", "Completado", "Retrasado"])
+        
+        submitted = st.form_submit_button("Agregar Hito", type="primary", use_container_width=True)
+        
+        if submitted:
+            if mil_name:
+                milestone_data = {
+                    "nombre": mil_name,
+                    "fecha": mil_date.strftime("%d/%m/%Y"),
+                    "descripcion": mil_description,
+                    "estado": mil_status,
+                    "created_by": st.session_state.user_info['name']
+                }
+                with st.spinner("Agregando hito..."):
+                    if dm.add_milestone(milestone_data):
+                        st.success(f'✅ **Hito "{mil_name}" agregado correctamente**')
+                        time.sleep(0.5)
+                        rerun_section()
+            else:
+                st.error("⚠️ **Completa el nombre del hito**")
+    
+    st.divider()
+    st.write("**Hitos del Proyecto**")
+    milestones = dm.get_milestones()
+    if milestones:
+        mil_df = dm.get_frame("milestones", milestones)
+        if not mil_df.empty:
+            display_cols = ["nombre", "fecha", "estado"]
+            available_cols = [col for col in display_cols if col in mil_df.columns]
+            if available_cols:
+                st.dataframe(
+                    mil_df[available_cols],
+                    use_container_width=True,
+                    hide_index=True,
+                    height=200
+                )
+    else:
+        st.info("No hay hitos registrados aún")
+
+def _manage_improvements_panel() -> None:
+    """Sugerencias de mejora con aprobación e implementación"""
+    st.write("**Sugerir Mejora o Cambio**")
+    with st.form("form_improvement", clear_on_submit=True):
+        imp_title = st.text_input("Título de la Mejora *", placeholder="Ej: Optimizar proceso de hormigonado")
+        imp_category = st.selectbox("Categoría *", ["Proceso", "Seguridad", "Calidad", "Eficiencia", "Costo", "Otro"])
+        imp_description = st.text_area("Descripción Detallada *", placeholder="Describe la mejora propuesta, beneficios esperados...", height=150)
+        imp_priority = st.selectbox("Prioridad", ["Baja", "Media", "Alta", "Crítica"])
+        imp_estimated_impact = st.text_area("Impacto Estimado", placeholder="Ahorro de tiempo, reducción de costos, mejora de calidad...")
+        
+        submitted = st.form_submit_button("Enviar Sugerencia", type="primary", use_container_width=True)
+        
+        if submitted:
+            if imp_title and imp_description:
+                with st.spinner("Enviando sugerencia..."):
+                    improvement_data = {
+                        "titulo": imp_title,
+                        "categoria": imp_category,
+                        "descripcion": imp_description,
+                        "prioridad": imp_priority,
+                        "impacto_estimado": imp_estimated_impact,
+                        "autor": st.session_state.user_info['name'],
+                        "rol_autor": st.session_state.user_info['role']
+                    }
+                    if dm.add_improvement(improvement_data):
+                        st.success(f'✅ **Sugerencia de mejora "{imp_title}" enviada correctamente**')
+                        time.sleep(0.5)
+                        rerun_section()
+            else:
+                st.error("⚠️ **Completa los campos obligatorios (*)**")
     
     st.divider()
+    st.write("**Mejoras y Sugerencias**")
+    improvements = dm.get_improvements()
+    if improvements:
+        for imp in improvements:
+            status_color = {
+                "Pendiente": "🟡",
+                "En Evaluación": "🔵",
+                "Aprobada": "🟢",
+                "Rechazada": "🔴",
+                "Implementada": "✅"
+            }.get(imp.get("status", "Pendiente"), "🟡")
+            
+            with st.expander(f"{status_color} {imp.get('titulo', 'Sin título')} - {imp.get('status', 'Pendiente')}"):
+                st.write(f"**Categoría:** {imp.get('categoria', 'N/A')}")
+                st.write(f"**Prioridad:** {imp.get('prioridad', 'N/A')}")
+                st.write(f"**Autor:** {imp.get('autor', 'N/A')}")
+                st.write(f"**Descripción:** {imp.get('descripcion', 'Sin descripción')}")
+                if imp.get('impacto_estimado'):
+                    st.write(f"**Impacto Estimado:** {imp['impacto_estimado']}")
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button(f"{get_icon_symbol('check')} Aprobar", key=f"approve_{imp['id']}", use_container_width=True):
+                        if dm.update_improvement_status(imp['id'], "Aprobada"):
+                            st.success("✅ **Mejora aprobada**")
+                            time.sleep(0.5)
+                            rerun_section()
+                with col2:
+                    if st.button(f"{get_icon_symbol('check')} Implementar", key=f"implement_{imp['id']}", use_container_width=True):
+                        if dm.update_improvement_status(imp['id'], "Implementada"):
+                            st.success("✅ **Mejora marcada como implementada**")
+                            time.sleep(0.5)
+                            rerun_section()
+    else:
+        st.info("No hay mejoras registradas aún")
+
+def view_dashboard_admin():
+    """Dashboard ejecutivo armado con secciones independientes (st.fragment).
+
+    Cada sección lee sus propios datos y sus widgets solo re-ejecutan esa sección. Los
+    paneles en vivo (KPIs, personal e inspecciones, alertas, bitácora y documentos)
+    además se refrescan solos con el intervalo elegido; el resto se actualiza en la
+    siguiente ejecución completa.
+    """
+    render_header_with_icon("Dashboard Ejecutivo", "dashboard")
+    
+    # Mostrar información del proyecto actual
+    current_project_id = dm.get_current_project_id()
+    if current_project_id:
+        current_project = dm.get_project(current_project_id)
+        if current_project:
+            st.info(f'🏗️ **Proyecto:** {current_project.get("name", "Sin nombre")} | 📍 {current_project.get("location", "N/A")}')
+    else:
+        st.warning("⚠️ No hay proyecto seleccionado. Ve a \"Proyectos\" para crear o seleccionar uno.")
+        return
+    
+    # Solo en ejecuciones completas: las re-ejecuciones de secciones no guardan snapshots
+    kpis = compute_kpis(dm.get_kpi_aggregates(), dm.get_budget())
+    baseline = st.session_state.get("kpi_baseline", {})
+    st.session_state["kpi_baseline"] = {"physical_progress": kpis["physical_progress"], "budget_executed": kpis["budget_executed"]}
+    try:
+        dm.add_dashboard_snapshot(build_dashboard_report(current_project, kpis))
+    except Exception as e:
+        logger.warning(f"No se pudo guardar snapshot de dashboard: {e}")
+    
+    col_refresh, col_reload = st.columns([3, 1])
+    with col_refresh:
+        refresh_seconds = st.selectbox(
+            "Actualización automática de paneles en vivo",
+            list(DASHBOARD_REFRESH_OPTIONS),
+            index=list(DASHBOARD_REFRESH_OPTIONS).index(DASHBOARD_REFRESH_DEFAULT_SECONDS),
+            format_func=DASHBOARD_REFRESH_OPTIONS.get,
+            key="dashboard_refresh_seconds"
+        )
+    with col_reload:
+        # Un widget fuera de las secciones re-ejecuta el dashboard completo
+        st.button(f"{get_icon_symbol('refresh')} Actualizar todo", use_container_width=True, key="btn_dashboard_reload")
+    live_every = refresh_seconds or None
+    
+    st.fragment(_dashboard_kpi_panel, run_every=live_every)(current_project, baseline)
+    st.divider()
+    st.fragment(_dashboard_history_panel)()
+    st.divider()
+    _dashboard_charts_panel()
+    st.divider()
+    _dashboard_evm_panel()
+    st.divider()
+    _dashboard_schedule_panel()
+    st.divider()
+    st.fragment(_dashboard_simulation_panel, run_every=live_every)()
+    st.divider()
+    _dashboard_activities_panel()
+    st.divider()
+    st.fragment(_dashboard_team_panel, run_every=live_every)()
+    st.divider()
+    st.fragment(_dashboard_alerts_panel, run_every=live_every)()
+    st.divider()
+    st.fragment(_dashboard_audit_panel, run_every=live_every)()
+    st.divider()
+    st.fragment(_dashboard_risks_panel)()
+    st.divider()
+    st.fragment(_dashboard_docs_panel, run_every=live_every)()
+    st.divider()
+    _dashboard_day_summary()
+    st.divider()
     
     # --- FORMULARIOS PARA INGRESAR INFORMACIÓN ---
     st.markdown(f'<h3>{get_icon("add", "md")} Gestión de Información del Proyecto</h3>', unsafe_allow_html=True)
     
-    tab_act, tab_pers, tab_bud, tab_mil, tab_imp = st.tabs([
-        f"{get_icon_symbol('building')} Actividades",
-        f"{get_icon_symbol('team')} Personal",
-        f"{get_icon_symbol('money')} Presupuesto",
-        f"{get_icon_symbol('calendar')} Hitos",
-        f"{get_icon_symbol('check')} Mejoras"
-    ])
-    
-    # TAB: ACTIVIDADES
-    with tab_act:
-        st.write("**Agregar Nueva Actividad**")
-        with st.form("form_activity", clear_on_submit=True):
-            col1, col2 = st.columns(2)
-            with col1:
-                act_name = st.text_input("Nombre de la Actividad *", placeholder="Ej: Hormigonado Torre A - Piso 8")
-                act_responsible = st.text_input("Responsable *", placeholder="Ej: Equipo Alfa")
-                act_location = st.text_input("Ubicación", placeholder="Ej: Torre A - Piso 8")
-            with col2:
-                act_progress = st.number_input("Avance (%)", min_value=0, max_value=100, value=0)
-                act_status = st.selectbox("Estado *", ["Pendiente", "En Curso", "Retrasado", "Completado"])
-                act_priority = st.selectbox("Prioridad", ["Baja", "Media", "Alta", "Crítica"])
-            
-            act_start = st.date_input("Fecha de Inicio", value=datetime.now().date())
-            act_end = st.date_input("Fecha de Fin Planificada")
-            act_notes = st.text_area("Notas adicionales", placeholder="Observaciones, comentarios...")
-            
-            submitted = st.form_submit_button("Guardar Actividad", type="primary", use_container_width=True)
-            
-            if submitted:
-                if act_name and act_responsible:
-                    activity_data = {
-                        "nombre": act_name,
-                        "responsable": act_responsible,
-                        "ubicacion": act_location,
-                        "avance": act_progress,
-                        "estado": act_status,
-                        "prioridad": act_priority,
-                        "fecha_inicio": act_start.strftime("%d/%m/%Y"),
-                        "fecha_fin": act_end.strftime("%d/%m/%Y") if act_end else None,
-                        "notas": act_notes,
-                        "created_by": st.session_state.user_info['name']
-                    }
-                    with st.spinner("Guardando actividad..."):
-                        if dm.add_activity(activity_data):
-                            show_success_message(f'Actividad "{act_name}" agregada correctamente', 2)
-                            time.sleep(0.5)
-                            st.rerun()
-                        else:
-                            show_error_message("Error al guardar la actividad. Intenta nuevamente.")
-                else:
-                    show_error_message("Completa los campos obligatorios (*)")
-        
-        st.divider()
-        st.write("**Actividades Registradas**")
-        activities = dm.get_activities()
-        if activities:
-            activities_df = pd.DataFrame(activities)
-            if not activities_df.empty:
-                display_cols = ["nombre", "responsable", "avance", "estado", "fecha_inicio", "fecha_fin"]
-                available_cols = [col for col in display_cols if col in activities_df.columns]
-                if available_cols:
-                    st.dataframe(
-                        activities_df[available_cols],
-                        use_container_width=True,
-                        hide_index=True,
-                        height=200
-                    )
-        else:
-            st.info("No hay actividades registradas aún")
-    
-    # TAB: PERSONAL
-    with tab_pers:
-        st.markdown(f'<h4>{get_icon("user", "sm")} Registrar Personal</h4>', unsafe_allow_html=True)
-        with st.form("form_personnel", clear_on_submit=True):
-            col1, col2 = st.columns(2)
-            with col1:
-                pers_name = st.text_input("Nombre Completo *", placeholder="Ej: Juan Pérez", help="Nombre completo del trabajador")
-                pers_role = st.selectbox("Rol/Cargo *", ["Albañil", "Carpintero", "Electricista", "Plomero", "Supervisor", "Ingeniero", "Arquitecto", "Otro"], help="Cargo o especialidad")
-                pers_team = st.text_input("Equipo", placeholder="Ej: Equipo Alfa", help="Equipo o cuadrilla asignada")
-            with col2:
-                pers_phone = st.text_input("Teléfono", placeholder="+56 9 1234 5678", help="Número de contacto")
-                pers_email = st.text_input("Email", placeholder="juan.perez@empresa.cl", help="Correo electrónico")
-                pers_status = st.selectbox("Estado", ["Activo", "Inactivo", "Vacaciones", "Licencia"], help="Estado actual del trabajador")
-            
-            # Campos adicionales
-            pers_dni = st.text_input("DNI/RUT", placeholder="12.345.678-9", help="Documento de identidad")
-            pers_start_date = st.date_input("Fecha de Ingreso", value=datetime.now().date(), help="Fecha en que comenzó a trabajar")
-            
-            submitted = st.form_submit_button(f'{get_icon_symbol("add")} Registrar Personal', type="primary", use_container_width=True)
-            
-            if submitted:
-                if pers_name and pers_role:
-                    with st.spinner("Registrando personal..."):
-                        personnel_data = {
-                            "nombre": pers_name,
-                            "rol": pers_role,
-                            "equipo": pers_team,
-                            "telefono": pers_phone,
-                            "email": pers_email,
-                            "dni": pers_dni,
-                            "fecha_ingreso": pers_start_date.strftime("%d/%m/%Y"),
-                            "estado": pers_status,
-                            "created_by": st.session_state.user_info['name']
-                        }
-                        if dm.add_personnel(personnel_data):
-                            st.success(f'✅ **Personal "{pers_name}" registrado correctamente**')
-                            time.sleep(0.5)
-                            st.rerun()
-                else:
-                    st.error("⚠️ **Completa los campos obligatorios (*)**")
-        
-        st.divider()
-        
-        # Sección de personal registrado con opción de descarga
-        col_header, col_export = st.columns([3, 1])
-        with col_header:
-            st.markdown(f'<h4>{get_icon("team", "sm")} Personal Registrado</h4>', unsafe_allow_html=True)
-        with col_export:
-            personnel = dm.get_personnel()
-            if personnel:
-                pers_df = pd.DataFrame(personnel)
-                if not pers_df.empty:
-                    csv = pers_df.to_csv(index=False).encode('utf-8')
-                    st.download_button(
-                        label=f'{get_icon_symbol("download")} Exportar',
-                        data=csv,
-                        file_name=f"personal_{datetime.now().strftime('%Y%m%d')}.csv",
-                        mime="text/csv",
-                        use_container_width=True,
-                        key="export_personnel"
-                    )
-        
-        personnel = dm.get_personnel()
-        if personnel:
-            pers_df = pd.DataFrame(personnel)
-            if not pers_df.empty:
-                display_cols = ["nombre", "rol", "equipo", "estado", "fecha_ingreso"]
-                available_cols = [col for col in display_cols if col in pers_df.columns]
-                if available_cols:
-                    st.dataframe(
-                        pers_df[available_cols],
-                        use_container_width=True,
-                        hide_index=True,
-                        height=200
-                    )
-        else:
-            st.info("No hay personal registrado aún")
+    render_lazy_tabs("dashboard_manage_tab", {
+        f"{get_icon_symbol('building')} Actividades": _manage_activities_panel,
+        f"{get_icon_symbol('team')} Personal": _manage_personnel_panel,
+        f"{get_icon_symbol('money')} Presupuesto": _manage_budget_panel,
+        f"{get_icon_symbol('calendar')} Hitos": _manage_milestones_panel,
+        f"{get_icon_symbol('check')} Mejoras": _manage_improvements_panel,
+    })
+
+def _portfolio_panel(portfolio: pd.DataFrame) -> None:
+    """Filtros, orden y tabla del portafolio; filtrar solo re-ejecuta este panel"""
+    col_text, col_status, col_type = st.columns([2, 1, 1])
+    with col_text:
+        text = st.text_input("Buscar", placeholder="Nombre o ubicación", key="portfolio_text").strip()
+    with col_status:
+        statuses = st.multiselect("Estado", sorted(portfolio["status"].dropna().unique()), key="portfolio_status")
+    with col_type:
+        types = st.multiselect("Tipo", sorted(t for t in portfolio["construction_type"].dropna().unique() if t), key="portfolio_type")
+    col_sort, col_flag = st.columns([2, 1])
+    with col_sort:
+        sort_label = st.selectbox("Ordenar por", list(PORTFOLIO_SORTS), key="portfolio_sort")
+    with col_flag:
+        only_alerts = st.toggle("Solo con alertas críticas", key="portfolio_only_alerts")
+    
+    # Filtros como máscaras booleanas sobre las columnas (sin recorrer proyectos)
+    mask = np.ones(len(portfolio), dtype=bool)
+    if text:
+        mask &= (portfolio["name"].str.contains(text, case=False, regex=False)
+                 | portfolio["location"].fillna("").str.contains(text, case=False, regex=False)).to_numpy()
+    if statuses:
+        mask &= portfolio["status"].isin(statuses).to_numpy()
+    if types:
+        mask &= portfolio["construction_type"].isin(types).to_numpy()
+    if only_alerts:
+        mask &= (portfolio["critical_alerts"] > 0).to_numpy()
+    column, ascending = PORTFOLIO_SORTS[sort_label]
+    view = portfolio[mask].sort_values(column, ascending=ascending)
+    st.caption(f"{len(view)} de {len(portfolio)} proyectos")
+    
+    table = view.rename(columns={
+        "name": "Proyecto", "status": "Estado", "location": "Ubicación",
+        "physical_progress": "Avance Físico", "budget_percent": "Avance Financiero", "schedule_gap": "Desfase (pts)",
+        "qa_approval_rate": "Calidad (%)", "pending_docs": "Docs Pendientes", "pending_improvements": "Mejoras Pendientes",
+        "risks": "Riesgos", "high_risks": "Riesgos Altos", "critical_alerts": "Alertas Críticas",
+    })
+    st.dataframe(
+        table[["Proyecto", "Estado", "Ubicación", "Avance Físico", "Avance Financiero", "Desfase (pts)", "Calidad (%)",
+               "Docs Pendientes", "Mejoras Pendientes", "Riesgos", "Riesgos Altos", "Alertas Críticas"]],
+        column_config={
+            "Avance Físico": st.column_config.ProgressColumn("Avance Físico", format="%.1f%%", min_value=0, max_value=100),
+            "Avance Financiero": st.column_config.ProgressColumn("Avance Financiero", format="%.1f%%", min_value=0, max_value=100),
+            "Desfase (pts)": st.column_config.NumberColumn("Desfase (pts)", format="%.1f",
+                                                           help="Avance financiero menos avance físico: positivo = gasto adelantado a la obra"),
+            "Calidad (%)": st.column_config.NumberColumn("Calidad (%)", format="%.1f"),
+        },
+        use_container_width=True,
+        hide_index=True,
+        height=min(600, 38 + 35 * max(len(table), 1))
+    )
     
-    # TAB: PRESUPUESTO
-    with tab_bud:
-        st.write("**Actualizar Presupuesto Ejecutado**")
-        budget = dm.get_budget()
-        
-        st.write(f"**Presupuesto Total:** ${budget['total']:,.0f}")
-        st.write(f"**Ejecutado:** ${budget['executed']:,.0f} ({budget['executed']/budget['total']*100:.1f}%)")
-        st.progress(budget['executed']/budget['total'])
-        
-        with st.form("form_budget", clear_on_submit=True):
-            budget_category = st.selectbox("Categoría *", list(budget['categories'].keys()))
-            budget_amount = st.number_input("Monto Ejecutado ($)", min_value=0.0, value=0.0, step=1000.0)
-            budget_notes = st.text_area("Descripción", placeholder="Detalle del gasto...")
-            
-            submitted = st.form_submit_button("Registrar Gasto", type="primary", use_container_width=True)
-            
-            if submitted:
-                if budget_amount > 0:
-                    if budget_amount > budget['categories'][budget_category]['budget']:
-                        show_warning_message(f"El monto excede el presupuesto asignado para {budget_category}")
-                    else:
-                        with st.spinner("Registrando gasto..."):
-                            if dm.update_budget(budget_category, budget_amount):
-                                show_success_message(f'Gasto de ${budget_amount:,.0f} registrado en {budget_category}', 2)
-                                time.sleep(0.5)
-                                st.rerun()
-                            else:
-                                show_error_message("Error al registrar el gasto. Intenta nuevamente.")
-                else:
-                    show_error_message("Ingresa un monto válido mayor a cero")
-        
-        st.divider()
-        st.write("**Desglose por Categoría**")
-        budget_cats = budget['categories']
-        budget_df = pd.DataFrame({
-            'Categoría': list(budget_cats.keys()),
-            'Presupuestado': [budget_cats[cat]['budget'] for cat in budget_cats],
-            'Ejecutado': [budget_cats[cat]['executed'] for cat in budget_cats]
-        })
-        budget_df['% Ejecutado'] = (budget_df['Ejecutado'] / budget_df['Presupuestado'] * 100).round(1)
-        budget_df['Restante'] = budget_df['Presupuestado'] - budget_df['Ejecutado']
-        
-        st.dataframe(
-            budget_df,
+    if not view.empty:
+        st.scatter_chart(view, x="budget_percent", y="physical_progress", use_container_width=True)
+        st.caption("Avance físico vs financiero por proyecto: bajo la diagonal, la obra va más lenta que el gasto")
+        st.download_button(
+            label=f'{get_icon_symbol("download")} Exportar Portafolio',
+            data=table.to_csv().encode("utf-8"),
+            file_name=f"portafolio_{datetime.now().strftime('%Y%m%d')}.csv",
+            mime="text/csv",
             use_container_width=True,
-            hide_index=True
+            key="export_portfolio"
         )
+
+def view_portfolio():
+    """Comparación de todos los proyectos sin cambiar el proyecto actual (la vista no escribe en la base)"""
+    render_header_with_icon("Portafolio de Proyectos", "project")
+    portfolio = dm.get_portfolio_frame()
+    if portfolio.empty:
+        st.info("No hay proyectos creados. Crea tu primer proyecto en 'Proyectos'.")
+        return
     
-    # TAB: HITOS
-    with tab_mil:
-        st.write("**Agregar Hito del Proyecto**")
-        with st.form("form_milestone", clear_on_submit=True):
-            mil_name = st.text_input("Nombre del Hito *", placeholder="Ej: Finalización Estructura Torre A")
-            mil_date = st.date_input("Fecha Planificada *", value=datetime.now().date())
-            mil_description = st.text_area("Descripción", placeholder="Detalles del hito...")
-            mil_status = st.selectbox("Estado", ["Planificado", "En Progreso", "Completado", "Retrasado"])
-            
-            submitted = st.form_submit_button("Agregar Hito", type="primary", use_container_width=True)
-            
-            if submitted:
-                if mil_name:
-                    milestone_data = {
-                        "nombre": mil_name,
-                        "fecha": mil_date.strftime("%d/%m/%Y"),
-                        "descripcion": mil_description,
-                        "estado": mil_status,
-                        "created_by": st.session_state.user_info['name']
-                    }
-                    with st.spinner("Agregando hito..."):
-                        if dm.add_milestone(milestone_data):
-                            st.success(f'✅ **Hito "{mil_name}" agregado correctamente**')
-                            time.sleep(0.5)
-                            st.rerun()
-                else:
-                    st.error("⚠️ **Completa el nombre del hito**")
+    # Totales del portafolio: avance físico ponderado por presupuesto
+    budget_total = portfolio["budget_total"].sum()
+    budget_executed = portfolio["budget_executed"].sum()
+    weights = portfolio["budget_total"].to_numpy(dtype=float)
+    weighted_progress = np.average(portfolio["physical_progress"], weights=weights) if weights.sum() > 0 else portfolio["physical_progress"].mean()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Proyectos", len(portfolio), help="Total de proyectos registrados")
+    with col2:
+        st.metric("Avance Físico Ponderado", f"{weighted_progress:.1f}%", help="Promedio del avance físico ponderado por presupuesto")
+    with col3:
+        st.metric("Presupuesto Ejecutado", f"{(budget_executed / budget_total * 100) if budget_total > 0 else 0:.1f}%",
+                  help=f"${budget_executed:,.0f} de ${budget_total:,.0f}")
+    with col4:
+        st.metric("Con Alertas Críticas", int((portfolio["critical_alerts"] > 0).sum()))
+    
+    st.divider()
+    st.fragment(_portfolio_panel)(portfolio)
+
+def _docs_upload_tab() -> None:
+    """Subida de planos desde archivo"""
+    uploaded_file = st.file_uploader(
+        "PDF / DWG", 
+        label_visibility="collapsed",
+        type=['pdf', 'dwg', 'dwgx', 'dxf'],
+        help=f"Tamaño máximo: {MAX_FILE_SIZE_MB}MB"
+    )
+    if uploaded_file:
+        file_size_mb = get_stream_size(uploaded_file) / (1024 * 1024)
+        st.caption(f"📄 {uploaded_file.name} ({file_size_mb:.2f} MB)")
         
-        st.divider()
-        st.write("**Hitos del Proyecto**")
-        milestones = dm.get_milestones()
-        if milestones:
-            mil_df = pd.DataFrame(milestones)
-            if not mil_df.empty:
-                display_cols = ["nombre", "fecha", "estado"]
-                available_cols = [col for col in display_cols if col in mil_df.columns]
-                if available_cols:
-                    st.dataframe(
-                        mil_df[available_cols],
-                        use_container_width=True,
-                        hide_index=True,
-                        height=200
-                    )
-        else:
-            st.info("No hay hitos registrados aún")
-    
-    # TAB: MEJORAS
-    with tab_imp:
-        st.write("**Sugerir Mejora o Cambio**")
-        with st.form("form_improvement", clear_on_submit=True):
-            imp_title = st.text_input("Título de la Mejora *", placeholder="Ej: Optimizar proceso de hormigonado")
-            imp_category = st.selectbox("Categoría *", ["Proceso", "Seguridad", "Calidad", "Eficiencia", "Costo", "Otro"])
-            imp_description = st.text_area("Descripción Detallada *", placeholder="Describe la mejora propuesta, beneficios esperados...", height=150)
-            imp_priority = st.selectbox("Prioridad", ["Baja", "Media", "Alta", "Crítica"])
-            imp_estimated_impact = st.text_area("Impacto Estimado", placeholder="Ahorro de tiempo, reducción de costos, mejora de calidad...")
-            
-            submitted = st.form_submit_button("Enviar Sugerencia", type="primary", use_container_width=True)
-            
-            if submitted:
-                if imp_title and imp_description:
-                    with st.spinner("Enviando sugerencia..."):
-                        improvement_data = {
-                            "titulo": imp_title,
-                            "categoria": imp_category,
-                            "descripcion": imp_description,
-                            "prioridad": imp_priority,
-                            "impacto_estimado": imp_estimated_impact,
-                            "autor": st.session_state.user_info['name'],
-                            "rol_autor": st.session_state.user_info['role']
-                        }
-                        if dm.add_improvement(improvement_data):
-                            st.success(f'✅ **Sugerencia de mejora "{imp_title}" enviada correctamente**')
-                            time.sleep(0.5)
-                            st.rerun()
-                else:
-                    st.error("⚠️ **Completa los campos obligatorios (*)**")
+        col_upload, col_version = st.columns([2, 1])
+        with col_version:
+            file_version = st.text_input("Versión", value="v1.0", placeholder="v1.0")
         
-        st.divider()
-        st.write("**Mejoras y Sugerencias**")
-        improvements = dm.get_improvements()
-        if improvements:
-            for imp in improvements:
-                status_color = {
-                    "Pendiente": "🟡",
-                    "En Evaluación": "🔵",
-                    "Aprobada": "🟢",
-                    "Rechazada": "🔴",
-                    "Implementada": "✅"
-                }.get(imp.get("status", "Pendiente"), "🟡")
+        if st.button(f'{get_icon_symbol("upload")} Guardar Archivo', use_container_width=True, type="primary", key="btn_guardar_archivo_docs"):
+            if dm.upload_file(uploaded_file, {"version": file_version}):
+                st.rerun()
+
+def _docs_scan_tab() -> None:
+    """Escaneo de documentos con la cámara del celular"""
+    # Cámara nativa del celular
+    img_file = st.camera_input("Tomar foto a documento", help="Toma una foto del documento para escanearlo")
+    if img_file:
+        try:
+            # Validar imagen
+            is_valid, message = validate_file(img_file, MAX_IMAGE_SIZE_MB, ALLOWED_IMAGE_TYPES + ['.jpg', '.jpeg', '.png'])
+            if is_valid:
+                st.success("✅ Foto capturada. Procesando...")
+                # Mostrar preview de la imagen
+                try:
+                    st.image(make_display_preview(img_file.getvalue(), 400), caption="Vista previa del documento", use_container_width=True)
+                except Exception as e:
+                    logger.warning(f"Error mostrando preview de imagen: {e}")
                 
-                with st.expander(f"{status_color} {imp.get('titulo', 'Sin título')} - {imp.get('status', 'Pendiente')}"):
-                    st.write(f"**Categoría:** {imp.get('categoria', 'N/A')}")
-                    st.write(f"**Prioridad:** {imp.get('prioridad', 'N/A')}")
-                    st.write(f"**Autor:** {imp.get('autor', 'N/A')}")
-                    st.write(f"**Descripción:** {imp.get('descripcion', 'Sin descripción')}")
-                    if imp.get('impacto_estimado'):
-                        st.write(f"**Impacto Estimado:** {imp['impacto_estimado']}")
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.button(f"{get_icon_symbol('check')} Aprobar", key=f"approve_{imp['id']}", use_container_width=True):
-                            if dm.update_improvement_status(imp['id'], "Aprobada"):
-                                st.success("✅ **Mejora aprobada**")
-                                time.sleep(0.5)
-                                st.rerun()
-                    with col2:
-                        if st.button(f"{get_icon_symbol('check')} Implementar", key=f"implement_{imp['id']}", use_container_width=True):
-                            if dm.update_improvement_status(imp['id'], "Implementada"):
-                                st.success("✅ **Mejora marcada como implementada**")
-                                time.sleep(0.5)
-                                st.rerun()
-        else:
-            st.info("No hay mejoras registradas aún")
+                # Aquí se podría implementar OCR
+                if st.button("Guardar como Documento", use_container_width=True, type="primary", key="btn_guardar_doc_camara"):
+                    try:
+                        # Convertir imagen a formato de archivo para subir
+                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                        filename = f"scanned_doc_{timestamp}.jpg"
+                        img_file.name = filename
+                        if dm.upload_file(img_file, {"version": "v1.0", "source": "camera"}):
+                            st.rerun()
+                        else:
+                            st.error("❌ Error al guardar el documento. Intenta nuevamente.")
+                    except Exception as e:
+                        logger.error(f"Error guardando documento desde cámara: {e}")
+                        st.error(f"❌ Error al guardar: {str(e)}")
+            else:
+                st.error(f"❌ {message}")
+        except Exception as e:
+            logger.error(f"Error procesando imagen de cámara: {e}")
+            st.error(f"❌ Error al procesar la imagen: {str(e)}")
 
 def view_docs():
     render_header_with_icon("Planos y Documentos", "documents")
     
-    # Subida Dual: Archivo (Escritorio) o Cámara (Móvil)
-    tab1, tab2 = st.tabs([
-        f"{get_icon_symbol('upload')} Subir Archivo",
-        f"{get_icon_symbol('camera')} Escanear Documento"
-    ])
-    
-    with tab1:
-        uploaded_file = st.file_uploader(
-            "PDF / DWG", 
-            label_visibility="collapsed",
-            type=['pdf', 'dwg', 'dwgx', 'dxf'],
-            help=f"Tamaño máximo: {MAX_FILE_SIZE_MB}MB"
-        )
-        if uploaded_file:
-            file_size_mb = len(uploaded_file.getvalue()) / (1024 * 1024)
-            st.caption(f"📄 {uploaded_file.name} ({file_size_mb:.2f} MB)")
-            
-            col_upload, col_version = st.columns([2, 1])
-            with col_version:
-                file_version = st.text_input("Versión", value="v1.0", placeholder="v1.0")
-            
-            if st.button(f'{get_icon_symbol("upload")} Guardar Archivo', use_container_width=True, type="primary", key="btn_guardar_archivo_docs"):
-                with st.spinner("Subiendo archivo..."):
-                    if dm.upload_file(uploaded_file, {"version": file_version}):
-                        st.success(f'✅ **Archivo "{uploaded_file.name}" guardado correctamente**')
-                        time.sleep(0.5)
-                        st.rerun()
-             
-    with tab2:
-        # Cámara nativa del celular
-        img_file = st.camera_input("Tomar foto a documento", help="Toma una foto del documento para escanearlo")
-        if img_file:
-            try:
-                # Validar imagen
-                is_valid, message = validate_file(img_file, MAX_IMAGE_SIZE_MB, ALLOWED_IMAGE_TYPES + ['.jpg', '.jpeg', '.png'])
-                if is_valid:
-                    st.success("✅ Foto capturada. Procesando...")
-                    # Mostrar preview de la imagen
-                    try:
-                        st.image(img_file, caption="Vista previa del documento", use_container_width=True)
-                    except Exception as e:
-                        logger.warning(f"Error mostrando preview de imagen: {e}")
-                    
-                    # Aquí se podría implementar OCR
-                    if st.button("Guardar como Documento", use_container_width=True, type="primary", key="btn_guardar_doc_camara"):
-                        with st.spinner("Guardando documento..."):
-                            try:
-                                # Convertir imagen a formato de archivo para subir
-                                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                filename = f"scanned_doc_{timestamp}.jpg"
-                                img_file.name = filename
-                                if dm.upload_file(img_file, {"version": "v1.0", "source": "camera"}):
-                                    st.success(f'✅ Documento "{filename}" guardado correctamente')
-                                    time.sleep(0.5)
-                                    st.rerun()
-                                else:
-                                    st.error("❌ Error al guardar el documento. Intenta nuevamente.")
-                            except Exception as e:
-                                logger.error(f"Error guardando documento desde cámara: {e}")
-                                st.error(f"❌ Error al guardar: {str(e)}")
-                else:
-                    st.error(f"❌ {message}")
-            except Exception as e:
-                logger.error(f"Error procesando imagen de cámara: {e}")
-                st.error(f"❌ Error al procesar la imagen: {str(e)}")
-            
+    # Subida Dual: Archivo (Escritorio) o Cámara (Móvil); solo se ejecuta la pestaña activa
+    render_lazy_tabs("docs_tab", {
+        f"{get_icon_symbol('upload')} Subir Archivo": _docs_upload_tab,
+        f"{get_icon_symbol('camera')} Escanear Documento": _docs_scan_tab,
+    })
+    
+    render_upload_progress("document")
+    
     # Sección de archivos con descarga
     col_files, col_download_files = st.columns([3, 1])
     with col_files:
@@ -3077,7 +6887,7 @@ def view_docs():
     with col_download_files:
         docs = dm.get_docs()
         if docs:
-            df = pd.DataFrame(docs)
+            df = dm.get_frame("docs", docs)
             csv = df.to_csv(index=False).encode('utf-8')
             st.download_button(
                 label=f'{get_icon_symbol("download")} Exportar',
@@ -3090,12 +6900,59 @@ def view_docs():
     
     docs = dm.get_docs()
     if docs:
-        # Limitar a 20 registros para mejor rendimiento en móvil
-        df = pd.DataFrame(docs[:20])
+        # Solo la revisión vigente de cada documento; limitar a 20 registros para mejor rendimiento en móvil
+        versions = get_document_versions()
+        current = [d for d in docs if versions.is_current(d)]
+        # Filtro sobre el resumen ya extraído (Metadatos): no se vuelve a abrir ningún archivo
+        needle = st.text_input("Filtrar", placeholder="Nombre, capa o formato (A1, A3...)", key="doc_filter").strip().lower()
+        if needle:
+            current = [d for d in current if needle in d.get("Archivo", "").lower() or any(
+                needle in str(value).lower()
+                for value in [*(d.get("Metadatos") or {}).get("layer_names", []), *(d.get("Metadatos") or {}).get("page_sizes", {})]
+            )]
+        current = current[:20]
+        df = pd.DataFrame(current)
+        if not df.empty:
+            df["Resumen"] = [
+                summarize_plan_metadata(d.get("Metadatos")) or ("Analizando..." if d.get("Metadatos_Estado") == "Pendiente" else "")
+                for d in current
+            ]
         # Mostrar solo columnas esenciales en móvil
-        display_cols = ["Archivo", "Versión", "Fecha", "Estado"]
+        display_cols = ["Archivo", "Versión", "Revisión", "Resumen", "Fecha", "Estado", "Upload_Estado"]
         available_cols = [col for col in display_cols if col in df.columns]
         st.dataframe(df[available_cols], use_container_width=True, hide_index=True, height=300)
+        
+        stored = [d for d in current if d.get("File_Path")]
+        if stored:
+            selected = st.selectbox(
+                "Descargar archivo", range(len(stored)), key="doc_download_select",
+                format_func=lambda i: f"{stored[i].get('Archivo')} · {stored[i].get('Fecha', '')}",
+            )
+            render_file_download(stored[selected]["File_Path"], stored[selected].get("Archivo") or "documento", "doc_download")
+        
+        history = [d for d in versions.documents(dm.get_current_project_id()) if len(d["revisions"]) > 1]
+        if history:
+            with st.expander(f"🗂️ Historial de revisiones ({len(history)} documentos)"):
+                doc = history[st.selectbox("Documento", range(len(history)), key="doc_history_select",
+                                           format_func=lambda i: history[i]["name"])]
+                revisions = list(reversed(doc["revisions"]))
+                st.dataframe(pd.DataFrame([{
+                    "Revisión": r["number"],
+                    "Versión": r["version"],
+                    "Fecha": r["created_at"][:16].replace("T", " "),
+                    "Tamaño (KB)": round(r["size"] / 1024, 1),
+                    "Guardado (KB)": round(r["stored_bytes"] / 1024, 1),
+                    "Fragmentos nuevos": f"{r['new_chunks']}/{len(r['chunks'])}",
+                } for r in revisions]), use_container_width=True, hide_index=True)
+                revision = revisions[st.selectbox("Revisión a descargar", range(len(revisions)), key="doc_history_revision",
+                                                  format_func=lambda i: f"R{revisions[i]['number']} · {revisions[i]['version']}")]
+                # La vigente se sirve directo; las anteriores se reconstruyen desde los fragmentos (una vez)
+                path = revision["path"] or versions.materialize(doc["doc_id"], revision["rev_id"])
+                if path is None:
+                    st.warning("Esta revisión no está disponible en este momento")
+                else:
+                    name = Path(doc["name"])
+                    render_file_download(str(path), f"{name.stem}_R{revision['number']}{name.suffix}", "doc_history_download")
     else:
         st.info("No hay archivos registrados aún")
 
@@ -3121,10 +6978,15 @@ def view_qa():
         # Mostrar preview si hay foto
         if photo:
             try:
-                st.image(photo, caption="Vista previa de la inspección", use_container_width=True, width=300)
+                st.image(make_display_preview(photo.getvalue(), 300), caption="Vista previa de la inspección", use_container_width=True)
             except Exception as e:
                 logger.warning(f"Error mostrando preview de foto de inspección: {e}")
         
+        extra_photos = st.file_uploader(
+            "Fotos adicionales (galería)", type=['jpg', 'jpeg', 'png', 'webp'], accept_multiple_files=True,
+            help="Sube varias fotos de la jornada de una vez; se procesan en paralelo",
+        )
+        
         submitted = st.form_submit_button(f'{get_icon_symbol("check")} Guardar Reporte', type="primary", use_container_width=True)
         
         if submitted:
@@ -3132,23 +6994,29 @@ def view_qa():
                 st.warning("⚠️ Por favor, ingresa una ubicación")
             else:
                 try:
-                    with st.spinner("Guardando inspección..."):
-                        new_inspection = {
-                            "Fecha": format_date(datetime.now()),
-                            "Actividad": f"{insp_type} - {location}",
-                            "Auditor": st.session_state.user_info['name'],
-                            "Resultado": result,
-                            "Tipo": insp_type,
-                            "Ubicacion": location
-                        }
-                        dm.save_inspection(new_inspection, photo)
-                        st.success("✅ **Inspección guardada correctamente**")
-                        time.sleep(0.5)
-                        st.rerun()
+                    new_inspection = {
+                        "Fecha": format_date(datetime.now()),
+                        "Actividad": f"{insp_type} - {location}",
+                        "Auditor": st.session_state.user_info['name'],
+                        "Resultado": result,
+                        "Tipo": insp_type,
+                        "Ubicacion": location
+                    }
+                    valid_extra = []
+                    for extra in extra_photos or []:
+                        is_valid, message = validate_file(extra, MAX_IMAGE_SIZE_MB, ALLOWED_IMAGE_TYPES)
+                        if is_valid:
+                            valid_extra.append(extra)
+                        else:
+                            st.warning(f"⚠️ {extra.name}: {message}")
+                    dm.save_inspection(new_inspection, photo, valid_extra)
+                    st.rerun()
                 except Exception as e:
                     logger.error(f"Error guardando inspección: {e}")
                     st.error(f"❌ Error al guardar la inspección: {str(e)}")
 
+    render_upload_progress("photo")
+    
     # Historial con descarga
     col_hist, col_download_hist = st.columns([3, 1])
     with col_hist:
@@ -3156,7 +7024,7 @@ def view_qa():
     with col_download_hist:
         inspections = dm.get_inspections()
         if inspections:
-            df = pd.DataFrame(inspections)
+            df = dm.get_frame("inspections", inspections)
             csv = df.to_csv(index=False).encode('utf-8')
             st.download_button(
                 label=f'{get_icon_symbol("download")} Exportar',
@@ -3170,13 +7038,43 @@ def view_qa():
     inspections = dm.get_inspections()
     if inspections:
         # Limitar a 20 registros
-        df = pd.DataFrame(inspections[:20])
+        df = dm.get_frame("inspections", inspections).head(20)
         # Columnas esenciales
-        display_cols = ["Fecha", "Actividad", "Auditor", "Resultado", "Tiene_Foto"]
+        display_cols = ["Fecha", "Actividad", "Auditor", "Resultado", "Tiene_Foto", "Upload_Estado"]
         available_cols = [col for col in display_cols if col in df.columns]
         st.dataframe(df[available_cols], use_container_width=True, hide_index=True, height=300)
     else:
         st.info("No hay inspecciones registradas aún")
+    
+    # Registro fotográfico: consulta el índice de metadatos, sin abrir imágenes
+    photo_index = get_photo_index()
+    if len(photo_index):
+        with st.expander(f"{get_icon_symbol('camera')} Registro fotográfico ({len(photo_index)} fotos)"):
+            col_text, col_from, col_to = st.columns([2, 1, 1])
+            with col_text:
+                photo_text = st.text_input("Ubicación o actividad", placeholder="Ej: Torre A", key="qa_photo_filter")
+            with col_from:
+                photo_from = st.date_input("Desde", value=None, key="qa_photo_from")
+            with col_to:
+                photo_to = st.date_input("Hasta", value=None, key="qa_photo_to")
+            photos_df = photo_index.query(
+                project_id=dm.get_current_project_id(),
+                text=photo_text.strip() or None,
+                start=datetime.combine(photo_from, datetime.min.time()) if photo_from else None,
+                end=datetime.combine(photo_to, datetime.max.time()) if photo_to else None,
+            )
+            if photos_df.empty:
+                st.info("No hay fotos para ese filtro")
+            else:
+                photos_df = photos_df.assign(
+                    Captura=photos_df["captured_at"].dt.strftime("%d/%m/%Y %H:%M"),
+                    Dimensiones=photos_df["width"].astype("Int64").astype(str) + "x" + photos_df["height"].astype("Int64").astype(str),
+                    GPS=photos_df["lat"].notna().map({True: "Sí", False: "No"}),
+                ).rename(columns={"entity_type": "Origen", "label": "Actividad", "location": "Ubicación", "camera": "Cámara"})
+                st.dataframe(
+                    photos_df[["Captura", "Origen", "Actividad", "Ubicación", "Cámara", "Dimensiones", "GPS"]],
+                    use_container_width=True, hide_index=True, height=250,
+                )
 
 def view_worker():
     render_header_with_icon("Perfil del Trabajador - Mi Jornada", "user")
@@ -3361,37 +7259,36 @@ def view_worker():
         # Mostrar preview si hay foto
         if incident_photo:
             try:
-                st.image(incident_photo, caption="Vista previa del incidente", use_container_width=True, width=300)
+                st.image(make_display_preview(incident_photo.getvalue(), 300), caption="Vista previa del incidente", use_container_width=True)
             except Exception as e:
                 logger.warning(f"Error mostrando preview de foto de incidente: {e}")
         
+        incident_extra = st.file_uploader(
+            "Fotos adicionales", type=['jpg', 'jpeg', 'png', 'webp'], accept_multiple_files=True,
+            key="incident_extra_photos", help="Se procesan en paralelo junto con la foto de la cámara",
+        )
+        
         if st.button(f'{get_icon_symbol("check")} ENVIAR REPORTE', type="primary", use_container_width=True, key="btn_enviar_reporte_incidente", help="Envía el reporte de incidente al equipo de seguridad"):
-            if incident_photo or incident_desc.strip():
+            if incident_photo or incident_extra or incident_desc.strip():
                 if confirm_action("¿Estás seguro de enviar este reporte de incidente? Se notificará inmediatamente al equipo de seguridad."):
                     try:
-                        with st.spinner("Enviando reporte..."):
-                            if incident_photo:
-                                try:
-                                    photo_bytes = incident_photo.getvalue()
-                                    compressed = compress_image(photo_bytes)
-                                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                    incident_path = PHOTOS_DIR / f"incident_{timestamp}.jpg"
-                                    incident_path.write_bytes(compressed)
-                                    logger.info(f"Foto de incidente guardada: {incident_path}")
-                                except Exception as e:
-                                    logger.error(f"Error guardando foto de incidente: {e}")
-                                    st.warning(f"⚠️ El reporte se envió pero hubo un error con la foto: {str(e)}")
-                            
-                            st.success("🚨 Reporte enviado a Prevención de Riesgos")
-                            st.info("✅ Tu reporte ha sido registrado. El equipo de seguridad se contactará contigo.")
-                            logger.warning(f"Incidente reportado por {st.session_state.user_info['name']}")
-                            time.sleep(2)
-                            st.rerun()
+                        incident_photos = [incident_photo] if incident_photo else []
+                        for extra in incident_extra or []:
+                            is_valid, message = validate_file(extra, MAX_IMAGE_SIZE_MB, ALLOWED_IMAGE_TYPES)
+                            if is_valid:
+                                incident_photos.append(extra)
+                            else:
+                                st.warning(f"⚠️ {extra.name}: {message}")
+                        dm.report_incident(incident_desc.strip(), incident_photos)
+                        st.success("🚨 Reporte enviado a Prevención de Riesgos")
+                        st.info("✅ Tu reporte ha sido registrado. El equipo de seguridad se contactará contigo.")
                     except Exception as e:
                         logger.error(f"Error enviando reporte de incidente: {e}")
                         st.error(f"❌ Error al enviar el reporte: {str(e)}")
             else:
                 st.warning("⚠️ Toma una foto o escribe una descripción del incidente")
+        
+        render_upload_progress("photo")
     
     # --- INFORMACIÓN DEL TRABAJADOR ---
     st.divider()
@@ -3439,20 +7336,17 @@ def view_client():
     # --- KPIs PRINCIPALES PARA CLIENTE (DATOS REALES) ---
     st.markdown(f'<h3>{get_icon("chart", "sm")} Resumen del Proyecto</h3>', unsafe_allow_html=True)
     
-    activities = dm.get_activities()
-    activities_df = pd.DataFrame(activities) if activities else pd.DataFrame()
+    activities = dm.get_activities()  # Para la tabla de actividades
     budget = dm.get_budget()
+    kpis = compute_kpis(dm.get_kpi_aggregates(), budget)
     
     # Avance físico promedio
-    if not activities_df.empty and "avance" in activities_df.columns:
-        physical_progress = float(activities_df["avance"].mean())
-    else:
-        physical_progress = 0.0
+    physical_progress = kpis["physical_progress"]
     
     # Avance financiero
-    budget_total = budget.get("total", 0)
-    budget_executed = budget.get("executed", 0)
-    budget_percent = (budget_executed / budget_total * 100) if budget_total > 0 else 0.0
+    budget_total = kpis["budget_total"]
+    budget_executed = kpis["budget_executed"]
+    budget_percent = kpis["budget_percent"]
     
     # Fechas y días
     start_date_str = current_project.get("start_date")
@@ -3462,8 +7356,14 @@ def view_client():
         start_date = datetime.now()
     today = datetime.now()
     days_elapsed = max(0, (today - start_date).days)
-    planned_duration_days = 365
-    days_remaining = max(0, planned_duration_days - days_elapsed)
+    # Término P50 de la simulación Monte Carlo; mientras corre, el término determinista de la ruta crítica
+    schedule_risk = dm.get_schedule_risk()
+    if schedule_risk:
+        finish_date = schedule_risk["finish"]["p50"]
+    else:
+        schedule = dm.get_critical_path()
+        finish_date = (schedule.origin + pd.Timedelta(days=schedule.project_finish)).date() if schedule.origin is not None else None
+    days_remaining = max(0, (finish_date - today.date()).days) if finish_date else None
     
     kpi_col1, kpi_col2, kpi_col3, kpi_col4 = st.columns(4)
     
@@ -3479,11 +7379,22 @@ def view_client():
     
     with kpi_col3:
         st.metric("Días Transcurridos", str(days_elapsed))
-        st.caption(f"De un horizonte estimado de {planned_duration_days} días")
+        if finish_date:
+            st.caption(f"Término estimado: {finish_date.strftime('%d/%m/%Y')}")
     
     with kpi_col4:
-        st.metric("Días Restantes (estimado)", str(days_remaining))
-        st.caption("Cálculo aproximado según duración estándar de 12 meses")
+        st.metric("Días Restantes (estimado)", "—" if days_remaining is None else str(days_remaining))
+        if schedule_risk:
+            st.caption(f"Mediana (P50) de {schedule_risk['iterations']:,} simulaciones; "
+                       f"con 80% de confianza antes del {schedule_risk['finish']['p80'].strftime('%d/%m/%Y')}")
+        elif finish_date:
+            st.caption("Según la ruta crítica; la simulación de riesgo se está calculando")
+        else:
+            st.caption("Sin actividades con fechas para estimar el término")
+    
+    # Índices de valor ganado precalculados al registrar actividades y gastos
+    evm_project = dm.get_evm()["project"]
+    render_evm_metrics(evm_project)
     
     # Botón para descargar resumen del cliente
     client_report = {
@@ -3497,7 +7408,10 @@ def view_client():
             "presupuesto_ejecutado": budget_executed,
             "dias_transcurridos": days_elapsed,
             "dias_restantes_estimados": days_remaining,
+            "termino_p50": str(schedule_risk["finish"]["p50"]) if schedule_risk else None,
+            "termino_p80": str(schedule_risk["finish"]["p80"]) if schedule_risk else None,
         },
+        "valor_ganado": evm_project,
     }
     
     col_kpi_title, col_kpi_download = st.columns([3, 1])
@@ -3519,28 +7433,7 @@ def view_client():
     
     with col_chart1:
         st.markdown(f'<h3>{get_icon("chart", "sm")} Curva de Avance</h3>', unsafe_allow_html=True)
-        if not activities_df.empty and "fecha_inicio" in activities_df.columns:
-            try:
-                act_dates = pd.to_datetime(activities_df["fecha_inicio"], format="%d/%m/%Y", errors="coerce")
-                df_curve = pd.DataFrame({"Fecha": act_dates, "Avance": activities_df.get("avance", 0)}).dropna()
-                df_curve = df_curve.sort_values("Fecha")
-                df_curve = df_curve.groupby("Fecha")["Avance"].mean().cumsum()
-                if df_curve.max() > 0:
-                    df_curve = df_curve / df_curve.max() * 100
-                st.line_chart(df_curve, use_container_width=True)
-                st.caption("Curva acumulada de avance físico (estimada)")
-            except Exception as e:
-                logger.warning(f"Error generando curva de avance cliente: {e}")
-        else:
-            progress_data = pd.DataFrame(
-                {
-                    "Mes": ["Ene", "Feb", "Mar", "Abr", "May", "Jun"],
-                    "Planificado": [10, 25, 45, 65, 80, 100],
-                    "Real": [8, 22, 42, 65, 0, 0],
-                }
-            )
-            st.line_chart(progress_data.set_index("Mes"), use_container_width=True)
-            st.caption("Ejemplo de curva planificado vs real (sin datos suficientes)")
+        render_s_curve()
     
     with col_chart2:
         st.subheader("💰 Ejecución Presupuestaria")
@@ -3565,7 +7458,7 @@ def view_client():
     st.markdown(f'<h3>{get_icon("building", "sm")} Estado de Actividades</h3>', unsafe_allow_html=True)
     
     if activities:
-        activities_df = pd.DataFrame(activities)
+        activities_df = dm.get_frame("activities", activities)
         if not activities_df.empty:
             display_df = pd.DataFrame(
                 {
@@ -3600,43 +7493,7 @@ def view_client():
     # --- GALERÍA DE FOTOS ---
     st.markdown(f'<h3>{get_icon("camera", "sm")} Galería de Avances</h3>', unsafe_allow_html=True)
     
-    gallery_col1, gallery_col2, gallery_col3 = st.columns(3)
-    
-    # Función helper para mostrar imágenes con fallback
-    def safe_image_display(image_path_or_url, caption):
-        """Muestra una imagen con manejo de errores"""
-        try:
-            if image_path_or_url.startswith("http"):
-                st.image(image_path_or_url, use_container_width=True, caption=caption)
-            else:
-                if Path(image_path_or_url).exists():
-                    st.image(image_path_or_url, use_container_width=True, caption=caption)
-                else:
-                    st.info(f"📷 {caption}\n\n*Imagen no disponible*")
-        except Exception as e:
-            logger.warning(f"Error mostrando imagen {image_path_or_url}: {e}")
-            st.info(f"📷 {caption}\n\n*Error al cargar imagen*")
-    
-    with gallery_col1:
-        safe_image_display(
-            "https://via.placeholder.com/400x300?text=Torre+A+-+Piso+8",
-            "Torre A - Piso 8 (Hormigonado)",
-        )
-    
-    with gallery_col2:
-        safe_image_display(
-            "https://via.placeholder.com/400x300?text=Instalaciones+Sanitarias",
-            "Instalaciones Sanitarias - Piso 5",
-        )
-    
-    with gallery_col3:
-        safe_image_display(
-            "https://via.placeholder.com/400x300?text=Fachada+Principal",
-            "Fachada Principal - Avance 30%",
-        )
-    
-    if st.button("Ver más fotos", use_container_width=True, key="btn_ver_mas_fotos_cliente"):
-        st.info("📸 Galería completa disponible en la sección de Documentos")
+    render_photo_gallery("client_gallery", current_project_id)
     
     st.divider()
     
@@ -3674,7 +7531,7 @@ def view_client():
     
     milestones = dm.get_milestones()
     if milestones:
-        milestones_df = pd.DataFrame(milestones)
+        milestones_df = dm.get_frame("milestones", milestones)
         if not milestones_df.empty:
             display_cols = ["nombre", "fecha", "estado"]
             available_cols = [col for col in display_cols if col in milestones_df.columns]
@@ -3719,7 +7576,7 @@ def view_client():
     
     docs = dm.get_docs()
     if docs:
-        recent_docs = pd.DataFrame(docs[:10])
+        recent_docs = dm.get_frame("docs", docs).head(10)
         display_cols = ["Archivo", "Versión", "Fecha", "Estado"]
         available_cols = [col for col in display_cols if col in recent_docs.columns]
         st.dataframe(
@@ -3751,6 +7608,154 @@ def view_client():
     
     st.info("💬 Para consultas urgentes, utiliza el chat o contacta directamente al equipo de obra.")
 
+def _projects_create_tab() -> None:
+    """Formulario de alta de proyecto"""
+    st.markdown("### Crear Nuevo Proyecto")
+    st.markdown("#### Información Básica")
+    with st.form("form_create_project", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            proj_name = st.text_input("Nombre del Proyecto *", placeholder="Ej: Edificio Residencial Altos del Parque", help="Nombre completo del proyecto")
+            proj_location = st.text_input("Ubicación *", placeholder="Ej: Av. Principal 1234, Santiago", help="Dirección completa del proyecto")
+            proj_start = st.date_input("Fecha de Inicio *", value=datetime.now().date(), help="Fecha planificada de inicio de obra")
+            proj_construction_type = st.selectbox("Tipo de Construcción *", 
+                ["Residencial", "Comercial", "Industrial", "Mixto", "Infraestructura", "Institucional", "Otro"],
+                help="Tipo principal de construcción")
+        with col2:
+            proj_budget = st.number_input("Presupuesto Total ($) *", min_value=0.0, value=0.0, step=1000.0, help="Presupuesto total del proyecto")
+            proj_status = st.selectbox("Estado", ["Activo", "En Planificación", "Pausado", "Completado"], help="Estado actual del proyecto")
+            proj_economic_range = st.selectbox("Rango Económico *",
+                ["Económico", "Medio", "Medio-Alto", "Alto", "Premium"],
+                help="Rango económico del proyecto")
+        
+        st.divider()
+        st.markdown("#### Dimensiones y Áreas")
+        col_area1, col_area2, col_area3 = st.columns(3)
+        with col_area1:
+            proj_total_area = st.number_input("Área Total (m²) *", min_value=0.0, value=0.0, step=1.0, help="Área total del terreno en metros cuadrados")
+        with col_area2:
+            proj_built_area = st.number_input("Área Construida (m²) *", min_value=0.0, value=0.0, step=1.0, help="Área total construida en metros cuadrados")
+        with col_area3:
+            proj_floors = st.number_input("Número de Pisos *", min_value=0, value=0, step=1, help="Cantidad de pisos del proyecto")
+        
+        col_units, col_parking = st.columns(2)
+        with col_units:
+            proj_units = st.number_input("Unidades/Viviendas", min_value=0, value=0, step=1, help="Número de unidades o viviendas (si aplica)")
+        with col_parking:
+            proj_parking = st.number_input("Estacionamientos", min_value=0, value=0, step=1, help="Número de estacionamientos")
+        
+        st.divider()
+        st.markdown("#### Condiciones de Construcción")
+        proj_conditions = st.text_area("Condiciones y Especificaciones Técnicas *", 
+            placeholder="Ej: Estructura de hormigón armado, muros de albañilería, techumbre de tejas, terminaciones estándar...", 
+            height=120,
+            help="Describe las condiciones de construcción, materiales principales, especificaciones técnicas relevantes")
+        
+        proj_description = st.text_area("Descripción General", placeholder="Descripción adicional del proyecto, objetivos, características especiales...", height=100)
+        
+        # Cálculo automático de métricas
+        if proj_total_area > 0 and proj_built_area > 0:
+            building_coefficient = (proj_built_area / proj_total_area * 100) if proj_total_area > 0 else 0
+            cost_per_m2 = (proj_budget / proj_built_area) if proj_built_area > 0 else 0
+            
+            st.info(f"""
+            **Métricas Calculadas:**
+            - Coeficiente de Construcción: {building_coefficient:.1f}%
+            - Costo por m² Construido: ${cost_per_m2:,.0f}
+            """)
+        
+        submitted = st.form_submit_button(f'{get_icon_symbol("add")} Crear Proyecto', type="primary", use_container_width=True)
+        
+        if submitted:
+            if proj_name and proj_location and proj_total_area > 0 and proj_built_area > 0:
+                project_id = dm.create_project(
+                    project_name=proj_name,
+                    description=proj_description,
+                    location=proj_location,
+                    start_date=proj_start,
+                    budget_total=proj_budget,
+                    total_area_m2=proj_total_area,
+                    built_area_m2=proj_built_area,
+                    economic_range=proj_economic_range,
+                    construction_type=proj_construction_type,
+                    floors=proj_floors,
+                    units=proj_units,
+                    parking_spaces=proj_parking,
+                    construction_conditions=proj_conditions
+                )
+                if project_id:
+                    st.success(f'✅ Proyecto "{proj_name}" creado correctamente')
+                    dm.set_current_project(project_id)
+                    st.rerun()
+            else:
+                st.error("⚠️ Completa todos los campos obligatorios (*): Nombre, Ubicación, Área Total, Área Construida")
+
+def _projects_list_tab(current_project_id: str | None) -> None:
+    """Proyectos existentes con su ficha y selección del proyecto actual"""
+    st.markdown("### Lista de Proyectos")
+    projects = dm.get_projects()
+    
+    if projects:
+        for project in projects:
+            is_current = project.get("id") == current_project_id
+            status_color = {
+                "Activo": "🟢",
+                "En Planificación": "🟡",
+                "Pausado": "🟠",
+                "Completado": "✅"
+            }.get(project.get("status", "Activo"), "🟢")
+            
+            with st.expander(f"{status_color} {project.get('name', 'Sin nombre')} - {project.get('status', 'Activo')} {'(Actual)' if is_current else ''}"):
+                col_info, col_actions = st.columns([3, 1])
+                with col_info:
+                    st.markdown("#### Información Básica")
+                    st.write(f"**Ubicación:** {project.get('location', 'N/A')}")
+                    st.write(f"**Fecha Inicio:** {project.get('start_date', 'N/A')}")
+                    st.write(f"**Presupuesto:** ${project.get('budget_total', 0):,.0f}")
+                    st.write(f"**Tipo de Construcción:** {project.get('construction_type', 'N/A')}")
+                    st.write(f"**Rango Económico:** {project.get('economic_range', 'N/A')}")
+                    
+                    st.divider()
+                    st.markdown("#### Dimensiones y Métricas")
+                    total_area = project.get('total_area_m2', 0)
+                    built_area = project.get('built_area_m2', 0)
+                    budget = project.get('budget_total', 0)
+                    
+                    col_metrics1, col_metrics2 = st.columns(2)
+                    with col_metrics1:
+                        st.metric("Área Total", f"{total_area:,.0f} m²")
+                        st.metric("Área Construida", f"{built_area:,.0f} m²")
+                        if total_area > 0:
+                            building_coeff = (built_area / total_area * 100)
+                            st.metric("Coef. Construcción", f"{building_coeff:.1f}%")
+                    with col_metrics2:
+                        st.metric("Pisos", project.get('floors', 0))
+                        st.metric("Unidades", project.get('units', 0))
+                        st.metric("Estacionamientos", project.get('parking_spaces', 0))
+                    
+                    if built_area > 0 and budget > 0:
+                        cost_per_m2 = budget / built_area
+                        st.metric("💰 Costo por m²", f"${cost_per_m2:,.0f}")
+                    
+                    if project.get('construction_conditions'):
+                        st.divider()
+                        st.markdown("#### Condiciones de Construcción")
+                        st.write(project.get('construction_conditions'))
+                    
+                    if project.get('description'):
+                        st.divider()
+                        st.markdown("#### Descripción")
+                        st.write(project.get('description'))
+                
+                with col_actions:
+                    if not is_current:
+                        if st.button(f"{get_icon_symbol('check')} Seleccionar", key=f"btn_select_project_{project['id']}", use_container_width=True):
+                            dm.set_current_project(project['id'])
+                            st.success(f"Proyecto '{project.get('name')}' seleccionado")
+                            st.rerun()
+    else:
+        st.info("No hay proyectos creados. Crea tu primer proyecto en la pestaña 'Crear Proyecto'")
+
 def view_projects():
     """Vista para gestionar proyectos"""
     render_header_with_icon("Gestión de Proyectos", "project")
@@ -3778,157 +7783,11 @@ def view_projects():
     
     st.divider()
     
-    # Tabs para crear y gestionar proyectos
-    tab_create, tab_list = st.tabs([
-        f"{get_icon_symbol('add')} Crear Proyecto",
-        f"{get_icon_symbol('project')} Mis Proyectos"
-    ])
-    
-    with tab_create:
-        st.markdown("### Crear Nuevo Proyecto")
-        st.markdown("#### Información Básica")
-        with st.form("form_create_project", clear_on_submit=True):
-            col1, col2 = st.columns(2)
-            with col1:
-                proj_name = st.text_input("Nombre del Proyecto *", placeholder="Ej: Edificio Residencial Altos del Parque", help="Nombre completo del proyecto")
-                proj_location = st.text_input("Ubicación *", placeholder="Ej: Av. Principal 1234, Santiago", help="Dirección completa del proyecto")
-                proj_start = st.date_input("Fecha de Inicio *", value=datetime.now().date(), help="Fecha planificada de inicio de obra")
-                proj_construction_type = st.selectbox("Tipo de Construcción *", 
-                    ["Residencial", "Comercial", "Industrial", "Mixto", "Infraestructura", "Institucional", "Otro"],
-                    help="Tipo principal de construcción")
-            with col2:
-                proj_budget = st.number_input("Presupuesto Total ($) *", min_value=0.0, value=0.0, step=1000.0, help="Presupuesto total del proyecto")
-                proj_status = st.selectbox("Estado", ["Activo", "En Planificación", "Pausado", "Completado"], help="Estado actual del proyecto")
-                proj_economic_range = st.selectbox("Rango Económico *",
-                    ["Económico", "Medio", "Medio-Alto", "Alto", "Premium"],
-                    help="Rango económico del proyecto")
-            
-            st.divider()
-            st.markdown("#### Dimensiones y Áreas")
-            col_area1, col_area2, col_area3 = st.columns(3)
-            with col_area1:
-                proj_total_area = st.number_input("Área Total (m²) *", min_value=0.0, value=0.0, step=1.0, help="Área total del terreno en metros cuadrados")
-            with col_area2:
-                proj_built_area = st.number_input("Área Construida (m²) *", min_value=0.0, value=0.0, step=1.0, help="Área total construida en metros cuadrados")
-            with col_area3:
-                proj_floors = st.number_input("Número de Pisos *", min_value=0, value=0, step=1, help="Cantidad de pisos del proyecto")
-            
-            col_units, col_parking = st.columns(2)
-            with col_units:
-                proj_units = st.number_input("Unidades/Viviendas", min_value=0, value=0, step=1, help="Número de unidades o viviendas (si aplica)")
-            with col_parking:
-                proj_parking = st.number_input("Estacionamientos", min_value=0, value=0, step=1, help="Número de estacionamientos")
-            
-            st.divider()
-            st.markdown("#### Condiciones de Construcción")
-            proj_conditions = st.text_area("Condiciones y Especificaciones Técnicas *", 
-                placeholder="Ej: Estructura de hormigón armado, muros de albañilería, techumbre de tejas, terminaciones estándar...", 
-                height=120,
-                help="Describe las condiciones de construcción, materiales principales, especificaciones técnicas relevantes")
-            
-            proj_description = st.text_area("Descripción General", placeholder="Descripción adicional del proyecto, objetivos, características especiales...", height=100)
-            
-            # Cálculo automático de métricas
-            if proj_total_area > 0 and proj_built_area > 0:
-                building_coefficient = (proj_built_area / proj_total_area * 100) if proj_total_area > 0 else 0
-                cost_per_m2 = (proj_budget / proj_built_area) if proj_built_area > 0 else 0
-                
-                st.info(f"""
-                **Métricas Calculadas:**
-                - Coeficiente de Construcción: {building_coefficient:.1f}%
-                - Costo por m² Construido: ${cost_per_m2:,.0f}
-                """)
-            
-            submitted = st.form_submit_button(f'{get_icon_symbol("add")} Crear Proyecto', type="primary", use_container_width=True)
-            
-            if submitted:
-                if proj_name and proj_location and proj_total_area > 0 and proj_built_area > 0:
-                    project_id = dm.create_project(
-                        project_name=proj_name,
-                        description=proj_description,
-                        location=proj_location,
-                        start_date=proj_start,
-                        budget_total=proj_budget,
-                        total_area_m2=proj_total_area,
-                        built_area_m2=proj_built_area,
-                        economic_range=proj_economic_range,
-                        construction_type=proj_construction_type,
-                        floors=proj_floors,
-                        units=proj_units,
-                        parking_spaces=proj_parking,
-                        construction_conditions=proj_conditions
-                    )
-                    if project_id:
-                        st.success(f'✅ Proyecto "{proj_name}" creado correctamente')
-                        dm.set_current_project(project_id)
-                        st.rerun()
-                else:
-                    st.error("⚠️ Completa todos los campos obligatorios (*): Nombre, Ubicación, Área Total, Área Construida")
-    
-    with tab_list:
-        st.markdown("### Lista de Proyectos")
-        projects = dm.get_projects()
-        
-        if projects:
-            for project in projects:
-                is_current = project.get("id") == current_project_id
-                status_color = {
-                    "Activo": "🟢",
-                    "En Planificación": "🟡",
-                    "Pausado": "🟠",
-                    "Completado": "✅"
-                }.get(project.get("status", "Activo"), "🟢")
-                
-                with st.expander(f"{status_color} {project.get('name', 'Sin nombre')} - {project.get('status', 'Activo')} {'(Actual)' if is_current else ''}"):
-                    col_info, col_actions = st.columns([3, 1])
-                    with col_info:
-                        st.markdown("#### Información Básica")
-                        st.write(f"**Ubicación:** {project.get('location', 'N/A')}")
-                        st.write(f"**Fecha Inicio:** {project.get('start_date', 'N/A')}")
-                        st.write(f"**Presupuesto:** ${project.get('budget_total', 0):,.0f}")
-                        st.write(f"**Tipo de Construcción:** {project.get('construction_type', 'N/A')}")
-                        st.write(f"**Rango Económico:** {project.get('economic_range', 'N/A')}")
-                        
-                        st.divider()
-                        st.markdown("#### Dimensiones y Métricas")
-                        total_area = project.get('total_area_m2', 0)
-                        built_area = project.get('built_area_m2', 0)
-                        budget = project.get('budget_total', 0)
-                        
-                        col_metrics1, col_metrics2 = st.columns(2)
-                        with col_metrics1:
-                            st.metric("Área Total", f"{total_area:,.0f} m²")
-                            st.metric("Área Construida", f"{built_area:,.0f} m²")
-                            if total_area > 0:
-                                building_coeff = (built_area / total_area * 100)
-                                st.metric("Coef. Construcción", f"{building_coeff:.1f}%")
-                        with col_metrics2:
-                            st.metric("Pisos", project.get('floors', 0))
-                            st.metric("Unidades", project.get('units', 0))
-                            st.metric("Estacionamientos", project.get('parking_spaces', 0))
-                        
-                        if built_area > 0 and budget > 0:
-                            cost_per_m2 = budget / built_area
-                            st.metric("💰 Costo por m²", f"${cost_per_m2:,.0f}")
-                        
-                        if project.get('construction_conditions'):
-                            st.divider()
-                            st.markdown("#### Condiciones de Construcción")
-                            st.write(project.get('construction_conditions'))
-                        
-                        if project.get('description'):
-                            st.divider()
-                            st.markdown("#### Descripción")
-                            st.write(project.get('description'))
-                    
-                    with col_actions:
-                        if not is_current:
-                            if st.button(f"{get_icon_symbol('check')} Seleccionar", key=f"btn_select_project_{project['id']}", use_container_width=True):
-                                dm.set_current_project(project['id'])
-                                st.success(f"Proyecto '{project.get('name')}' seleccionado")
-                                st.rerun()
-        else:
-            st.info("No hay proyectos creados. Crea tu primer proyecto en la pestaña 'Crear Proyecto'")
+    # Pestañas para crear y gestionar proyectos (solo se ejecuta la activa)
+    render_lazy_tabs("projects_tab", {
+        f"{get_icon_symbol('add')} Crear Proyecto": _projects_create_tab,
+        f"{get_icon_symbol('project')} Mis Proyectos": lambda: _projects_list_tab(current_project_id),
+    })
 
 def get_chat_response(user_message: str, user_role: str, user_name: str) -> str:
     """Genera una respuesta inteligente basada en el mensaje del usuario"""
@@ -4082,6 +7941,123 @@ def view_chat():
             })
             st.rerun()
 
+def view_performance():
+    render_header_with_icon("Rendimiento", "settings")
+    st.caption("Benchmarks internos para comparar rutas de código con datos sintéticos")
+    
+    st.markdown("#### Ingestión de archivos")
+    size_mb = st.select_slider("Tamaño del archivo de prueba (MB)", options=[5, 20, 50], value=20, key="bench_ingestion_size")
+    if st.button("Ejecutar benchmark de ingestión", key="btn_bench_ingestion"):
+        with st.spinner("Midiendo asignaciones de memoria..."):
+            st.session_state.bench_ingestion = benchmark_upload_ingestion(size_mb)
+    if "bench_ingestion" in st.session_state:
+        st.dataframe(st.session_state.bench_ingestion, use_container_width=True, hide_index=True)
+    
+    st.divider()
+    st.markdown("#### Compresión de fotos")
+    if PIL_AVAILABLE:
+        corpus_files = st.file_uploader(
+            "Fotos de obra para el benchmark (opcional)", type=['jpg', 'jpeg', 'png', 'webp'],
+            accept_multiple_files=True, key="bench_photo_corpus",
+            help="Si no se suben fotos se usan las guardadas localmente o una foto sintética de 12 MP",
+        )
+        if st.button("Ejecutar benchmark de compresión", key="btn_bench_compression"):
+            with st.spinner("Comprimiendo corpus..."):
+                corpus = [(f.name, f.getvalue()) for f in corpus_files or []] or load_photo_corpus()
+                if not corpus:
+                    corpus = [("sintética_12mp.jpg", synthetic_site_photo())]
+                st.session_state.bench_compression = benchmark_image_compression(corpus)
+                st.session_state.bench_batch = benchmark_batch_processing(corpus)
+        if "bench_compression" in st.session_state:
+            bench = st.session_state.bench_compression
+            summary = bench.groupby(["Motor", "Formato"], as_index=False)[["Tiempo (ms)", "Codificaciones", "Salida (KB)"]].mean().round(1)
+            st.caption("Promedio por motor y formato")
+            st.dataframe(summary, use_container_width=True, hide_index=True)
+            st.dataframe(bench, use_container_width=True, hide_index=True)
+        if "bench_batch" in st.session_state:
+            st.caption("Lote de fotos: serie vs pool de procesos")
+            st.dataframe(st.session_state.bench_batch, use_container_width=True, hide_index=True)
+    else:
+        st.info("Pillow no está instalado: el benchmark de compresión no está disponible")
+    
+    st.divider()
+    st.markdown("#### Ruta crítica")
+    if st.button("Ejecutar benchmark de ruta crítica", key="btn_bench_cpm"):
+        with st.spinner("Calculando redes sintéticas..."):
+            st.session_state.bench_cpm = benchmark_critical_path()
+    if "bench_cpm" in st.session_state:
+        st.dataframe(st.session_state.bench_cpm, use_container_width=True, hide_index=True)
+        st.caption("Incremental: promedio de cambios de duración de una actividad al azar")
+    
+    simulation_stats = get_simulation_service().stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Simulaciones Monte Carlo", simulation_stats["runs"], help=f"{simulation_stats['failed']} fallidas")
+    col2.metric("Tiempo promedio", f"{simulation_stats['avg_ms']:.0f} ms")
+    col3.metric("En caché / en curso", f"{simulation_stats['cached']} / {simulation_stats['running']}")
+    
+    st.divider()
+    st.markdown("#### Almacén de blobs")
+    blob_stats = dm.blobs.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Blobs únicos", blob_stats["blobs"])
+    col2.metric("Referencias", blob_stats["refs"])
+    col3.metric("Almacenado", f"{blob_stats['stored_bytes'] / (1024 * 1024):.1f} MB")
+    col4.metric("Ahorrado por deduplicación", f"{blob_stats['saved_bytes'] / (1024 * 1024):.1f} MB")
+    if st.button(f"Recolectar basura ({blob_stats['unreferenced']} sin referencias)", key="btn_blob_gc"):
+        gc_result = dm.blobs.collect_garbage()
+        st.success(f"{gc_result['removed']} archivos eliminados, {gc_result['freed_bytes'] / (1024 * 1024):.1f} MB liberados")
+    if st.button(f"Indexar fotos antiguas ({len(get_photo_index())} en el índice)", key="btn_photo_backfill"):
+        with st.spinner("Leyendo metadatos de fotos..."):
+            added = dm.backfill_photo_index()
+        st.success(f"{added} foto(s) agregadas al índice")
+    
+    st.divider()
+    st.markdown("#### Versiones de documentos")
+    version_stats = get_document_versions().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Documentos", version_stats["documents"])
+    col2.metric("Revisiones", version_stats["revisions"])
+    col3.metric("Tamaño lógico", f"{version_stats['logical_bytes'] / (1024 * 1024):.1f} MB")
+    col4.metric("Compresión", f"{version_stats['ratio']:.1f}x",
+                help=f"Fragmentos: {version_stats['chunk_bytes'] / (1024 * 1024):.1f} MB · "
+                     f"revisiones vigentes completas: {version_stats['full_bytes'] / (1024 * 1024):.1f} MB")
+    
+    st.divider()
+    st.markdown("#### Metadatos de planos")
+    meta_stats = get_plan_metadata_service().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Analizados", meta_stats["processed"], help=f"{meta_stats['cache_hits']} resueltos desde la caché por SHA-256")
+    col2.metric("Fallidos", meta_stats["failed"])
+    col3.metric("En cola", meta_stats["queued"])
+    col4.metric("Rendimiento", f"{meta_stats['mb_per_second']:.1f} MB/s", help=f"{meta_stats['avg_ms']:.0f} ms por plano en promedio")
+    if not PYPDF_AVAILABLE:
+        st.caption("pypdf no está instalado: las páginas de PDF se cuentan de forma aproximada")
+    if meta_stats["recent_failures"]:
+        st.dataframe(pd.DataFrame(meta_stats["recent_failures"]), use_container_width=True, hide_index=True)
+    
+    st.divider()
+    st.markdown("#### Caché de DataFrames")
+    frame_stats = get_frame_cache().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Tasa de aciertos", f"{frame_stats['hit_rate']:.0%}", help=f"{frame_stats['hits']} aciertos · {frame_stats['misses']} construcciones")
+    col2.metric("Entradas", frame_stats["entries"], help=", ".join(frame_stats["collections"]) or None)
+    col3.metric("Memoria", f"{frame_stats['memory_bytes'] / (1024 * 1024):.2f} MB", help=f"Límite {FRAME_CACHE_MAX_MB} MB · {frame_stats['evictions']} desalojos")
+    col4.metric("Tiempo de construcción", f"{frame_stats['build_ms']:.0f} ms", help="Acumulado de las construcciones (fallos)")
+    
+    st.divider()
+    st.markdown("#### Caché local de GCS")
+    cache_stats = dm.blob_cache.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Aciertos", cache_stats["hits"], help=f"{cache_stats['coalesced']} lecturas compartieron una descarga en curso")
+    col2.metric("Fallos", cache_stats["misses"], help=f"{cache_stats['errors']} descargas con error")
+    col3.metric("Tasa de aciertos", f"{cache_stats['hit_rate']:.0%}")
+    col4.metric("En caché", f"{cache_stats['cached_bytes'] / (1024 * 1024):.1f} / {cache_stats['max_bytes'] / (1024 * 1024):.0f} MB",
+                help=f"{cache_stats['entries']} objetos · {cache_stats['evictions']} desalojos LRU")
+    st.caption(f"Servido desde disco: {cache_stats['hit_bytes'] / (1024 * 1024):.1f} MB · "
+               f"descargado de GCS: {cache_stats['fetched_bytes'] / (1024 * 1024):.1f} MB")
+    if st.button("Vaciar caché", key="btn_blob_cache_clear"):
+        st.success(f"{dm.blob_cache.clear() / (1024 * 1024):.1f} MB liberados")
+
 # --- ROUTER PRINCIPAL ---
 
 if not st.session_state.authenticated:
@@ -4152,6 +8128,7 @@ else:
             
             # Mostrar tiempo de sesión restante
             st.divider()
+            render_sync_status()
             if 'last_activity' in st.session_state:
                 elapsed = datetime.now() - st.session_state.last_activity
                 remaining = SESSION_TIMEOUT_MINUTES - (elapsed.total_seconds() / 60)
@@ -4165,7 +8142,7 @@ else:
             menu_options = []
             
             if role == "ADMIN":
-                menu_options = ["Dashboard", "Proyectos", "Documentos", "Calidad", "Chat"]
+                menu_options = ["Dashboard", "Portafolio", "Proyectos", "Documentos", "Calidad", "Rendimiento", "Chat"]
             elif role == "WORKER":
                 menu_options = ["Mi Jornada", "Chat"]
             elif role == "CLIENT":
@@ -4176,9 +8153,11 @@ else:
         # Renderizar vista seleccionada
         if role == "ADMIN":
             if selected_page == "Dashboard": view_dashboard_admin()
+            elif selected_page == "Portafolio": view_portfolio()
             elif selected_page == "Proyectos": view_projects()
             elif selected_page == "Documentos": view_docs()
             elif selected_page == "Calidad": view_qa()
+            elif selected_page == "Rendimiento": view_performance()
             elif selected_page == "Chat": view_chat()
         elif role == "WORKER":
             if selected_page == "Mi Jornada": view_worker()
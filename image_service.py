@@ -0,0 +1,203 @@
+"""
+Procesamiento de imágenes (compresión, orientación EXIF, derivados y hash).
+
+Funciones puras sin dependencia de Streamlit: construction_app las ejecuta en un
+pool de procesos, cuyos workers importan este módulo (el script de Streamlit no
+se puede importar ni serializar desde otro proceso).
+"""
+import hashlib
+import logging
+import time
+from datetime import datetime
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageOps
+    from PIL.ExifTags import GPS, IFD, Base
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# --- CONSTANTES DE IMAGEN ---
+IMAGE_MAX_EDGE_PX = 1920  # Lado mayor de las fotos guardadas (suficiente para revisar detalles en pantalla)
+IMAGE_MIN_QUALITY = 20
+IMAGE_QUALITY_TOLERANCE = 4  # La búsqueda binaria se detiene cuando el rango de calidad es menor a esto
+PHOTO_VARIANTS = {"small": 320, "medium": 800}  # Derivados por lado mayor; "full" es el original
+PHOTO_VARIANT_QUALITY = 80
+WEBP_METHOD = 4  # Esfuerzo del codificador WebP (0 = rápido ... 6 = más compacto)
+DEFAULT_PHOTO_FORMAT = "webp"  # Formato de entrega; "jpeg" queda como respaldo para clientes sin WebP
+
+# Formatos de salida: calidad inicial equivalente (WebP 80 ≈ JPEG 85) y metadatos de entrega
+PHOTO_FORMATS = {
+    "jpeg": {"ext": ".jpg", "content_type": "image/jpeg", "quality": 85, "alpha": False},
+    "webp": {"ext": ".webp", "content_type": "image/webp", "quality": 80, "alpha": True},
+}
+
+# --- OPERACIONES ---
+
+def to_rgb(img):
+    """Convierte a RGB aplanando la transparencia sobre fondo blanco"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+def prepare_for_format(img, output_format: str):
+    """Modo de color para el formato: WebP conserva la transparencia, JPEG se aplana sobre blanco"""
+    if PHOTO_FORMATS[output_format]["alpha"] and (img.mode in ('RGBA', 'LA') or 'transparency' in img.info):
+        return img.convert('RGBA')
+    return to_rgb(img)
+
+def encode_image(img, output_format: str, quality: int) -> bytes:
+    """Codifica una imagen ya preparada en el formato indicado"""
+    output = BytesIO()
+    if output_format == "webp":
+        img.save(output, format='WEBP', quality=quality, method=WEBP_METHOD)
+    else:
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+def compress_image_with_stats(image_bytes: bytes, max_size_kb: int = 500, max_edge: int = IMAGE_MAX_EDGE_PX,
+                              output_format: str = "jpeg") -> tuple[bytes, dict]:
+    """Reduce la imagen a max_edge y busca por bisección la mayor calidad que cabe en max_size_kb.
+
+    En JPEG, draft() decodifica directamente a 1/2, 1/4 u 1/8 de resolución (escalado DCT)
+    y thumbnail() termina con reduce() + LANCZOS, así que nunca se codifica el cuadro
+    completo de la cámara. La orientación EXIF se aplica sobre la imagen ya reducida.
+    Retorna los bytes y estadísticas (codificaciones, tiempos, calidad).
+    """
+    start = time.perf_counter()
+    stats = {"format": output_format, "encodes": 0, "encode_ms": 0.0, "total_ms": 0.0, "quality": None,
+             "width": None, "height": None, "input_bytes": len(image_bytes), "output_bytes": len(image_bytes)}
+    if not PIL_AVAILABLE:
+        return image_bytes, stats
+
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        scale = max_edge / max(img.size)
+        if scale < 1:
+            target = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+            if img.format == 'JPEG':
+                img.draft('RGB', target)
+            img.thumbnail(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        img = prepare_for_format(ImageOps.exif_transpose(img), output_format)
+        stats["width"], stats["height"] = img.size
+        max_bytes = max_size_kb * 1024
+        default_quality = PHOTO_FORMATS[output_format]["quality"]
+
+        def encode(quality):
+            encode_start = time.perf_counter()
+            data = encode_image(img, output_format, quality)
+            stats["encodes"] += 1
+            stats["encode_ms"] += (time.perf_counter() - encode_start) * 1000
+            return data
+
+        # Camino rápido: tras reducir resolución, la calidad por defecto casi siempre cabe
+        best_quality = default_quality
+        best = encode(best_quality)
+        if len(best) > max_bytes:
+            low, high = IMAGE_MIN_QUALITY, default_quality - 1
+            best_quality = IMAGE_MIN_QUALITY
+            best = None
+            while high - low >= IMAGE_QUALITY_TOLERANCE:
+                quality = (low + high) // 2
+                candidate = encode(quality)
+                if len(candidate) <= max_bytes:
+                    best, best_quality = candidate, quality
+                    low = quality + 1
+                else:
+                    high = quality - 1
+            if best is None:
+                best = encode(IMAGE_MIN_QUALITY)
+
+        stats.update(quality=best_quality, output_bytes=len(best), total_ms=(time.perf_counter() - start) * 1000)
+        return best, stats
+    except Exception as e:
+        logger.error(f"Error comprimiendo imagen: {e}")
+        return image_bytes, stats
+
+def make_photo_variants(image_bytes: bytes, output_format: str = "jpeg") -> dict:
+    """Genera los derivados de PHOTO_VARIANTS en output_format (de mayor a menor, reutilizando cada reducción)"""
+    if not PIL_AVAILABLE:
+        return {}
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        largest = max(PHOTO_VARIANTS.values())
+        if img.format == 'JPEG':
+            img.draft('RGB', (largest, largest))
+        img = prepare_for_format(ImageOps.exif_transpose(img), output_format)
+        variants = {}
+        for name, edge in sorted(PHOTO_VARIANTS.items(), key=lambda item: -item[1]):
+            if max(img.size) > edge:
+                img.thumbnail((edge, edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            variants[name] = encode_image(img, output_format, PHOTO_VARIANT_QUALITY)
+        return variants
+    except Exception as e:
+        logger.error(f"Error generando derivados de imagen: {e}")
+        return {}
+
+def transcode_image(image_bytes: bytes, output_format: str) -> bytes:
+    """Convierte una imagen ya procesada a otro formato (respaldo para clientes sin WebP)"""
+    img = prepare_for_format(Image.open(BytesIO(image_bytes)), output_format)
+    return encode_image(img, output_format, PHOTO_FORMATS[output_format]["quality"])
+
+def _gps_to_degrees(value, ref) -> float | None:
+    """Convierte grados/minutos/segundos EXIF a grados decimales con signo"""
+    try:
+        degrees, minutes, seconds = (float(v) for v in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    result = degrees + minutes / 60 + seconds / 3600
+    return round(-result if ref in ("S", "W") else result, 6)
+
+def extract_photo_metadata(image_bytes: bytes) -> dict:
+    """Metadatos de captura desde el encabezado (sin decodificar píxeles): fecha EXIF, GPS, cámara y dimensiones"""
+    metadata = {"captured_at": None, "lat": None, "lon": None, "camera": None, "width": None, "height": None}
+    if not PIL_AVAILABLE:
+        return metadata
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        width, height = img.size
+        exif = img.getexif()
+        if exif.get(Base.Orientation) in (5, 6, 7, 8):
+            width, height = height, width  # La foto se guarda rotada según EXIF
+        metadata.update(width=width, height=height)
+
+        raw_time = exif.get_ifd(IFD.Exif).get(Base.DateTimeOriginal) or exif.get(Base.DateTime)
+        if raw_time:
+            try:
+                metadata["captured_at"] = datetime.strptime(str(raw_time).strip("\x00 "), "%Y:%m:%d %H:%M:%S").isoformat()
+            except ValueError:
+                pass
+        camera = " ".join(str(v).strip("\x00 ") for v in (exif.get(Base.Make), exif.get(Base.Model)) if v)
+        metadata["camera"] = camera or None
+
+        gps = exif.get_ifd(IFD.GPSInfo)
+        if GPS.GPSLatitude in gps and GPS.GPSLongitude in gps:
+            metadata["lat"] = _gps_to_degrees(gps[GPS.GPSLatitude], gps.get(GPS.GPSLatitudeRef))
+            metadata["lon"] = _gps_to_degrees(gps[GPS.GPSLongitude], gps.get(GPS.GPSLongitudeRef))
+    except Exception as e:
+        logger.warning(f"Error leyendo metadatos de imagen: {e}")
+    return metadata
+
+def process_photo(image_bytes: bytes, max_size_kb: int = 500, output_format: str = DEFAULT_PHOTO_FORMAT) -> dict:
+    """Pipeline completo de una foto: metadatos, orientación EXIF + compresión, derivados y SHA-256"""
+    metadata = extract_photo_metadata(image_bytes)  # Antes de comprimir: la salida no conserva EXIF
+    compressed, stats = compress_image_with_stats(image_bytes, max_size_kb, output_format=output_format)
+    if stats["quality"] is None:
+        output_format = None  # Sin PIL (o imagen ilegible) se guarda tal cual, en su formato original
+    return {
+        "data": compressed,
+        "sha256": hashlib.sha256(compressed).hexdigest(),
+        "format": output_format,
+        "variants": make_photo_variants(compressed, output_format) if output_format else {},
+        "metadata": metadata,
+        "stats": stats,
+    }
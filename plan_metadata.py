@@ -0,0 +1,163 @@
+"""
+Extracción de metadatos de planos (DXF, PDF y DWG) sin dependencia de Streamlit.
+
+Igual que image_service, construction_app ejecuta estas funciones en el pool de
+procesos: el análisis de un DXF de varios MB es CPU puro y no debe competir con la
+sesión por el GIL.
+"""
+import logging
+import re
+from collections import Counter
+from io import BytesIO
+
+try:
+    from pypdf import PdfReader
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# --- CONSTANTES DE PLANOS ---
+ACAD_VERSIONS = {
+    "AC1009": "R12", "AC1012": "R13", "AC1014": "R14", "AC1015": "AutoCAD 2000", "AC1018": "AutoCAD 2004",
+    "AC1021": "AutoCAD 2007", "AC1024": "AutoCAD 2010", "AC1027": "AutoCAD 2013", "AC1032": "AutoCAD 2018",
+}
+DXF_UNITS = {0: None, 1: "pulgadas", 2: "pies", 4: "mm", 5: "cm", 6: "m"}
+PAPER_SIZES_MM = {"A0": (841, 1189), "A1": (594, 841), "A2": (420, 594), "A3": (297, 420), "A4": (210, 297), "Carta": (216, 279)}
+PAPER_TOLERANCE = 0.02
+MAX_LAYER_NAMES = 100  # Nombres guardados en el resumen (el conteo siempre es completo)
+TOP_ENTITY_TYPES = 15
+
+# --- EXTRACCIÓN ---
+
+def paper_size_name(width_pt: float, height_pt: float) -> str:
+    """Formato de papel (A0...A4, Carta) de una página en puntos PDF, o sus medidas en mm"""
+    short, long = sorted((width_pt * 25.4 / 72, height_pt * 25.4 / 72))
+    for name, (paper_short, paper_long) in PAPER_SIZES_MM.items():
+        if abs(short - paper_short) <= paper_short * PAPER_TOLERANCE and abs(long - paper_long) <= paper_long * PAPER_TOLERANCE:
+            return name
+    return f"{short:.0f}x{long:.0f} mm"
+
+def _parse_dxf(data: bytes) -> dict:
+    """DXF ASCII: versión, unidades y extensión (HEADER), capas (TABLES) y entidades por tipo y capa (ENTITIES).
+
+    Se recorre por pares código/valor leyendo línea a línea, sin cargar el texto completo en memoria.
+    """
+    if data.startswith(b"AutoCAD Binary DXF"):
+        return {"kind": "dxf", "format_version": "DXF binario", "parser": "dxf"}
+    stream = BytesIO(data)
+    section = None
+    expect_section_name = False
+    header_var = None
+    entry = None
+    entity_layer_seen = False
+    header = {}
+    extents = {}
+    layers = set()
+    entity_types = Counter()
+    entity_layers = Counter()
+
+    for raw_code in stream:
+        code = raw_code.strip()
+        value = stream.readline().strip()
+        if code == b"0":
+            entry = value
+            entity_layer_seen = False
+            if value == b"SECTION":
+                expect_section_name = True
+            elif value == b"ENDSEC":
+                section = None
+            elif value == b"EOF":
+                break
+            elif section == b"ENTITIES":
+                entity_types[value.decode("ascii", "replace")] += 1
+            continue
+        if expect_section_name and code == b"2":
+            section = value
+            expect_section_name = False
+        elif section == b"HEADER":
+            if code == b"9":
+                header_var = value
+            elif header_var == b"$ACADVER" and code == b"1":
+                header["version"] = value.decode("ascii", "replace")
+            elif header_var == b"$INSUNITS" and code == b"70":
+                header["units"] = int(value or 0)
+            elif header_var in (b"$EXTMIN", b"$EXTMAX") and code in (b"10", b"20"):
+                extents.setdefault(header_var.decode(), {})[code.decode()] = round(float(value), 3)
+        elif section == b"TABLES" and entry == b"LAYER" and code == b"2":
+            layers.add(value.decode("utf-8", "replace"))
+            entry = None  # Solo el primer código 2 de la entrada es el nombre
+        elif section == b"ENTITIES" and code == b"8" and not entity_layer_seen:
+            entity_layers[value.decode("utf-8", "replace")] += 1
+            entity_layer_seen = True
+
+    layers.update(entity_layers)  # Capas usadas por entidades aunque falte la tabla
+    metadata = {
+        "kind": "dxf",
+        "format_version": ACAD_VERSIONS.get(header.get("version"), header.get("version")),
+        "units": DXF_UNITS.get(header.get("units")),
+        "layers": len(layers),
+        "layer_names": sorted(layers)[:MAX_LAYER_NAMES],
+        "entities": sum(entity_types.values()),
+        "entity_types": dict(entity_types.most_common(TOP_ENTITY_TYPES)),
+        "entities_by_layer": dict(entity_layers.most_common(TOP_ENTITY_TYPES)),
+        "parser": "dxf",
+    }
+    if "$EXTMIN" in extents and "$EXTMAX" in extents:
+        metadata["extents"] = [[extents["$EXTMIN"].get("10"), extents["$EXTMIN"].get("20")],
+                               [extents["$EXTMAX"].get("10"), extents["$EXTMAX"].get("20")]]
+    return metadata
+
+def _parse_pdf(data: bytes) -> dict:
+    """PDF: número de páginas y formatos de papel (pypdf si está instalado; si no, búsqueda de objetos /Page)"""
+    if PYPDF_AVAILABLE:
+        reader = PdfReader(BytesIO(data))
+        sizes = Counter(paper_size_name(float(page.mediabox.width), float(page.mediabox.height)) for page in reader.pages)
+        info = reader.metadata or {}
+        return {
+            "kind": "pdf",
+            "pages": len(reader.pages),
+            "page_sizes": dict(sizes),
+            "title": info.get("/Title") or None,
+            "producer": info.get("/Producer") or None,
+            "parser": "pypdf",
+        }
+
+    # Respaldo sin dependencias: no ve páginas dentro de flujos de objetos comprimidos
+    pages = len(re.findall(rb"/Type\s*/Page(?![A-Za-z])", data))
+    if pages == 0:
+        counts = [int(c) for c in re.findall(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)", data)]
+        pages = max(counts, default=0)
+    boxes = re.findall(rb"/MediaBox\s*\[\s*([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s*\]", data)
+    sizes = Counter(paper_size_name(abs(float(x1) - float(x0)), abs(float(y1) - float(y0))) for x0, y0, x1, y1 in boxes)
+    return {"kind": "pdf", "pages": pages or None, "page_sizes": dict(sizes), "parser": "regex"}
+
+def _parse_dwg(data: bytes) -> dict:
+    """DWG es un formato cerrado: solo se lee la versión del encabezado"""
+    version = data[:6].decode("ascii", "replace")
+    return {"kind": "dwg", "format_version": ACAD_VERSIONS.get(version, version), "parser": "dwg"}
+
+def extract_plan_metadata(data: bytes, ext: str) -> dict:
+    """Resumen de metadatos de un plano según su extensión (.dxf, .pdf, .dwg/.dwgx)"""
+    ext = ext.lower()
+    if ext == ".dxf":
+        return _parse_dxf(data)
+    if ext == ".pdf":
+        return _parse_pdf(data)
+    if ext in (".dwg", ".dwgx"):
+        return _parse_dwg(data)
+    raise ValueError(f"Tipo de plano no soportado: {ext}")
+
+def summarize_plan_metadata(metadata: dict | None) -> str:
+    """Texto corto para tablas: capas y entidades (DXF), páginas y formatos (PDF) o versión (DWG)"""
+    if not metadata:
+        return ""
+    if metadata["kind"] == "pdf":
+        sizes = ", ".join(f"{name}×{count}" if count > 1 else name for name, count in metadata.get("page_sizes", {}).items())
+        pages = metadata.get("pages")
+        return " · ".join(p for p in [f"{pages} págs" if pages else None, sizes or None] if p)
+    if metadata["kind"] == "dxf" and "layers" in metadata:
+        parts = [f"{metadata['layers']} capas", f"{metadata['entities']:,} entidades".replace(",", "."), metadata.get("units")]
+        return " · ".join(p for p in parts if p)
+    return metadata.get("format_version") or ""
@@ -0,0 +1,52 @@
+"""Agrupación de revisiones por documento lógico (document_id)."""
+import importlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    """Importa construction_app en modo script (sin servidor) con data/ y uploads/ en un directorio temporal"""
+    workdir = tmp_path_factory.mktemp("app")
+    cwd = os.getcwd()
+    sys.path.insert(0, str(ROOT))
+    os.chdir(workdir)
+    try:
+        yield importlib.import_module("construction_app")
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(str(ROOT))
+
+
+@pytest.mark.parametrize("first, second", [
+    ("Planta Sector 3.pdf", "Planta Sector 4.pdf"),
+    ("Floor3.pdf", "Floor4.pdf"),
+    ("Corte R1.dwg", "Corte R2.dwg"),
+    ("Plano.pdf", "Plano.dwg"),
+])
+def test_distinct_documents_get_distinct_ids(app, first, second):
+    assert app.document_id("p1", first) != app.document_id("p1", second)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("Planta_v1.pdf", "Planta_v2.pdf"),
+    ("Planta v1.2.pdf", "Planta V2_0.pdf"),
+    ("Planta-rev3.pdf", "Planta Rev.4.pdf"),
+    ("Planta.pdf", "Planta_v2.pdf"),
+    ("Planta (1).pdf", "Planta.pdf"),
+])
+def test_revisions_share_the_document_id(app, first, second):
+    assert app.document_id("p1", first) == app.document_id("p1", second)
+
+
+def test_id_depends_on_project(app):
+    assert app.document_id("p1", "Planta_v1.pdf") != app.document_id("p2", "Planta_v1.pdf")
+
+
+def test_bare_version_name_keeps_its_stem(app):
+    assert app.document_id("p1", "v2.pdf") != app.document_id("p1", "v3.pdf")